@@ -0,0 +1,54 @@
+"""Microbenchmark of the memory allocated and the time spent per `skarv.put`.
+
+Run with `python benchmarks/put_allocations.py`.
+"""
+
+import time
+import tracemalloc
+
+import skarv
+
+N = 20_000
+
+
+def _measure(key: str) -> dict:
+    # Warm up the match caches and the vault entry
+    for value in range(1000):
+        skarv.put(key, value)
+
+    start = time.perf_counter()
+    for value in range(N):
+        skarv.put(key, value)
+    elapsed = time.perf_counter() - start
+
+    # Transient bytes allocated by a single put, averaged over many puts
+    allocated = 0
+    tracemalloc.start()
+    for value in range(N // 10):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        skarv.put(key, value)
+        allocated += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    return {
+        "ns_per_put": elapsed / N * 1e9,
+        "bytes_per_put": allocated / (N // 10),
+    }
+
+
+def main():
+    results = {"no_subscribers": _measure("bench/quiet")}
+
+    skarv.subscribe("bench/busy")(lambda sample: None)
+    results["one_subscriber"] = _measure("bench/busy")
+
+    for name, result in results.items():
+        print(
+            f"{name:>16}: {result['ns_per_put']:8.0f} ns/put"
+            f" {result['bytes_per_put']:8.0f} bytes/put"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""Benchmark suite for the skarv hot path.
+
+Measures how `put`, `get`, the match caches and the middlewares scale with the number of
+keys, subscribers, wildcard depth and producer threads.
+
+Usage:
+    python benchmarks/run.py [--filter SUBSTRING] [--output results.json]
+                             [--compare baseline.json] [--threshold 0.2]
+
+Results are saved as JSON, keyed on the benchmark name, so that runs of different
+releases can be compared with `--compare`.
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import threading
+from typing import Callable, Dict, List
+
+import skarv
+from skarv import middlewares
+
+BENCHMARKS: Dict[str, Callable[[], dict]] = {}
+
+
+def benchmark(name: str):
+    """Register a benchmark under a unique name."""
+
+    def decorator(func: Callable[[], dict]) -> Callable[[], dict]:
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def reset():
+    """Reset the global skarv state between benchmarks."""
+    skarv._default.clear()
+
+
+def timed(op: Callable[[], None], number: int, repeat: int = 5) -> dict:
+    """Time `number` calls of `op`, `repeat` times, reporting nanoseconds per call."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            op()
+        timings.append((time.perf_counter() - start) / number * 1e9)
+
+    return {
+        "unit": "ns/op",
+        "min": min(timings),
+        "median": statistics.median(timings),
+    }
+
+
+def _keys(count: int, depth: int = 4) -> List[str]:
+    return [
+        "/".join(["fleet", str(ix % 97), "sensor", str(ix)][:depth])
+        for ix in range(count)
+    ]
+
+
+def _cycle(keys: List[str], func: Callable[[str], None]) -> Callable[[], None]:
+    state = {"ix": 0}
+
+    def op():
+        ix = state["ix"]
+        func(keys[ix])
+        state["ix"] = (ix + 1) % len(keys)
+
+    return op
+
+
+for _count in (1, 1_000, 100_000):
+
+    @benchmark(f"put/keys={_count}")
+    def _put_keys(count=_count):
+        keys = _keys(count)
+        for key in keys:
+            skarv.put(key, 0)
+        return timed(_cycle(keys, lambda key: skarv.put(key, 1)), 20_000)
+
+
+for _count in (0, 10, 1_000):
+
+    @benchmark(f"put/subscribers={_count}")
+    def _put_subscribers(count=_count):
+        # One matching subscriber per key expression, all others never match
+        skarv.subscribe("fleet/**")(lambda sample: None)
+        for ix in range(count):
+            skarv.subscribe(f"other/{ix}/**")(lambda sample: None)
+        keys = _keys(1_000)
+        return timed(_cycle(keys, lambda key: skarv.put(key, 1)), 20_000)
+
+
+for _count in (10, 1_000):
+
+    @benchmark(f"put/cache_miss/subscribers={_count}")
+    def _put_cache_miss(count=_count):
+        for ix in range(count):
+            skarv.subscribe(f"fleet/{ix}/**")(lambda sample: None)
+        skarv.configure_match_cache(1)
+        try:
+            keys = _keys(1_000)
+            return timed(_cycle(keys, lambda key: skarv.put(key, 1)), 5_000)
+        finally:
+            skarv.configure_match_cache(skarv._index.DEFAULT_CACHE_SIZE)
+
+
+@benchmark("subscribe_close/cached_keys=4096")
+def _subscribe_close():
+    # A full match cache, of which each registration affects a single entry
+    skarv.subscribe("other")(lambda sample: None)
+    keys = _keys(skarv._index.DEFAULT_CACHE_SIZE)
+    for key in keys:
+        skarv.put(key, 0)
+
+    def op(key: str):
+        with skarv.subscribe(key) as subscription:
+            subscription(lambda sample: None)
+
+    return timed(_cycle(keys, op), 500)
+
+
+for _depth in (1, 4, 8):
+
+    @benchmark(f"put/wildcard_depth={_depth}")
+    def _put_wildcard_depth(depth=_depth):
+        pattern = "/".join(["*"] * (depth - 1) + ["**"])
+        skarv.subscribe(pattern)(lambda sample: None)
+        skarv.configure_match_cache(1)
+        try:
+            keys = [
+                "/".join(f"c{ix}{level}" for level in range(depth)) for ix in range(100)
+            ]
+            return timed(_cycle(keys, lambda key: skarv.put(key, 1)), 5_000)
+        finally:
+            skarv.configure_match_cache(skarv._index.DEFAULT_CACHE_SIZE)
+
+
+@benchmark("put_many/size=100")
+def _put_many():
+    items = {key: 1 for key in _keys(100)}
+    result = timed(lambda: skarv.put_many(items), 500)
+    result["per_item"] = result["median"] / len(items)
+    return result
+
+
+for _threads in (1, 4, 12):
+    for _shards in (1, 16):
+
+        @benchmark(f"put/threads={_threads}/shards={_shards}")
+        def _put_threads(threads=_threads, shards=_shards):
+            broker = skarv.Broker(shards=shards)
+            per_thread = 20_000
+            barrier = threading.Barrier(threads + 1)
+
+            def producer(ix: int):
+                keys = [f"thread{ix}/{key}" for key in range(100)]
+                barrier.wait()
+                for value in range(per_thread):
+                    broker.put(keys[value % 100], value)
+
+            workers = [
+                threading.Thread(target=producer, args=(ix,)) for ix in range(threads)
+            ]
+            for worker in workers:
+                worker.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+            return {"unit": "puts/s", "median": threads * per_thread / elapsed}
+
+
+for _count in (1_000, 100_000):
+
+    @benchmark(f"get/exact/keys={_count}")
+    def _get_exact(count=_count):
+        keys = _keys(count)
+        for key in keys:
+            skarv.put(key, 0)
+        return timed(_cycle(keys, skarv.get), 20_000)
+
+    @benchmark(f"get/wildcard_subtree/keys={_count}")
+    def _get_subtree(count=_count):
+        for key in _keys(count):
+            skarv.put(key, 0)
+        patterns = [f"fleet/{ix}/**" for ix in range(97)]
+        return timed(_cycle(patterns, skarv.get), 200)
+
+    @benchmark(f"get/wildcard_all/keys={_count}")
+    def _get_all(count=_count):
+        for key in _keys(count):
+            skarv.put(key, 0)
+        return timed(lambda: skarv.get("fleet/**"), 5, repeat=3)
+
+
+@benchmark("latency/inline")
+def _latency_inline():
+    latencies = []
+
+    @skarv.subscribe("latency")
+    def _(sample: skarv.Sample):
+        latencies.append(time.monotonic() - sample.monotonic)
+
+    for value in range(10_000):
+        skarv.put("latency", value)
+
+    return _percentiles(latencies)
+
+
+@benchmark("latency/thread_executor")
+def _latency_thread():
+    latencies = []
+    done = threading.Event()
+
+    @skarv.subscribe("latency", executor="thread")
+    def _(sample: skarv.Sample):
+        latencies.append(time.monotonic() - sample.monotonic)
+        if len(latencies) == 10_000:
+            done.set()
+
+    for value in range(10_000):
+        skarv.put("latency", value)
+    done.wait(60)
+
+    return _percentiles(latencies)
+
+
+def _percentiles(latencies: List[float]) -> dict:
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "unit": "us",
+        "median": quantiles[49] * 1e6,
+        "p99": quantiles[98] * 1e6,
+    }
+
+
+_MIDDLEWARES = {
+    "throttle": lambda: middlewares.throttle(0.001),
+    "average": lambda: middlewares.average(1000),
+    "weighted_average": lambda: middlewares.weighted_average(1000),
+    "variance": lambda: middlewares.variance(1000),
+    "exponential_moving_average": lambda: middlewares.exponential_moving_average(0.1),
+    "rolling_max": lambda: middlewares.rolling_max(1000),
+    "median": lambda: middlewares.median(1000),
+    "differentiate": middlewares.differentiate,
+    "batch": lambda: middlewares.batch(1000),
+}
+
+for _name, _factory in _MIDDLEWARES.items():
+
+    @benchmark(f"middleware/{_name}")
+    def _middleware(factory=_factory):
+        operator = factory()
+        values = iter(range(10**9))
+        return timed(lambda: operator(next(values)), 20_000)
+
+    @benchmark(f"put/middleware/{_name}")
+    def _put_middleware(factory=_factory):
+        skarv.register_middleware("mw", factory())
+        values = iter(range(10**9))
+        return timed(lambda: skarv.put("mw", next(values)), 20_000)
+
+
+@benchmark("put/middleware/chain")
+def _put_middleware_chain():
+    skarv.register_middleware("mw", middlewares.throttle(0.0))
+    skarv.register_middleware("mw", middlewares.average(10))
+    skarv.register_middleware("mw", middlewares.differentiate())
+    values = iter(range(10**9))
+    return timed(lambda: skarv.put("mw", next(values)), 20_000)
+
+
+@benchmark("put/cache_miss/middleware_chain")
+def _put_cache_miss_middleware_chain():
+    for _ in range(3):
+        skarv.register_middleware("fleet/**", lambda value: value)
+    skarv.configure_match_cache(1)
+    try:
+        keys = _keys(1_000)
+        return timed(_cycle(keys, lambda key: skarv.put(key, 1)), 5_000)
+    finally:
+        skarv.configure_match_cache(skarv._index.DEFAULT_CACHE_SIZE)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """List the benchmarks that regressed by more than `threshold` against a baseline."""
+    regressions = []
+    for name, result in results.items():
+        if (reference := baseline.get(name)) is None:
+            continue
+
+        ratio = result["median"] / reference["median"]
+        # Throughputs regress when they go down, timings when they go up
+        if result["unit"] == "puts/s":
+            ratio = 1 / ratio
+
+        print(f"{name:<40} {ratio:6.2f}x")
+        if ratio > 1 + threshold:
+            regressions.append(name)
+
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filter", default="", help="only run matching benchmarks")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument(
+        "--compare", help="compare against a previous JSON results file"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative slowdown reported as a regression (default: 0.2)",
+    )
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+
+        reset()
+        try:
+            results[name] = func()
+        finally:
+            reset()
+
+        extras = {key: value for key, value in results[name].items() if key != "unit"}
+        print(
+            f"{name:<40} "
+            + " ".join(f"{key}={value:,.1f}" for key, value in extras.items())
+            + f" [{results[name]['unit']}]"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "timestamp": time.time(),
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        if regressions := compare(results, baseline, args.threshold):
+            print(f"Regressions: {', '.join(regressions)}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
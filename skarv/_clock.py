@@ -0,0 +1,50 @@
+import time
+import functools
+from contextvars import ContextVar
+from typing import Any, Callable, Optional, Tuple
+
+# The monotonic time at which the value currently being processed was put
+_put_time: ContextVar[Optional[float]] = ContextVar("skarv_put_time", default=None)
+
+# How to resume the put being processed:
+# (resume, key expression, pipeline, source timestamp)
+_put_resume: ContextVar[Optional[Tuple[Callable, Any, Any, Optional[float]]]] = (
+    ContextVar("skarv_put_resume", default=None)
+)
+
+
+def now() -> float:
+    """Get the monotonic time of the value being processed.
+
+    Within middlewares invoked by `put`, this is the monotonic timestamp stamped on the
+    sample, so that all middlewares of a pipeline agree on a single time unaffected by
+    processing delays. Elsewhere, it is the current monotonic time.
+
+    Returns:
+        float: A monotonic time in seconds.
+    """
+    if (put_time := _put_time.get()) is None:
+        return time.monotonic()
+    return put_time
+
+
+def resumer(operator: Callable[[Any], Any]) -> Optional[Callable[[Any], None]]:
+    """Get a function to publish a value later, as if a middleware had returned it now.
+
+    Within a middleware invoked by `put`, the returned function passes a value through
+    the middlewares following `operator` in the pipeline of the key being put, then stores
+    and publishes it with the source timestamp of that put. This lets middlewares that
+    hold values back, such as `batch`, release them later from a timer.
+
+    Args:
+        operator (Callable[[Any], Any]): The middleware operator asking, as registered.
+
+    Returns:
+        Optional[Callable[[Any], None]]: The function to call with the value, None outside of
+            a put.
+    """
+    if (context := _put_resume.get()) is None:
+        return None
+
+    resume, key_expr, pipeline, source_timestamp = context
+    return functools.partial(resume, key_expr, pipeline, source_timestamp, operator)
@@ -0,0 +1,395 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Hashable, Optional, Tuple
+
+from .concurrency import _in_thread_pool, get_background_loop, get_thread_pool
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ("thread", "loop")
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest", "latest")
+
+
+class BoundedQueue:
+    """A thread-safe FIFO queue with a maximum size and an overflow policy.
+
+    When the queue is full, the overflow policy decides what happens to a new item:
+
+    * `block`: the caller waits until there is room in the queue.
+    * `drop_oldest`: the oldest queued item is discarded.
+    * `drop_newest`: the new item is discarded.
+    * `latest`: the most recently queued item is replaced by the new one.
+
+    Args:
+        maxsize (int): Maximum number of queued items.
+        overflow (str): The overflow policy.
+    """
+
+    def __init__(self, maxsize: int = 1024, overflow: str = "block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}"
+            )
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+
+        self._items: Deque[Any] = deque()
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, item: Any, may_block: bool = True) -> bool:
+        """Add an item to the queue, applying the overflow policy if full.
+
+        Args:
+            item (Any): The item to add.
+            may_block (bool, optional): If False, the `block` policy lets the queue grow past
+                its bound instead of waiting, e.g. when the caller is the consumer itself.
+                Defaults to True.
+
+        Returns:
+            bool: Whether the queue was empty before the item was added.
+        """
+        with self._condition:
+            if self.closed:
+                self.dropped += 1
+                return False
+
+            if self._replace(item):
+                self.dropped += 1
+                return False
+
+            if len(self._items) >= self.maxsize:
+                if self.overflow == "block":
+                    if may_block:
+                        self._condition.wait_for(
+                            lambda: self.closed or len(self._items) < self.maxsize
+                        )
+                        if self.closed:
+                            self.dropped += 1
+                            return False
+                elif self.overflow == "drop_oldest":
+                    self._pop(oldest=True)
+                    self.dropped += 1
+                elif self.overflow == "latest":
+                    self._pop(oldest=False)
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return False
+
+            self._append(item)
+            return len(self._items) == 1
+
+    def get(self, default: Any = None) -> Any:
+        """Remove and return the oldest item, without waiting.
+
+        Args:
+            default (Any, optional): Returned if the queue is empty. Defaults to None.
+
+        Returns:
+            Any: The oldest item, or `default`.
+        """
+        with self._condition:
+            if not self._items:
+                return default
+            item = self._pop(oldest=True)
+            self._condition.notify()
+            return item
+
+    def close(self):
+        """Refuse new items, releasing the callers waiting for room. Queued items remain."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def _replace(self, item: Any) -> bool:
+        return False
+
+    def _append(self, item: Any):
+        self._items.append(item)
+
+    def _pop(self, oldest: bool) -> Any:
+        return self._items.popleft() if oldest else self._items.pop()
+
+
+class ConflatingQueue(BoundedQueue):
+    """A `BoundedQueue` holding at most one pending item per key.
+
+    An item whose key is already pending replaces the pending item in place, keeping its
+    position in the queue, and the replaced item counts as dropped. The maximum size and
+    the overflow policy apply to the number of distinct pending keys.
+
+    Args:
+        maxsize (int): Maximum number of queued items.
+        overflow (str): The overflow policy.
+        key (Callable[[Any], Hashable]): Gives the key of an item.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        overflow: str = "block",
+        key: Callable[[Any], Hashable] = id,
+    ):
+        super().__init__(maxsize, overflow)
+        self.key = key
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def _replace(self, item: Any) -> bool:
+        if (key := self.key(item)) not in self._items:
+            return False
+        self._items[key] = item
+        return True
+
+    def _append(self, item: Any):
+        self._items[self.key(item)] = item
+
+    def _pop(self, oldest: bool) -> Any:
+        return self._items.popitem(last=not oldest)[1]
+
+
+class Dispatcher:
+    """Deliver calls to a callback off the calling thread, through a bounded queue.
+
+    Calls are queued and drained in order by a single job at a time, either on the shared
+    worker thread pool (`executor="thread"`) or on the background event loop
+    (`executor="loop"`), so a slow callback never stalls the publisher. When the queue is
+    full, the overflow policy of the `BoundedQueue` applies, except that the `block` policy
+    never blocks the threads draining the queues: a call made from a worker of the pool,
+    or from the background event loop for the `loop` executor, lets the queue grow past
+    its bound instead, since the job draining it may be waiting for that very thread. With a `key`, pending calls
+    with equal keys are conflated into the latest one, see `ConflatingQueue`.
+
+    Args:
+        callback (Callable): The callback to deliver calls to.
+        executor (str): Where to run the callback, `thread` or `loop`.
+        queue_size (int): Maximum number of pending calls.
+        overflow (str): The overflow policy.
+        key (Optional[Callable[[Tuple[Any, ...]], Hashable]], optional): Gives the
+            conflation key of the arguments of a call, None to deliver every call.
+            Defaults to None.
+    """
+
+    def __init__(
+        self,
+        callback: Callable,
+        executor: str = "thread",
+        queue_size: int = 1024,
+        overflow: str = "block",
+        key: Optional[Callable[[Tuple[Any, ...]], Hashable]] = None,
+    ):
+        if executor not in EXECUTORS:
+            raise ValueError(
+                f"Unknown executor {executor!r}, expected one of {EXECUTORS}"
+            )
+
+        self.callback = callback
+        self.executor = executor
+        self.queue = (
+            BoundedQueue(queue_size, overflow)
+            if key is None
+            else ConflatingQueue(queue_size, overflow, key)
+        )
+
+        self._lock = threading.Lock()
+        self._scheduled = False
+
+    def __call__(self, *args: Any):
+        # Blocking a thread the queue needs to be drained would deadlock
+        self.queue.put(args, may_block=not self._drains_here())
+
+        with self._lock:
+            if not self._scheduled:
+                self._scheduled = True
+                self._schedule()
+
+    def _drains_here(self) -> bool:
+        if self.executor == "loop":
+            # Any callback of the loop holds it, not only a running drain
+            try:
+                return asyncio.get_running_loop() is get_background_loop()
+            except RuntimeError:
+                return False
+        # Any worker of the pool, when all of them are blocked the drain never runs
+        return _in_thread_pool()
+
+    def _schedule(self):
+        if self.executor == "thread":
+            get_thread_pool().submit(self._drain)
+        else:
+            get_background_loop().call_soon_threadsafe(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                args: Optional[Tuple[Any, ...]] = self.queue.get()
+                if args is None:
+                    self._scheduled = False
+                    return
+
+            try:
+                self.callback(*args)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(f"Exception in dispatched callback {self.callback}")
+
+
+def _log_exception(future: "asyncio.Future"):
+    if not future.cancelled() and (exc := future.exception()) is not None:
+        logger.error("Exception in coroutine callback", exc_info=exc)
+
+
+class CoroutineCallback:
+    """Schedule a coroutine function on an event loop each time it is called.
+
+    When called from the thread running `loop`, the coroutine is scheduled directly as a
+    task, otherwise it is handed over thread-safely. Once `loop` is closed, e.g. when the
+    `asyncio.run` it belonged to has returned, the coroutines run on the background event
+    loop instead.
+
+    Args:
+        callback (Callable): The coroutine function to schedule.
+        loop (asyncio.AbstractEventLoop): The event loop to run the coroutines on.
+    """
+
+    def __init__(self, callback: Callable, loop: asyncio.AbstractEventLoop):
+        self.callback = callback
+        self.loop = loop
+
+    def __call__(self, *args: Any):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        while True:
+            if self.loop.is_closed():
+                logger.warning(
+                    f"Event loop of {self.callback} is closed, "
+                    "running it on the background event loop"
+                )
+                self.loop = get_background_loop()
+
+            coroutine = self.callback(*args)
+            try:
+                if running is self.loop:
+                    future = self.loop.create_task(coroutine)
+                else:
+                    future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+                break
+            except RuntimeError:
+                coroutine.close()
+                # The loop was closed meanwhile
+                if not self.loop.is_closed():
+                    raise
+
+        future.add_done_callback(_log_exception)
+
+
+class Stream:
+    """An asynchronous iterator over the samples published to one or more keys.
+
+    Samples are buffered in a `BoundedQueue`; the consumer's event loop is only woken up
+    when it is waiting for a sample, so a busy consumer drains bursts without a thread hop
+    per sample. With the `block` overflow policy, publishers are held back while the
+    buffer is full, giving backpressure.
+
+    Use it as an async context manager, or call `close` when done, to unsubscribe.
+
+    Args:
+        maxsize (int): Maximum number of buffered samples.
+        overflow (str): The overflow policy of the buffer.
+        on_close (Callable[[Stream], None]): Called once when the stream is closed.
+    """
+
+    def __init__(
+        self, maxsize: int, overflow: str, on_close: Callable[["Stream"], None]
+    ):
+        self.queue = BoundedQueue(maxsize, overflow)
+        self._on_close = on_close
+        self._closed = False
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._waiter: Optional[asyncio.Future] = None
+
+    def push(self, sample: Any):
+        """Add a sample to the stream, waking up a waiting consumer.
+
+        Args:
+            sample (Any): The sample to add.
+        """
+        if self._closed:
+            return
+
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+
+        self.queue.put(sample, may_block=not in_loop)
+        self._wake(in_loop)
+
+    def close(self):
+        """Unsubscribe the stream and end the iteration once buffered samples are consumed."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        self._on_close(self)
+        # Publishers blocked on a full buffer would otherwise wait forever
+        self.queue.close()
+
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        self._wake(in_loop)
+
+    def __aiter__(self) -> "Stream":
+        return self
+
+    async def __anext__(self) -> Any:
+        self._loop = asyncio.get_running_loop()
+
+        while True:
+            with self._lock:
+                if (sample := self.queue.get(self)) is not self:
+                    return sample
+                if self._closed:
+                    raise StopAsyncIteration
+                self._waiter = self._loop.create_future()
+                waiter = self._waiter
+
+            await waiter
+
+    async def __aenter__(self) -> "Stream":
+        return self
+
+    async def __aexit__(self, *exc_info: Any):
+        self.close()
+
+    def _wake(self, in_loop: bool):
+        with self._lock:
+            waiter, self._waiter = self._waiter, None
+
+        if waiter is None:
+            return
+
+        if in_loop:
+            _resolve(waiter)
+        else:
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+
+def _resolve(waiter: "asyncio.Future"):
+    if not waiter.done():
+        waiter.set_result(None)
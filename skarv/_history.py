@@ -0,0 +1,154 @@
+import math
+from array import array
+from typing import Any, Iterator, List, MutableSequence, Optional, Tuple
+
+# A stored value along with its stamp: (value, timestamp, monotonic, sequence, source_timestamp)
+Entry = Tuple[Any, float, float, int, Optional[float]]
+
+# Values of these exact types are packed into typed arrays, everything else in a list
+_TYPECODES = {int: "q", float: "d"}
+
+
+class RingBuffer:
+    """A fixed-capacity history of stamped values, oldest entries being overwritten.
+
+    The stamps are kept in typed arrays. Values are kept in an `array` as well as long as
+    they are all ints or all floats, and fall back to a list otherwise.
+
+    Args:
+        capacity (int): Maximum number of entries kept.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._times = array("d", bytes(8 * capacity))
+        self._monotonic = array("d", bytes(8 * capacity))
+        self._sequences = array("q", bytes(8 * capacity))
+        # Missing source timestamps are stored as NaN
+        self._sources = array("d", bytes(8 * capacity))
+        self._values: Optional[MutableSequence] = None
+        self._packed: Optional[type] = None
+        self._start = 0
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, entry: Entry):
+        """Append a stamped value, overwriting the oldest entry when full.
+
+        Args:
+            entry (Entry): The value and its stamp.
+        """
+        value, timestamp, monotonic, sequence, source_timestamp = entry
+
+        if self._values is None:
+            if (typecode := _TYPECODES.get(type(value))) is not None:
+                self._values = array(typecode, bytes(8 * self.capacity))
+                self._packed = type(value)
+            else:
+                self._values = [None] * self.capacity
+
+        index = (self._start + self._length) % self.capacity
+        if self._length == self.capacity:
+            self._start = (self._start + 1) % self.capacity
+        else:
+            self._length += 1
+
+        self._times[index] = timestamp
+        self._monotonic[index] = monotonic
+        self._sequences[index] = sequence
+        self._sources[index] = (
+            math.nan if source_timestamp is None else source_timestamp
+        )
+
+        if self._packed is not None and type(value) is not self._packed:
+            self._unpack()
+        try:
+            self._values[index] = value
+        except OverflowError:
+            self._unpack()
+            self._values[index] = value
+
+    def entries(
+        self, last_n: Optional[int] = None, since: Optional[float] = None
+    ) -> Iterator[Entry]:
+        """Iterate over the stored entries, oldest first, reading only the requested range.
+
+        Args:
+            last_n (Optional[int], optional): Only the `last_n` most recent entries. Defaults to None.
+            since (Optional[float], optional): Only entries with a timestamp at or after `since`.
+                Defaults to None.
+
+        Yields:
+            Entry: The stored values and their stamps.
+        """
+        first = 0
+        if last_n is not None:
+            first = max(self._length - last_n, 0)
+        if since is not None:
+            first = max(first, self._bisect(since))
+
+        for offset in range(first, self._length):
+            index = (self._start + offset) % self.capacity
+            source = self._sources[index]
+            yield (
+                self._values[index],
+                self._times[index],
+                self._monotonic[index],
+                self._sequences[index],
+                None if math.isnan(source) else source,
+            )
+
+    def resized(self, capacity: int) -> "RingBuffer":
+        """Create a copy with a new capacity, keeping the most recent entries.
+
+        Args:
+            capacity (int): The capacity of the copy.
+
+        Returns:
+            RingBuffer: The resized copy.
+        """
+        copy = RingBuffer(capacity)
+        for entry in self.entries(last_n=capacity):
+            copy.append(entry)
+        return copy
+
+    def _unpack(self):
+        self._values = list(self._values)
+        self._packed = None
+
+    def _bisect(self, timestamp: float) -> int:
+        low, high = 0, self._length
+        while low < high:
+            middle = (low + high) // 2
+            if self._times[(self._start + middle) % self.capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+def collect(
+    buffers: List[Tuple[Any, RingBuffer]],
+    last_n: Optional[int] = None,
+    since: Optional[float] = None,
+) -> List[Tuple[Any, Entry]]:
+    """Collect the requested entries of several ring buffers, ordered by time of storage.
+
+    Args:
+        buffers (List[Tuple[Any, RingBuffer]]): (key, buffer) pairs.
+        last_n (Optional[int], optional): Only the `last_n` most recent entries per buffer.
+        since (Optional[float], optional): Only entries with a timestamp at or after `since`.
+
+    Returns:
+        List[Tuple[Any, Entry]]: (key, entry) pairs, oldest first.
+    """
+    entries = [
+        (key, entry)
+        for key, buffer in buffers
+        for entry in buffer.entries(last_n, since)
+    ]
+    if len(buffers) > 1:
+        entries.sort(key=lambda pair: pair[1][2])
+    return entries
@@ -0,0 +1,438 @@
+import re
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from zenoh import KeyExpr
+
+
+def _is_wild(key: str) -> bool:
+    return "*" in key or "$" in key
+
+
+def _compile_chunk(chunk: str) -> "re.Pattern":
+    return re.compile(".*".join(re.escape(part) for part in chunk.split("$*")))
+
+
+def _chunk_matches(pattern: "re.Pattern", chunk: str) -> bool:
+    return not chunk.startswith("@") and pattern.fullmatch(chunk) is not None
+
+
+class _Node:
+    __slots__ = ("children", "star", "double_star", "dollar", "items")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.star: Optional["_Node"] = None
+        self.double_star: Optional["_Node"] = None
+        self.dollar: Dict[str, Tuple["re.Pattern", "_Node"]] = {}
+        self.items: Dict[Hashable, None] = {}
+
+    def is_empty(self) -> bool:
+        return not (
+            self.children or self.star or self.double_star or self.dollar or self.items
+        )
+
+
+class CacheInfo(NamedTuple):
+    """Statistics of a match cache.
+
+    Attributes:
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that had to walk the index.
+        evictions (int): Number of entries dropped to respect `maxsize`.
+        maxsize (Optional[int]): The size bound of the cache, None if unbounded.
+        currsize (int): The current number of cached entries.
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: Optional[int]
+    currsize: int
+
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class KeyExprIndex:
+    """A chunk-wise trie of key expressions, used to find the registrations matching a key.
+
+    Every registered item must expose a `key_expr` attribute. The trie holds one level per
+    chunk of the registered key expressions, with dedicated branches for `*`, `**` and
+    chunks containing `$*`, so that matching a concrete key costs time proportional to the
+    depth of the key rather than to the number of registrations. Match results are kept
+    in a cache keyed on the canonical key string, evicting the oldest entries first. The
+    cached keys are also laid out in a `KeyTree`, so that modifying the index finds and
+    drops only the cached entries intersecting the changed registration, without visiting
+    the others. Cache hits and lookups in an empty index take no lock, so the hit counter
+    is approximate under concurrent use.
+
+    Args:
+        maxsize (Optional[int]): Maximum number of cached match results, None for unbounded.
+        compile (Optional[Callable[[List[Any]], Any]]): Turns the matching items into the
+            result cached and returned by `match`, the plain list of items if None.
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = DEFAULT_CACHE_SIZE,
+        compile: Optional[Callable[[List[Any]], Any]] = None,
+    ):
+        self._lock = Lock()
+        self._root = _Node()
+        self._entries: Dict[Hashable, int] = {}
+        self._references: Dict[Hashable, int] = {}
+        self._counter = 0
+        self._cache: Dict[str, Any] = {}
+        self._cached = KeyTree()
+        self._compile = compile
+        self._empty = [] if compile is None else compile([])
+        self._maxsize = maxsize
+        self._hits = self._misses = self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(list(self._entries))
+
+    def add(self, item: Any):
+        """Add an item to the index.
+
+        Items are reference counted: adding an item equal to one already present keeps a
+        single entry, in its original position, until it has been removed as many times.
+
+        Args:
+            item (Any): The item to add, indexed on its `key_expr` attribute.
+        """
+        with self._lock:
+            if item in self._entries:
+                self._references[item] += 1
+                return
+            self._references[item] = 1
+
+            self._counter += 1
+            self._entries[item] = self._counter
+
+            node = self._root
+            for chunk in str(item.key_expr).split("/"):
+                node = self._child(node, chunk)
+            node.items[item] = None
+
+            self._invalidate(item.key_expr)
+
+    def remove(self, item: Any):
+        """Remove one reference to an item, dropping it once unreferenced.
+
+        Removing an absent item is a no-op.
+
+        Args:
+            item (Any): The item to remove.
+        """
+        with self._lock:
+            if (references := self._references.get(item)) is None:
+                return
+            if references > 1:
+                self._references[item] = references - 1
+                return
+            del self._references[item]
+            del self._entries[item]
+
+            path = [self._root]
+            chunks = str(item.key_expr).split("/")
+            for chunk in chunks:
+                path.append(self._child(path[-1], chunk))
+            path[-1].items.pop(item, None)
+
+            # Prune branches that no longer lead to any item
+            for parent, chunk, node in zip(
+                reversed(path[:-1]), reversed(chunks), reversed(path[1:])
+            ):
+                if not node.is_empty():
+                    break
+                self._unlink(parent, chunk)
+
+            self._invalidate(item.key_expr)
+
+    def clear(self):
+        """Remove all items and cached matches from the index."""
+        with self._lock:
+            self._root = _Node()
+            self._entries.clear()
+            self._references.clear()
+            self._cache.clear()
+            self._cached.clear()
+            self._hits = self._misses = self._evictions = 0
+
+    def cache_info(self) -> CacheInfo:
+        """Report the statistics of the match cache.
+
+        Returns:
+            CacheInfo: Hit, miss and eviction counters along with the cache size.
+        """
+        with self._lock:
+            return CacheInfo(
+                self._hits,
+                self._misses,
+                self._evictions,
+                self._maxsize,
+                len(self._cache),
+            )
+
+    def cache_resize(self, maxsize: Optional[int]):
+        """Change the size bound of the match cache, evicting entries if needed.
+
+        Args:
+            maxsize (Optional[int]): Maximum number of cached match results, None for unbounded.
+        """
+        with self._lock:
+            self._maxsize = maxsize
+            self._evict()
+
+    def match(self, key: str) -> Any:
+        """Find all items whose key expression intersects the given one.
+
+        Args:
+            key (str): The canonical key expression to match against, as a string.
+
+        Returns:
+            Any: The matching items, in registration order, as compiled by `compile`.
+        """
+        if not self._entries:
+            return self._empty
+        if (found := self._cache.get(key)) is not None:
+            self._hits += 1
+            return found
+
+        with self._lock:
+            if (found := self._cache.get(key)) is not None:
+                self._hits += 1
+                return found
+
+            self._misses += 1
+            if _is_wild(key):
+                # Wildcard lookups are rare, a linear scan keeps the semantics exact
+                found = [
+                    item for item in self._entries if item.key_expr.intersects(key)
+                ]
+            else:
+                hits: Dict[Hashable, None] = {}
+                self._collect(self._root, key.split("/"), 0, hits)
+                found = sorted(hits, key=self._entries.__getitem__)
+
+            if self._compile is not None:
+                found = self._compile(found)
+            self._cache[key] = found
+            self._cached.insert(KeyExpr(key), key)
+            self._evict()
+            return found
+
+    @staticmethod
+    def _child(node: _Node, chunk: str) -> _Node:
+        if chunk == "*":
+            if node.star is None:
+                node.star = _Node()
+            return node.star
+
+        if chunk == "**":
+            if node.double_star is None:
+                node.double_star = _Node()
+            return node.double_star
+
+        if "$*" in chunk:
+            if chunk not in node.dollar:
+                node.dollar[chunk] = (_compile_chunk(chunk), _Node())
+            return node.dollar[chunk][1]
+
+        if chunk not in node.children:
+            node.children[chunk] = _Node()
+        return node.children[chunk]
+
+    @staticmethod
+    def _unlink(node: _Node, chunk: str):
+        if chunk == "*":
+            node.star = None
+        elif chunk == "**":
+            node.double_star = None
+        elif "$*" in chunk:
+            del node.dollar[chunk]
+        else:
+            del node.children[chunk]
+
+    def _collect(
+        self, node: _Node, chunks: List[str], index: int, hits: Dict[Hashable, None]
+    ):
+        if node.double_star is not None:
+            # `**` may swallow any number of chunks, but never verbatim (`@`) ones
+            end = index
+            while end < len(chunks) and not chunks[end].startswith("@"):
+                end += 1
+            for resume in range(index, end + 1):
+                self._collect(node.double_star, chunks, resume, hits)
+
+        if index == len(chunks):
+            hits.update(node.items)
+            return
+
+        chunk = chunks[index]
+
+        if (child := node.children.get(chunk)) is not None:
+            self._collect(child, chunks, index + 1, hits)
+
+        if node.star is not None and not chunk.startswith("@"):
+            self._collect(node.star, chunks, index + 1, hits)
+
+        for pattern, child in node.dollar.values():
+            if _chunk_matches(pattern, chunk):
+                self._collect(child, chunks, index + 1, hits)
+
+    def _evict(self):
+        if self._maxsize is None:
+            return
+        while len(self._cache) > self._maxsize:
+            key = next(iter(self._cache))
+            del self._cache[key]
+            self._cached.discard(key)
+            self._evictions += 1
+
+    def _invalidate(self, key_expr: KeyExpr):
+        for cached in self._cached.find(key_expr):
+            key = str(cached)
+            self._cached.discard(key)
+            del self._cache[key]
+
+
+class _Branch:
+    __slots__ = ("children", "key_expr")
+
+    def __init__(self):
+        self.children: Dict[str, "_Branch"] = {}
+        self.key_expr: Optional[KeyExpr] = None
+
+
+class KeyTree:
+    """A hierarchical prefix index over a set of stored key expressions.
+
+    Stored keys are laid out chunk by chunk so that a (wildcard) query only visits the
+    subtrees it can match. Stored keys that themselves contain wildcards are kept aside
+    and checked with `KeyExpr.intersects`. The tree is not thread-safe on its own.
+    """
+
+    def __init__(self):
+        self._root = _Branch()
+        self._wild: Dict[str, KeyExpr] = {}
+
+    def insert(self, key_expr: KeyExpr, key: Optional[str] = None):
+        """Insert a canonical key expression into the tree.
+
+        Args:
+            key_expr (KeyExpr): The key expression to insert.
+            key (Optional[str], optional): `str(key_expr)`, when already at hand.
+        """
+        if key is None:
+            key = str(key_expr)
+        if _is_wild(key):
+            self._wild[key] = key_expr
+            return
+
+        node = self._root
+        for chunk in key.split("/"):
+            if (child := node.children.get(chunk)) is None:
+                child = node.children[chunk] = _Branch()
+            node = child
+        node.key_expr = key_expr
+
+    def discard(self, key_expr: Union[KeyExpr, str]):
+        """Remove a key expression from the tree, if present.
+
+        Args:
+            key_expr (Union[KeyExpr, str]): The key expression to remove, or its canonical
+                string.
+        """
+        key = str(key_expr)
+        if _is_wild(key):
+            self._wild.pop(key, None)
+            return
+
+        node = self._root
+        path = [node]
+        chunks = key.split("/")
+        for chunk in chunks:
+            if (node := node.children.get(chunk)) is None:
+                return
+            path.append(node)
+        node.key_expr = None
+
+        # Prune the branches left empty
+        while len(path) > 1 and not (node.children or node.key_expr is not None):
+            path.pop()
+            node = path[-1]
+            del node.children[chunks[len(path) - 1]]
+
+    def clear(self):
+        """Remove all key expressions from the tree."""
+        self._root = _Branch()
+        self._wild.clear()
+
+    def find(self, key_expr: KeyExpr) -> List[KeyExpr]:
+        """Find all stored key expressions intersecting the given one.
+
+        Args:
+            key_expr (KeyExpr): The canonical key expression to query for.
+
+        Returns:
+            List[KeyExpr]: The matching stored key expressions.
+        """
+        hits: Dict[KeyExpr, None] = {}
+        chunks = [
+            _compile_chunk(chunk) if "$*" in chunk else chunk
+            for chunk in str(key_expr).split("/")
+        ]
+        self._walk(self._root, chunks, 0, hits)
+
+        for stored in self._wild.values():
+            if stored.intersects(key_expr):
+                hits[stored] = None
+
+        return list(hits)
+
+    def _walk(
+        self, node: _Branch, chunks: List[Any], index: int, hits: Dict[KeyExpr, None]
+    ):
+        if index == len(chunks):
+            if node.key_expr is not None:
+                hits[node.key_expr] = None
+            return
+
+        chunk = chunks[index]
+
+        if chunk == "**":
+            self._walk(node, chunks, index + 1, hits)
+            for name, child in node.children.items():
+                if not name.startswith("@"):
+                    self._walk(child, chunks, index, hits)
+
+        elif chunk == "*":
+            for name, child in node.children.items():
+                if not name.startswith("@"):
+                    self._walk(child, chunks, index + 1, hits)
+
+        elif isinstance(chunk, str):
+            if (child := node.children.get(chunk)) is not None:
+                self._walk(child, chunks, index + 1, hits)
+
+        else:
+            for name, child in node.children.items():
+                if _chunk_matches(chunk, name):
+                    self._walk(child, chunks, index + 1, hits)
@@ -0,0 +1,48 @@
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+
+class Pipeline:
+    """The middlewares matching a key expression, fused into a single callable.
+
+    Middlewares run by decreasing `priority`, those of equal priority in registration
+    order. The operators are fused into one function that calls them in turn and stops at
+    the first one dropping the value. Building a pipeline is cheap, as one is built for
+    every new key matched.
+
+    Args:
+        middlewares (Iterable[Any]): The matching middlewares, in registration order.
+    """
+
+    __slots__ = ("middlewares", "run")
+
+    def __init__(self, middlewares: Iterable[Any]):
+        self.middlewares = tuple(
+            sorted(middlewares, key=lambda middleware: -middleware.priority)
+        )
+        self.run: Callable[[Any], Optional[Any]] = _fuse(
+            [middleware.operator for middleware in self.middlewares]
+        )
+
+    def __len__(self) -> int:
+        return len(self.middlewares)
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+def _fuse(operators: Sequence[Callable[[Any], Any]]) -> Callable[[Any], Optional[Any]]:
+    if not operators:
+        return _identity
+    if len(operators) == 1:
+        return operators[0]
+
+    operators = tuple(operators)
+
+    def _pipeline(value: Any) -> Optional[Any]:
+        for operator in operators:
+            if (value := operator(value)) is None:
+                return None
+        return value
+
+    return _pipeline
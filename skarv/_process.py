@@ -0,0 +1,264 @@
+import sys
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Deque, List, NamedTuple, Optional, Tuple
+
+from zenoh import KeyExpr
+
+from ._clock import resumer
+from ._dispatch import Dispatcher
+from ._sample import Sample
+from .concurrency import PROCESS_WORKERS, get_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Bytes and arrays at least this large are sent through shared memory rather than pickled
+SHARED_MEMORY_THRESHOLD = 64 * 1024
+
+# Maximum number of calls of one callback in flight in the process pool
+MAX_IN_FLIGHT = 2 * PROCESS_WORKERS
+
+
+class _Shared(NamedTuple):
+    """A bytes object or array placed in a shared memory block."""
+
+    name: str
+    size: int
+    dtype: Optional[str] = None
+    shape: Tuple[int, ...] = ()
+
+
+class _PackedSample(NamedTuple):
+    """A sample with its key as a string, as key expressions cannot be pickled."""
+
+    key: str
+    value: Any
+    stamps: Tuple[Any, ...]
+
+
+def _share(
+    data: memoryview, dtype: Optional[str] = None, shape=()
+) -> Tuple[_Shared, SharedMemory]:
+    block = SharedMemory(create=True, size=data.nbytes)
+    block.buf[: data.nbytes] = data.cast("B")
+    return _Shared(block.name, data.nbytes, dtype, tuple(shape)), block
+
+
+def _export(value: Any, blocks: List[SharedMemory]) -> Any:
+    """Prepare a value to be sent to another process, appending the blocks it uses."""
+    if isinstance(value, Sample):
+        return _PackedSample(
+            str(value.key_expr), _export(value.value, blocks), tuple(value[2:])
+        )
+    if isinstance(value, list):
+        return [_export(item, blocks) for item in value]
+
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) < SHARED_MEMORY_THRESHOLD:
+            return value
+        shared, block = _share(memoryview(value))
+    elif (np := sys.modules.get("numpy")) is not None and isinstance(value, np.ndarray):
+        if value.nbytes < SHARED_MEMORY_THRESHOLD or value.dtype.hasobject:
+            return value
+        value = np.ascontiguousarray(value)
+        shared, block = _share(memoryview(value), value.dtype.str, value.shape)
+    else:
+        return value
+
+    blocks.append(block)
+    return shared
+
+
+def _import(value: Any, blocks: List[SharedMemory], copy: bool) -> Any:
+    """Rebuild a value received from another process, appending the blocks it maps.
+
+    Without `copy`, arrays are read-only views of their shared memory block, which must
+    stay open for as long as they are in use.
+    """
+    if isinstance(value, _PackedSample):
+        return Sample(
+            KeyExpr(value.key), _import(value.value, blocks, copy), *value.stamps
+        )
+    if isinstance(value, list):
+        return [_import(item, blocks, copy) for item in value]
+    if not isinstance(value, _Shared):
+        return value
+
+    block = SharedMemory(value.name)
+    blocks.append(block)
+
+    if value.dtype is None:
+        return bytes(block.buf[: value.size])
+
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    array = np.ndarray(value.shape, np.dtype(value.dtype), buffer=block.buf)
+    if copy:
+        return array.copy()
+    array.flags.writeable = False
+    return array
+
+
+def _close(blocks: List[SharedMemory], unlink: bool):
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            # Still referenced by a value kept by the callback, closed when collected
+            pass
+        if unlink:
+            block.unlink()
+
+
+def _run(func: Callable, args: Tuple[Any, ...]) -> Any:
+    """Call a function in a worker process, with arguments prepared by `_export`."""
+    received: List[SharedMemory] = []
+    try:
+        result = func(*_import(list(args), received, copy=False))
+
+        # The result may be a view of an argument, export it before unmapping those
+        sent: List[SharedMemory] = []
+        try:
+            return _export(result, sent)
+        finally:
+            del result
+            _close(sent, unlink=False)
+    finally:
+        _close(received, unlink=False)
+
+
+def submit(func: Callable, *args: Any) -> "Future[Any]":
+    """Call a function in the process pool, sending large bytes and arrays through shared memory.
+
+    Args:
+        func (Callable): The function to call, which must be picklable.
+        *args (Any): The arguments, samples and lists of samples included.
+
+    Returns:
+        Future[Any]: The result of the call.
+    """
+    blocks: List[SharedMemory] = []
+    try:
+        future = get_process_pool().submit(_run, func, _export(list(args), blocks))
+    except BaseException:
+        _close(blocks, unlink=True)
+        raise
+
+    result: "Future[Any]" = Future()
+
+    def _done(done: "Future[Any]"):
+        _close(blocks, unlink=True)
+
+        if (exc := done.exception()) is not None:
+            result.set_exception(exc)
+            return
+
+        received: List[SharedMemory] = []
+        try:
+            result.set_result(_import(done.result(), received, copy=True))
+        except Exception as error:  # pylint: disable=broad-except
+            result.set_exception(error)
+        finally:
+            _close(received, unlink=True)
+
+    future.add_done_callback(_done)
+    return result
+
+
+class ProcessCallback:
+    """Call a subscriber or trigger callback in the process pool each time it is called.
+
+    Calls are submitted without waiting for their completion, so that a single callback
+    runs on several cores, up to `MAX_IN_FLIGHT` calls at once. Beyond that, the caller
+    waits for a call to complete. The callback runs in a worker process: its return value
+    is discarded and its exceptions are logged.
+
+    Args:
+        callback (Callable): The callback to call, which must be picklable.
+    """
+
+    def __init__(self, callback: Callable):
+        self.callback = callback
+        self._slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+    def __call__(self, *args: Any):
+        self._slots.acquire()
+        try:
+            future = submit(self.callback, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+
+    def _done(self, future: "Future[Any]"):
+        self._slots.release()
+        if (exc := future.exception()) is not None:
+            logger.error(
+                "Exception in process callback %s", self.callback, exc_info=exc
+            )
+
+
+class ProcessMiddleware:
+    """Run a middleware operator in the process pool.
+
+    Within a put, each value is submitted to the pool and held back: the put returns at
+    once and the result is later passed through the rest of the pipeline, then stored and
+    published, as `batch` does with its timer. Results are published in the order the
+    values were put, whereas up to `MAX_IN_FLIGHT` values are processed at once. Outside
+    of a put, the operator is called in the pool and waited for.
+
+    As each value may be processed by a different worker process, the operator should not
+    keep state between calls.
+
+    Args:
+        operator (Callable[[Any], Any]): The operator to run, which must be picklable.
+    """
+
+    def __init__(self, operator: Callable[[Any], Any]):
+        self.operator = operator
+        self._slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+        self._lock = threading.Lock()
+        self._pending: Deque[Tuple["Future[Any]", Callable[[Any], None]]] = deque()
+        self._publisher = Dispatcher(self._publish, "thread", queue_size=MAX_IN_FLIGHT)
+
+    def __call__(self, value: Any) -> Any:
+        if (resume := resumer(self)) is None:
+            return submit(self.operator, value).result()
+
+        self._slots.acquire()
+        try:
+            future = submit(self.operator, value)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._pending.append((future, resume))
+        future.add_done_callback(self._done)
+
+        return None
+
+    def _done(self, _: "Future[Any]"):
+        with self._lock:
+            while self._pending and self._pending[0][0].done():
+                future, resume = self._pending.popleft()
+
+                if (exc := future.exception()) is not None:
+                    self._slots.release()
+                    logger.error(
+                        "Exception in process middleware %s",
+                        self.operator,
+                        exc_info=exc,
+                    )
+                elif (result := future.result()) is None:
+                    self._slots.release()
+                else:
+                    # The slot is held until the result is dequeued, bounding the queue
+                    self._publisher(resume, result)
+
+    def _publish(self, resume: Callable[[Any], None], value: Any):
+        self._slots.release()
+        resume(value)
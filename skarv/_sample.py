@@ -0,0 +1,30 @@
+from typing import Any, NamedTuple, Optional
+
+from zenoh import KeyExpr
+
+
+class Sample(NamedTuple):
+    """A data sample consisting of a key expression, its associated value and when it was put.
+
+    Every sample is stamped once, when it is put. The monotonic timestamp is the one seen
+    by middlewares, and makes it possible to measure delivery latency as
+    `time.monotonic() - sample.monotonic`.
+
+    Samples are immutable, slotted tuples. The sample stored in the vault by a put is the
+    very one handed to subscribers and returned by `get`, so no copies are made.
+
+    Attributes:
+        key_expr (KeyExpr): The key expression associated with the sample.
+        value (Any): The value of the sample.
+        timestamp (float): The wall-clock time of the put, in seconds since the epoch.
+        monotonic (float): The monotonic clock time of the put, in seconds.
+        sequence (int): The sequence number of the sample, counting the puts per key from 1.
+        source_timestamp (Optional[float]): A timestamp supplied by the source of the value, if any.
+    """
+
+    key_expr: KeyExpr
+    value: Any
+    timestamp: float = 0.0
+    monotonic: float = 0.0
+    sequence: int = 0
+    source_timestamp: Optional[float] = None
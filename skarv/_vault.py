@@ -0,0 +1,288 @@
+from contextlib import ExitStack
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from zenoh import KeyExpr
+
+from ._index import KeyExprIndex, KeyTree, _is_wild
+from ._history import RingBuffer, collect
+from ._sample import Sample
+
+# Number of independently locked partitions of a vault
+DEFAULT_SHARDS = 16
+
+_new_tuple = tuple.__new__
+
+
+@dataclass(frozen=True)
+class HistoryConfig:
+    """The history depth configured for a key expression.
+
+    Attributes:
+        key_expr (KeyExpr): The key expression the configuration applies to.
+        depth (int): The number of values to keep per matching key.
+    """
+
+    key_expr: KeyExpr
+    depth: int
+
+
+class _Shard:
+    """A partition of the vault, guarded by its own lock."""
+
+    __slots__ = ("lock", "values", "tree", "histories")
+
+    def __init__(self):
+        self.lock = Lock()
+        self.values: Dict[str, Sample] = {}
+        self.tree = KeyTree()
+        self.histories: Dict[str, RingBuffer] = {}
+
+
+class Vault:
+    """Thread-safe storage of the latest value per key expression.
+
+    Each value is stored as a `Sample`, holding its stamp and a per-key sequence number
+    assigned at storage. Samples live in a plain dict keyed on the canonical key string
+    for O(1) exact-key access, while a `KeyTree` over the
+    stored keys lets wildcard queries visit only the matching subtrees. Keys matching a
+    history configuration additionally keep their recent values in a `RingBuffer`.
+
+    The storage is partitioned into shards by the hash of the whole key, each with its own
+    lock, so that producers writing different keys rarely contend, even when all keys share
+    a common root. Queries for a single key visit its shard only, wildcard queries visit
+    every shard, each shard being read in a consistent state. Stored keys starting with a
+    wildcard are kept in a dedicated shard.
+
+    Args:
+        shards (int, optional): The number of shards. Defaults to `DEFAULT_SHARDS`.
+    """
+
+    def __init__(self, shards: int = DEFAULT_SHARDS):
+        if shards < 1:
+            raise ValueError(f"The number of shards must be positive, got {shards}")
+
+        self._shards = [_Shard() for _ in range(shards)]
+        self._wild = _Shard()
+        self._history_configs: Dict[KeyExpr, HistoryConfig] = {}
+        self._history_index = KeyExprIndex()
+
+    def __len__(self) -> int:
+        return sum(len(shard.values) for shard in self._all_shards())
+
+    def put(
+        self,
+        key_expr: KeyExpr,
+        value: Any,
+        timestamp: float,
+        monotonic: float,
+        source_timestamp: Optional[float] = None,
+        key: Optional[str] = None,
+    ) -> Sample:
+        """Store the latest value for a key expression.
+
+        Args:
+            key_expr (KeyExpr): The canonical key expression.
+            value (Any): The value to store.
+            timestamp (float): The wall-clock time of the put.
+            monotonic (float): The monotonic clock time of the put.
+            source_timestamp (Optional[float], optional): A timestamp supplied by the source.
+            key (Optional[str], optional): `str(key_expr)`, when already at hand.
+
+        Returns:
+            Sample: The stored sample, including its sequence number.
+        """
+        if key is None:
+            key = str(key_expr)
+        depth = self._history_depth(key)
+        shard = self._shard(key)
+
+        with shard.lock:
+            return _store(
+                shard,
+                key_expr,
+                key,
+                value,
+                timestamp,
+                monotonic,
+                source_timestamp,
+                depth,
+            )
+
+    def put_many(
+        self, items: List[Tuple[KeyExpr, Any, float, float, Optional[float]]]
+    ) -> List[Sample]:
+        """Store the latest values for several key expressions at once.
+
+        The locks of all shards involved are held together, so the whole batch becomes
+        visible at once.
+
+        Args:
+            items (List[Tuple[KeyExpr, Any, float, float, Optional[float]]]): The arguments
+                of `put` for each value.
+
+        Returns:
+            List[Sample]: The stored samples, in the same order.
+        """
+        keys = [str(item[0]) for item in items]
+        depths = [self._history_depth(key) for key in keys]
+        shards = [self._shard(key) for key in keys]
+
+        # Lock in a fixed order to never deadlock with a concurrent batch
+        locks = sorted({id(shard): shard.lock for shard in shards}.items())
+        with ExitStack() as stack:
+            for _, lock in locks:
+                stack.enter_context(lock)
+
+            return [
+                _store(shard, item[0], key, *item[1:], depth=depth)
+                for shard, key, item, depth in zip(shards, keys, items, depths)
+            ]
+
+    def find(self, key_expr: KeyExpr) -> List[Sample]:
+        """Find all stored samples whose key intersects the given key expression.
+
+        Args:
+            key_expr (KeyExpr): The canonical key expression to query for.
+
+        Returns:
+            List[Sample]: The matching samples.
+        """
+        key = str(key_expr)
+        if not _is_wild(key):
+            shard = self._shard(key)
+            with shard.lock:
+                sample = shard.values.get(key)
+            return [] if sample is None else [sample]
+
+        samples: List[Sample] = []
+        for shard in self._all_shards():
+            with shard.lock:
+                samples.extend(
+                    shard.values[str(ke)] for ke in shard.tree.find(key_expr)
+                )
+        return samples
+
+    def history(
+        self,
+        key_expr: KeyExpr,
+        last_n: Optional[int] = None,
+        since: Optional[float] = None,
+    ) -> List[Sample]:
+        """Read the recorded history of all keys intersecting the given key expression.
+
+        Args:
+            key_expr (KeyExpr): The canonical key expression to query for.
+            last_n (Optional[int], optional): Only the `last_n` most recent values per key.
+            since (Optional[float], optional): Only values stored at or after this time.
+
+        Returns:
+            List[Sample]: The recorded samples, oldest first.
+        """
+        key = str(key_expr)
+        wild = _is_wild(key)
+
+        entries = []
+        shards = self._all_shards() if wild else [self._shard(key)]
+        for shard in shards:
+            with shard.lock:
+                if not wild:
+                    found = [key_expr] if key in shard.histories else []
+                else:
+                    found = [
+                        ke
+                        for ke in shard.tree.find(key_expr)
+                        if str(ke) in shard.histories
+                    ]
+
+                entries.extend(
+                    collect(
+                        [(ke, shard.histories[str(ke)]) for ke in found], last_n, since
+                    )
+                )
+
+        if len(shards) > 1:
+            entries.sort(key=lambda pair: pair[1][2])
+
+        return [Sample(ke, *entry) for ke, entry in entries]
+
+    def configure_history(self, key_expr: KeyExpr, depth: int):
+        """Set the history depth for all keys matching a key expression.
+
+        Existing histories of matching keys are resized, keeping their most recent values.
+        When several configurations match a key, the largest depth applies.
+
+        Args:
+            key_expr (KeyExpr): The canonical key expression to configure.
+            depth (int): The number of values to keep per key, 0 to disable.
+        """
+        if (previous := self._history_configs.pop(key_expr, None)) is not None:
+            self._history_index.remove(previous)
+        if depth > 0:
+            self._history_configs[key_expr] = HistoryConfig(key_expr, depth)
+            self._history_index.add(self._history_configs[key_expr])
+
+        for shard in self._all_shards():
+            with shard.lock:
+                histories = shard.histories
+                for key in [key for key in histories if key_expr.intersects(key)]:
+                    if (depth := self._history_depth(key)) == 0:
+                        del histories[key]
+                    elif depth != histories[key].capacity:
+                        histories[key] = histories[key].resized(depth)
+
+    def clear(self):
+        """Remove all stored values, histories and history configurations."""
+        for shard in self._all_shards():
+            with shard.lock:
+                shard.values.clear()
+                shard.tree.clear()
+                shard.histories.clear()
+        self._history_configs.clear()
+        self._history_index.clear()
+
+    def _all_shards(self) -> List[_Shard]:
+        return self._shards + [self._wild]
+
+    def _shard(self, key: str) -> _Shard:
+        if _is_wild(key.partition("/")[0]):
+            return self._wild
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _history_depth(self, key: str) -> int:
+        if not self._history_configs:
+            return 0
+        return max(
+            (config.depth for config in self._history_index.match(key)), default=0
+        )
+
+
+def _store(
+    shard: _Shard,
+    key_expr: KeyExpr,
+    key: str,
+    value: Any,
+    timestamp: float,
+    monotonic: float,
+    source_timestamp: Optional[float],
+    depth: int,
+) -> Sample:
+    if (previous := shard.values.get(key)) is None:
+        shard.tree.insert(key_expr, key)
+        sequence = 1
+    else:
+        sequence = previous.sequence + 1
+
+    # Bypass the generated constructor of the named tuple, which is comparatively slow
+    sample = _new_tuple(
+        Sample, (key_expr, value, timestamp, monotonic, sequence, source_timestamp)
+    )
+    shard.values[key] = sample
+
+    if depth:
+        if (history := shard.histories.get(key)) is None:
+            history = shard.histories[key] = RingBuffer(depth)
+        history.append(sample[1:])
+
+    return sample
@@ -0,0 +1,645 @@
+import time
+import asyncio
+import logging
+from threading import Lock
+from dataclasses import dataclass
+from typing import Callable, Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+from zenoh import KeyExpr
+
+from ._index import CacheInfo, KeyExprIndex
+from ._sample import Sample
+from ._pipeline import Pipeline
+from ._vault import DEFAULT_SHARDS, Vault
+from ._dispatch import CoroutineCallback, Dispatcher, Stream
+from ._process import ProcessCallback, ProcessMiddleware
+from ._clock import _put_resume, _put_time
+from .concurrency import get_background_loop
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class Subscriber:
+    """A subscriber that listens to updates for a specific key expression.
+
+    Attributes:
+        key_expr (KeyExpr): The key expression to subscribe to.
+        callback (Callable[[Any], None]): The callback function to invoke when a matching sample is published.
+        batch (bool): Whether the callback receives a list of samples instead of a single sample.
+    """
+
+    key_expr: KeyExpr
+    callback: Callable[[Any], None]
+    batch: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class Middleware:
+    """A middleware operator that processes values for a specific key expression.
+
+    Attributes:
+        key_expr (KeyExpr): The key expression the middleware applies to.
+        operator (Callable[[Any], Any]): The operator function to process the value.
+        priority (int): Middlewares with a higher priority run first, those with equal
+            priorities in registration order.
+    """
+
+    key_expr: KeyExpr
+    operator: Callable[[Any], Any]
+    priority: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class Trigger:
+    """A trigger that executes a callback when a matching key expression is published.
+
+    Attributes:
+        key_expr (KeyExpr): The key expression to trigger on.
+        callback (Callable[[], None]): The callback function to invoke when a matching sample is published.
+    """
+
+    key_expr: KeyExpr
+    callback: Callable[[], None]
+
+
+class Registration:
+    """A handle on the subscribers, triggers or middlewares registered by one call.
+
+    The handle is the decorator returned by `subscribe` and `trigger`: calling it with a
+    callback registers that callback and returns it unchanged. Closing the handle removes
+    everything it registered, invalidating only the cached matches of the affected key
+    expressions, while equal registrations made through other handles remain. It can be
+    used as a context manager to close it on exit.
+
+    Example:
+        ```python
+        with skarv.subscribe("connection/42/**") as subscription:
+            subscription(websocket_send)
+            ...
+        ```
+
+    Args:
+        index (KeyExprIndex): The registry to register into.
+        records (Callable[[Callable], List[Any]]): Creates the records to register for a callback.
+    """
+
+    def __init__(self, index: KeyExprIndex, records: Callable[[Callable], List[Any]]):
+        self._index = index
+        self._records = records
+        self._registered: List[Any] = []
+        self._lock = Lock()
+        self.closed = False
+
+    def __call__(self, callback: Callable) -> Callable:
+        """Register a callback.
+
+        Args:
+            callback (Callable): The callback to register.
+
+        Returns:
+            Callable: The callback itself.
+
+        Raises:
+            RuntimeError: If the handle is closed.
+        """
+        records = self._records(callback)
+
+        # Registered under the lock, so that a concurrent `close` removes the records
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("Cannot register on a closed registration")
+            self._registered.extend(records)
+            for record in records:
+                self._index.add(record)
+
+        return callback
+
+    def close(self):
+        """Remove everything registered through this handle. Closing twice is a no-op."""
+        with self._lock:
+            self.closed = True
+            records, self._registered = self._registered, []
+            for record in records:
+                self._index.remove(record)
+
+    def __enter__(self) -> "Registration":
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.close()
+
+
+def _call(callback: Callable, *args: Any):
+    callback(*args)
+
+
+def _sample_key(args: Tuple[Sample]) -> KeyExpr:
+    return args[0].key_expr
+
+
+def _dispatcher(
+    callback: Callable,
+    executor: Optional[str],
+    queue_size: int,
+    overflow: str,
+    key: Optional[Callable[[Tuple[Any, ...]], Any]] = None,
+) -> Callable:
+    if executor == "process":
+        if asyncio.iscoroutinefunction(callback):
+            raise ValueError("Coroutine functions cannot run in the process pool")
+        # Queued and submitted in order from the thread pool
+        callback, executor = ProcessCallback(callback), "thread"
+    elif asyncio.iscoroutinefunction(callback):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = get_background_loop()
+        callback = CoroutineCallback(callback, loop)
+
+    if executor is None:
+        return callback
+    return Dispatcher(callback, executor, queue_size, overflow, key)
+
+
+class Broker:
+    """An in-memory message broker owning its own vault, registrations and match caches.
+
+    Brokers are fully independent of each other: each has its own locks, caches and
+    metrics, so separate pipelines can be partitioned over separate brokers to lower
+    contention. The module-level functions of `skarv` delegate to a default broker.
+
+    Args:
+        metrics (Optional[Metrics], optional): The metrics to record into, a new disabled
+            `Metrics` instance if None. Defaults to None.
+        shards (int, optional): The number of independently locked partitions of the vault.
+            Raise it when many producer threads write different keys. Defaults to 16.
+    """
+
+    def __init__(self, metrics: Optional[Metrics] = None, shards: int = DEFAULT_SHARDS):
+        self._vault = Vault(shards)
+
+        self._subscribers = KeyExprIndex()
+        self._middlewares = KeyExprIndex(compile=Pipeline)
+        self._triggers = KeyExprIndex()
+
+        self.metrics = Metrics() if metrics is None else metrics
+        self.metrics.gauge("vault_keys", lambda: len(self._vault))
+        self.metrics.gauge("subscribers", lambda: len(self._subscribers))
+
+    def clear(self):
+        """Remove all stored values and all registrations."""
+        self._vault.clear()
+        self._subscribers.clear()
+        self._middlewares.clear()
+        self._triggers.clear()
+
+    def _process(
+        self,
+        ke: KeyExpr,
+        key: str,
+        value: Any,
+        monotonic: float,
+        source_timestamp: Optional[float],
+    ) -> Any:
+        pipeline: Pipeline = self._middlewares.match(key)
+        if not pipeline.middlewares:
+            return value
+        return self._run(ke, key, pipeline, 0, value, monotonic, source_timestamp)
+
+    def _run(
+        self,
+        ke: KeyExpr,
+        key: str,
+        pipeline: Pipeline,
+        stage: int,
+        value: Any,
+        monotonic: float,
+        source_timestamp: Optional[float],
+    ) -> Any:
+        # Let the middlewares agree on the time stamped on the sample, and resume the put
+        time_token = _put_time.set(monotonic)
+        resume_token = _put_resume.set((self._resume, ke, pipeline, source_timestamp))
+        try:
+            if self.metrics.enabled:
+                return self.metrics.run_middlewares(
+                    key, pipeline.middlewares[stage:], value
+                )
+            if stage == 0:
+                return pipeline.run(value)
+            for middleware in pipeline.middlewares[stage:]:
+                if (value := middleware.operator(value)) is None:
+                    return None
+            return value
+        finally:
+            _put_resume.reset(resume_token)
+            _put_time.reset(time_token)
+
+    def _resume(
+        self,
+        ke: KeyExpr,
+        pipeline: Pipeline,
+        source_timestamp: Optional[float],
+        operator: Callable[[Any], Any],
+        value: Any,
+    ):
+        operators = [middleware.operator for middleware in pipeline.middlewares]
+        try:
+            stage = operators.index(operator) + 1
+        except ValueError:
+            logger.error("Cannot resume %s from an unknown middleware %s", ke, operator)
+            return
+
+        key = str(ke)
+        timestamp, monotonic = time.time(), time.monotonic()
+
+        value = self._run(ke, key, pipeline, stage, value, monotonic, source_timestamp)
+        if value is None:
+            return
+
+        self._publish(ke, key, value, timestamp, monotonic, source_timestamp)
+
+    def put(self, key: str, value: Any, source_timestamp: Optional[float] = None):
+        """Store a value for a given key, passing it through any registered middlewares and notifying subscribers.
+
+        Args:
+            key (str): The key to associate with the value.
+            value (Any): The value to store.
+            source_timestamp (Optional[float], optional): A timestamp supplied by the source of
+                the value, carried along in the sample. Defaults to None.
+        """
+        ke: KeyExpr = KeyExpr.autocanonize(key)
+        key = str(ke)
+        timestamp, monotonic = time.time(), time.monotonic()
+
+        if self.metrics.enabled:
+            self.metrics.count_put(key)
+
+        # Pass through middlewares
+        value = self._process(ke, key, value, monotonic, source_timestamp)
+        if value is None:
+            return
+
+        self._publish(ke, key, value, timestamp, monotonic, source_timestamp)
+
+    def _publish(
+        self,
+        ke: KeyExpr,
+        key: str,
+        value: Any,
+        timestamp: float,
+        monotonic: float,
+        source_timestamp: Optional[float],
+    ):
+        # Add final value to vault, the stored sample is the one handed to subscribers
+        sample = self._vault.put(ke, value, timestamp, monotonic, source_timestamp, key)
+
+        if self.metrics.enabled:
+            for subscriber in self._subscribers.match(key):
+                self.metrics.call(
+                    subscriber.callback, [sample] if subscriber.batch else sample
+                )
+            for trigger in self._triggers.match(key):
+                self.metrics.call(trigger.callback)
+            return
+
+        # Trigger subscribers
+        for subscriber in self._subscribers.match(key):
+            subscriber.callback([sample] if subscriber.batch else sample)
+
+        # Trigger triggers
+        for trigger in self._triggers.match(key):
+            trigger.callback()
+
+    def put_many(
+        self,
+        items: Union[Mapping[str, Any], Iterable[Tuple[str, Any]]],
+        source_timestamp: Optional[float] = None,
+    ):
+        """Store several values at once, notifying subscribers once the whole batch is stored.
+
+        Each value passes through its matching middlewares just like with `put`, after which
+        all surviving values are written to the vault in a single operation. Regular
+        subscribers are then called once per sample, subscribers registered with `batch=True`
+        are called once with the list of all their matching samples and every matching
+        trigger is called once.
+
+        Args:
+            items (Union[Mapping[str, Any], Iterable[Tuple[str, Any]]]): The key/value pairs to store.
+            source_timestamp (Optional[float], optional): A timestamp supplied by the source of
+                the values, carried along in all samples. Defaults to None.
+        """
+        if isinstance(items, Mapping):
+            items = items.items()
+
+        stamped: List[Tuple[KeyExpr, Any, float, float, Optional[float]]] = []
+        keys: List[str] = []
+        for key, value in items:
+            ke: KeyExpr = KeyExpr.autocanonize(key)
+            key = str(ke)
+            timestamp, monotonic = time.time(), time.monotonic()
+
+            if self.metrics.enabled:
+                self.metrics.count_put(key)
+
+            # Pass through middlewares
+            value = self._process(ke, key, value, monotonic, source_timestamp)
+            if value is not None:
+                stamped.append((ke, value, timestamp, monotonic, source_timestamp))
+                keys.append(key)
+
+        if not stamped:
+            return
+
+        # Add all final values to vault at once
+        samples = self._vault.put_many(stamped)
+
+        call = self.metrics.call if self.metrics.enabled else _call
+
+        # Trigger subscribers, collecting the batches and triggers to fire once
+        batches: Dict[Subscriber, List[Sample]] = {}
+        triggers: Dict[Trigger, None] = {}
+        for key, sample in zip(keys, samples):
+            for subscriber in self._subscribers.match(key):
+                if subscriber.batch:
+                    batches.setdefault(subscriber, []).append(sample)
+                else:
+                    call(subscriber.callback, sample)
+
+            triggers.update(dict.fromkeys(self._triggers.match(key)))
+
+        for subscriber, batch in batches.items():
+            call(subscriber.callback, batch)
+
+        # Trigger triggers
+        for trigger in triggers:
+            call(trigger.callback)
+
+    def subscribe(
+        self,
+        *keys: str,
+        batch: bool = False,
+        executor: Optional[str] = None,
+        queue_size: int = 1024,
+        overflow: str = "block",
+        conflate: bool = False,
+    ) -> Registration:
+        """Decorator to subscribe a callback to one or more keys.
+
+        By default the callback runs inline on the publishing thread. With an `executor`, samples
+        are instead queued per subscriber and delivered in order on the shared worker thread
+        pool (`thread`) or on the background event loop (`loop`), so a slow callback does not
+        stall the publisher.
+
+        CPU-bound callbacks can run in the worker process pool (`process`) to use several
+        cores. The callback and the sample values must then be picklable, large bytes and
+        NumPy arrays being passed through shared memory. Calls run concurrently, so their
+        order is not guaranteed, and the side effects of the callback stay in the worker
+        process.
+
+        Coroutine functions are accepted as callbacks and scheduled as tasks on the event loop
+        running where `subscribe` was called, or on the background event loop if there is none.
+
+        With `conflate`, the callback only receives the latest sample of each key: while a
+        sample is pending, newer samples of the same key replace it in place. A slow callback
+        thus skips stale values instead of falling behind. Conflated subscribers are
+        dispatched on the worker thread pool unless another `executor` is given.
+
+        The decorator is a `Registration` handle: closing it unsubscribes the callback.
+
+        Args:
+            *keys (str): One or more keys to subscribe to.
+            batch (bool, optional): If True, the callback receives a list of samples, holding all
+                matching samples of a `put_many` call. Defaults to False.
+            executor (Optional[str], optional): `thread`, `loop` or `process` to dispatch off the
+                publishing thread, None to call inline. Defaults to None.
+            queue_size (int, optional): Maximum number of pending samples when dispatching.
+                Defaults to 1024.
+            overflow (str, optional): What to do when the queue is full: `block`, `drop_oldest`,
+                `drop_newest` or `latest`. Defaults to "block". Publishers running on the
+                threads that drain the queues, such as other dispatched callbacks, are never
+                blocked, to avoid deadlocks: the queue grows past its bound instead.
+            conflate (bool, optional): If True, deliver only the latest pending sample of each
+                key. Defaults to False.
+
+        Returns:
+            Registration: A decorator that registers the callback as a subscriber, and a
+                handle to unsubscribe with.
+
+        Raises:
+            ValueError: If both `batch` and `conflate` are requested, or a coroutine function
+                is to run in the process pool.
+        """
+        logger.debug("Subscribing to: %s", keys)
+        kes = [KeyExpr.autocanonize(key) for key in keys]
+
+        key = None
+        if conflate:
+            if batch:
+                raise ValueError("Batched subscribers cannot be conflated")
+            executor, key = executor or "thread", _sample_key
+
+        def records(callback: Callable) -> List[Subscriber]:
+            target = _dispatcher(callback, executor, queue_size, overflow, key)
+            logger.debug("Adding internal Subscribers for %s", kes)
+            return [Subscriber(ke, target, batch) for ke in kes]
+
+        return Registration(self._subscribers, records)
+
+    def trigger(
+        self,
+        *keys: str,
+        executor: Optional[str] = None,
+        queue_size: int = 1024,
+        overflow: str = "block",
+    ) -> Registration:
+        """Decorator to trigger a callback when one or more keys are published.
+
+        Args:
+            *keys (str): One or more keys to trigger on.
+            executor (Optional[str], optional): `thread`, `loop` or `process` to dispatch off the
+                publishing thread, None to call inline. Defaults to None.
+            queue_size (int, optional): Maximum number of pending calls when dispatching.
+                Defaults to 1024.
+            overflow (str, optional): What to do when the queue is full: `block`, `drop_oldest`,
+                `drop_newest` or `latest`. Defaults to "block".
+
+        Returns:
+            Registration: A decorator that registers the callback as a trigger, and a
+                handle to remove the trigger with.
+        """
+        logger.debug("Adding trigger for: %s", keys)
+        kes = [KeyExpr.autocanonize(key) for key in keys]
+
+        def records(callback: Callable) -> List[Trigger]:
+            target = _dispatcher(callback, executor, queue_size, overflow)
+            logger.debug("Adding internal Triggers for %s", kes)
+            return [Trigger(ke, target) for ke in kes]
+
+        return Registration(self._triggers, records)
+
+    def stream(
+        self, *keys: str, maxsize: int = 1024, overflow: str = "block"
+    ) -> Stream:
+        """Subscribe to one or more keys as an asynchronous iterator of samples.
+
+        Example:
+            ```python
+            async with skarv.stream("sensor/**") as samples:
+                async for sample in samples:
+                    print(sample.value)
+            ```
+
+        Args:
+            *keys (str): One or more keys to subscribe to.
+            maxsize (int, optional): Maximum number of buffered samples. Defaults to 1024.
+            overflow (str, optional): What to do when the buffer is full: `block` (hold back
+                the publisher), `drop_oldest`, `drop_newest` or `latest`. Defaults to "block".
+
+        Returns:
+            Stream: The stream of samples, to be closed when no longer needed.
+        """
+        logger.debug("Streaming: %s", keys)
+
+        kes = [KeyExpr.autocanonize(key) for key in keys]
+        registration = Registration(
+            self._subscribers, lambda push: [Subscriber(ke, push) for ke in kes]
+        )
+
+        samples = Stream(maxsize, overflow, lambda _: registration.close())
+        registration(samples.push)
+
+        return samples
+
+    def get(self, key: str) -> Union[Sample, List[Sample], None]:
+        """Retrieve sample(s) whose keys intersect with the given key.
+
+        For key expressions without wildcards, returns a single Sample or None.
+        For key expressions with wildcards, returns a list of matching samples.
+
+        Args:
+            key (str): The key to search for.
+
+        Returns:
+            Union[Sample, List[Sample], None]: For non-wildcard keys, returns a single Sample or None if not found.
+                                                For wildcard keys, returns a list of matching samples.
+        """
+        logger.debug("Getting for %s", key)
+        req_ke = KeyExpr.autocanonize(key)
+
+        samples = self._vault.find(req_ke)
+
+        # Return single sample for non-wildcard keys, list for wildcard keys
+        has_wildcards = "*" in key or "$" in key
+        if has_wildcards:
+            return samples
+        else:
+            return samples[0] if samples else None
+
+    def set_history(self, key: str, depth: int):
+        """Keep the most recent values of all keys matching a key expression.
+
+        Histories are stored once, in ring buffers packed into arrays for numeric values, and
+        are read with `get_history`.
+
+        Args:
+            key (str): The key expression to keep history for.
+            depth (int): The number of values to keep per key, 0 to disable.
+        """
+        logger.debug("Setting history depth of %s to %d", key, depth)
+        self._vault.configure_history(KeyExpr.autocanonize(key), depth)
+
+    def get_history(
+        self, key: str, last_n: Optional[int] = None, since: Optional[float] = None
+    ) -> List[Sample]:
+        """Retrieve the recorded history of the keys intersecting the given key.
+
+        Only keys configured with `set_history` have a history. Only the requested part of
+        each history is read.
+
+        Args:
+            key (str): The key expression to retrieve the history for.
+            last_n (Optional[int], optional): Only the `last_n` most recent samples per key.
+                Defaults to None.
+            since (Optional[float], optional): Only samples put at or after this time, in seconds
+                since the epoch. Defaults to None.
+
+        Returns:
+            List[Sample]: The samples, oldest first.
+        """
+        req_ke = KeyExpr.autocanonize(key)
+        return self._vault.history(req_ke, last_n, since)
+
+    def register_middleware(
+        self,
+        key: str,
+        operator: Callable[[Any], Any],
+        priority: int = 0,
+        executor: Optional[str] = None,
+    ) -> Registration:
+        """Register a middleware operator for a given key.
+
+        When several middlewares match a key, those with a higher priority run first and
+        those with equal priorities run in registration order. The matching middlewares are
+        compiled once per key into a single pipeline, cached along with the match results.
+
+        With `executor="process"`, a CPU-bound operator runs in the worker process pool:
+        `put` returns as soon as the value is submitted, and the result is passed through the
+        following middlewares, stored and published once ready, in the order of the puts.
+        The operator and the values must be picklable, large bytes and NumPy arrays being
+        passed through shared memory, and the operator should not keep state between calls.
+
+        Args:
+            key (str): The key to associate with the middleware.
+            operator (Callable[[Any], Any]): The operator function to process values.
+            priority (int, optional): The priority of the middleware. Defaults to 0.
+            executor (Optional[str], optional): `process` to run the operator in the process
+                pool, None to run it inline. Defaults to None.
+
+        Returns:
+            Registration: A handle to remove the middleware with.
+
+        Raises:
+            ValueError: If the executor is unknown.
+        """
+        logger.debug("Registering middleware on %s", key)
+        if executor == "process":
+            operator = ProcessMiddleware(operator)
+        elif executor is not None:
+            raise ValueError(
+                f"Unknown middleware executor {executor!r}, expected 'process' or None"
+            )
+
+        ke = KeyExpr.autocanonize(key)
+        registration = Registration(
+            self._middlewares, lambda operator: [Middleware(ke, operator, priority)]
+        )
+        registration(operator)
+        return registration
+
+    def configure_match_cache(self, maxsize: Optional[int]):
+        """Bound the number of cached match results kept per registry.
+
+        Skarv caches, per published key expression, which subscribers, middlewares and
+        triggers it matches. Each of these caches evicts its oldest entries beyond
+        `maxsize`, keeping memory bounded for high-cardinality keys.
+
+        Args:
+            maxsize (Optional[int]): Maximum number of cached entries per registry, None for unbounded.
+        """
+        logger.debug("Setting match cache size to %s", maxsize)
+        for registry in (self._subscribers, self._middlewares, self._triggers):
+            registry.cache_resize(maxsize)
+
+    def match_cache_info(self) -> Dict[str, CacheInfo]:
+        """Report hit, miss and eviction statistics of the match caches.
+
+        Returns:
+            Dict[str, CacheInfo]: The cache statistics for `subscribers`, `middlewares` and `triggers`.
+        """
+        return {
+            "subscribers": self._subscribers.cache_info(),
+            "middlewares": self._middlewares.cache_info(),
+            "triggers": self._triggers.cache_info(),
+        }
@@ -1,11 +1,275 @@
+import os
+import math
 import logging
 import asyncio
+import warnings
 import threading
-from typing import Awaitable
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
 
 logger = logging.getLogger(__name__)
 
+MISSED_TICK_POLICIES = ("skip", "catch_up", "coalesce")
+
+# Maximum number of synchronous periodic jobs running at once
+TIMER_WORKERS = 4
+
+# Number of processes running CPU-bound subscribers and middlewares
+PROCESS_WORKERS = os.cpu_count() or 1
+
 _background_loop = None
+_background_loop_lock = threading.Lock()
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_thread_pool_lock = threading.Lock()
+
+# Marks the worker threads of the thread pool
+_worker = threading.local()
+
+_timer_pool: Optional[ThreadPoolExecutor] = None
+_timer_pool_lock = threading.Lock()
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Get the background asyncio event loop, starting it in a new thread if not running.
+
+    Returns:
+        asyncio.AbstractEventLoop: The background event loop.
+    """
+    global _background_loop
+
+    with _background_loop_lock:
+        if _background_loop is None:
+            logger.info("Starting asyncio event loop in background thread")
+            _background_loop = asyncio.new_event_loop()
+
+            def _initializer():
+                asyncio.set_event_loop(_background_loop)
+                _background_loop.run_forever()
+                logger.info("Background event loop initialized.")
+
+            threading.Thread(target=_initializer, daemon=True).start()
+
+    return _background_loop
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Get the thread pool used to run callbacks off the publishing thread.
+
+    The pool is created on first use.
+
+    Returns:
+        ThreadPoolExecutor: The shared worker pool.
+    """
+    global _thread_pool
+
+    with _thread_pool_lock:
+        if _thread_pool is None:
+            logger.info("Starting worker thread pool")
+            _thread_pool = ThreadPoolExecutor(
+                thread_name_prefix="skarv", initializer=_mark_worker
+            )
+
+    return _thread_pool
+
+
+def _mark_worker():
+    _worker.in_thread_pool = True
+
+
+def _in_thread_pool() -> bool:
+    return getattr(_worker, "in_thread_pool", False)
+
+
+def get_timer_pool() -> ThreadPoolExecutor:
+    """Get the bounded thread pool running synchronous periodic jobs.
+
+    The pool is created on first use, with `TIMER_WORKERS` threads, and is separate from
+    the pools running callbacks so that slow jobs cannot starve them.
+
+    Returns:
+        ThreadPoolExecutor: The timer pool.
+    """
+    global _timer_pool
+
+    with _timer_pool_lock:
+        if _timer_pool is None:
+            logger.info("Starting timer thread pool")
+            _timer_pool = ThreadPoolExecutor(
+                max_workers=TIMER_WORKERS, thread_name_prefix="skarv-timer"
+            )
+
+    return _timer_pool
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the process pool running CPU-bound subscribers and middlewares.
+
+    The pool is created on first use, with `PROCESS_WORKERS` processes. Worker processes are
+    spawned rather than forked, as forking would copy the state of the running threads
+    and event loops, so the functions sent to them must be importable by reference.
+
+    Returns:
+        ProcessPoolExecutor: The shared process pool.
+    """
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is None:
+            logger.info("Starting worker process pool")
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    return _process_pool
+
+
+class Job:
+    """A function called periodically from the background event loop.
+
+    Runs are scheduled on a fixed grid of monotonic deadlines, `interval` seconds apart, so
+    that the period neither drifts with execution times nor jumps with wall-clock changes.
+    All jobs share the timer queue of the background loop. Coroutine functions run as tasks
+    on the loop, other functions on the timer pool, and a job never overlaps with itself.
+
+    When a run ends after the next deadline has passed, the `missed` policy applies:
+
+    * `skip`: the missed deadlines are skipped, the job runs at the next deadline to come.
+    * `catch_up`: the job runs once per missed deadline, back to back, until caught up.
+    * `coalesce`: the job runs once right away for all missed deadlines.
+
+    Args:
+        func (Callable): The function or coroutine function to call, without arguments.
+        interval (float): The interval in seconds between calls.
+        wait_first (bool, optional): If True, wait for the interval before the first call.
+            Defaults to False.
+        missed (str, optional): The missed tick policy. Defaults to "coalesce".
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        interval: float,
+        wait_first: bool = False,
+        missed: str = "coalesce",
+    ):
+        if missed not in MISSED_TICK_POLICIES:
+            raise ValueError(
+                f"Unknown missed tick policy {missed!r}, expected one of {MISSED_TICK_POLICIES}"
+            )
+        if interval <= 0:
+            raise ValueError(f"The interval must be positive, got {interval}")
+
+        self.func = func
+        self.interval = interval
+        self.missed = missed
+        self.cancelled = False
+
+        self._is_coroutine = asyncio.iscoroutinefunction(func)
+        self._loop = get_background_loop()
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._running = False
+        self._restarted = False
+        self._deadline = 0.0
+        self._started = 0.0
+
+        self._loop.call_soon_threadsafe(self._restart, self._first_deadline(wait_first))
+
+    def cancel(self):
+        """Stop calling the function. A run in progress completes."""
+        self.cancelled = True
+        self._loop.call_soon_threadsafe(self._disarm)
+
+    def reschedule(self, interval: Optional[float] = None, wait_first: bool = True):
+        """Restart the schedule from now, optionally with a new interval.
+
+        Args:
+            interval (Optional[float], optional): The new interval in seconds, None to keep
+                the current one. Defaults to None.
+            wait_first (bool, optional): If True, wait for the interval before the next call.
+                Defaults to True.
+        """
+        if interval is not None:
+            if interval <= 0:
+                raise ValueError(f"The interval must be positive, got {interval}")
+            self.interval = interval
+        self._loop.call_soon_threadsafe(self._restart, self._first_deadline(wait_first))
+
+    def _first_deadline(self, wait_first: bool) -> float:
+        # The loop clock is monotonic and may be read from any thread
+        return self._loop.time() + (self.interval if wait_first else 0.0)
+
+    def _restart(self, deadline: float):
+        self._disarm()
+        self._deadline = deadline
+        if self._running:
+            self._restarted = True
+        else:
+            self._arm()
+
+    def _arm(self):
+        if not self.cancelled:
+            self._handle = self._loop.call_at(self._deadline, self._run)
+
+    def _disarm(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _run(self):
+        self._handle = None
+        self._running = True
+        self._started = self._loop.time()
+
+        if self._is_coroutine:
+            self._loop.create_task(self.func()).add_done_callback(self._done)
+            return
+
+        try:
+            future = get_timer_pool().submit(self.func)
+        except RuntimeError:
+            # The interpreter is shutting down
+            logger.debug("Stopping periodic job %s", self.func)
+            return
+
+        future.add_done_callback(
+            lambda future: self._loop.call_soon_threadsafe(self._done, future)
+        )
+
+    def _done(self, future: "Future"):
+        self._running = False
+
+        if not future.cancelled() and (exc := future.exception()) is not None:
+            logger.error(f"call_every: Exception in {self.func}", exc_info=exc)
+
+        now = self._loop.time()
+        if now - self._started > self.interval:
+            warnings.warn(
+                f"Function {self.func} has an execution time the exceeds"
+                f" the requested execution interval of {self.interval}s!",
+                UserWarning,
+            )
+
+        # A restart during the run already set the next deadline
+        if self._restarted:
+            self._restarted = False
+        else:
+            self._deadline += self.interval
+
+            if (late := now - self._deadline) > 0:
+                if self.missed == "skip":
+                    self._deadline += (
+                        math.floor(late / self.interval) + 1
+                    ) * self.interval
+                elif self.missed == "coalesce":
+                    self._deadline += math.floor(late / self.interval) * self.interval
+
+        self._arm()
 
 
 def schedule_coroutine(coro: Awaitable) -> asyncio.Future:
@@ -19,18 +283,7 @@ def schedule_coroutine(coro: Awaitable) -> asyncio.Future:
     Returns:
         asyncio.Future: A Future representing the execution of the coroutine.
     """
-    global _background_loop
-
-    if _background_loop is None:
-        logger.info("Starting asyncio event loop in background thread")
-        _background_loop = asyncio.new_event_loop()
-
-        def _initializer():
-            asyncio.set_event_loop(_background_loop)
-            _background_loop.run_forever()
-            logger.info("Background event loop initialized.")
-
-        threading.Thread(target=_initializer, daemon=True).start()
+    loop = get_background_loop()
 
     logger.debug("Scheduling coroutine...")
-    return asyncio.run_coroutine_threadsafe(coro, _background_loop)
+    return asyncio.run_coroutine_threadsafe(coro, loop)
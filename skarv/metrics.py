@@ -0,0 +1,280 @@
+import time
+import bisect
+import logging
+from threading import Lock
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from ._dispatch import CoroutineCallback, Dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS: Sequence[float] = (
+    1e-6,
+    5e-6,
+    1e-5,
+    5e-5,
+    1e-4,
+    5e-4,
+    1e-3,
+    5e-3,
+    1e-2,
+    5e-2,
+    1e-1,
+    5e-1,
+    1.0,
+)
+
+
+def callback_name(callback: Callable) -> str:
+    """Get a readable label for a callback, looking through skarv's dispatch wrappers.
+
+    Args:
+        callback (Callable): The callback.
+
+    Returns:
+        str: The module and qualified name of the callback.
+    """
+    while isinstance(callback, (Dispatcher, CoroutineCallback)):
+        callback = callback.callback
+
+    name = getattr(callback, "__qualname__", None) or type(callback).__qualname__
+    return f"{getattr(callback, '__module__', None) or '?'}.{name}"
+
+
+class Histogram:
+    """A latency histogram with fixed buckets.
+
+    Args:
+        bounds (Sequence[float]): The upper bounds of the buckets, in seconds.
+    """
+
+    def __init__(self, bounds: Sequence[float] = BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        """Record one observation.
+
+        Args:
+            seconds (float): The observed duration.
+        """
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Export the histogram with cumulative bucket counts.
+
+        Returns:
+            Dict[str, Any]: `buckets` (upper bound to cumulative count), `sum` and `count`.
+        """
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class Metrics:
+    """Opt-in instrumentation of the broker hot path.
+
+    While disabled, the broker only checks the `enabled` flag. While enabled, it records
+    the number of puts per key expression, the time spent in each middleware and callback
+    and the number of values dropped by each middleware. Callback times are those seen by
+    the publisher, i.e. the time to enqueue for callbacks dispatched to an executor.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = Lock()
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._since = time.monotonic()
+            self._puts: Dict[str, int] = defaultdict(int)
+            self._dropped: Dict[str, Dict[str, int]] = defaultdict(
+                lambda: defaultdict(int)
+            )
+            self._middlewares: Dict[str, Histogram] = defaultdict(Histogram)
+            self._callbacks: Dict[str, Histogram] = defaultdict(Histogram)
+
+    def gauge(self, name: str, func: Callable[[], float]):
+        """Register a gauge, evaluated when exporting.
+
+        Args:
+            name (str): The name of the gauge.
+            func (Callable[[], float]): Returns the current value of the gauge.
+        """
+        self._gauges[name] = func
+
+    def count_put(self, key_expr: Any):
+        """Count a put to a key expression.
+
+        Args:
+            key_expr (Any): The key expression put to.
+        """
+        with self._lock:
+            self._puts[str(key_expr)] += 1
+
+    def run_middlewares(
+        self, key_expr: Any, middlewares: Iterable[Any], value: Any
+    ) -> Optional[Any]:
+        """Pass a value through middlewares, timing each and counting drops.
+
+        Args:
+            key_expr (Any): The key expression of the value.
+            middlewares (Iterable[Any]): The middlewares to apply, in order.
+            value (Any): The value.
+
+        Returns:
+            Optional[Any]: The processed value, None if dropped.
+        """
+        for middleware in middlewares:
+            start = time.perf_counter()
+            value = middleware.operator(value)
+            elapsed = time.perf_counter() - start
+
+            name = callback_name(middleware.operator)
+            with self._lock:
+                self._middlewares[name].observe(elapsed)
+                if value is None:
+                    self._dropped[str(key_expr)][name] += 1
+
+            if value is None:
+                return None
+
+        return value
+
+    def call(self, callback: Callable, *args: Any):
+        """Call a subscriber or trigger callback, timing it.
+
+        Args:
+            callback (Callable): The callback.
+            *args (Any): The arguments to call it with.
+        """
+        start = time.perf_counter()
+        try:
+            callback(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._callbacks[callback_name(callback)].observe(elapsed)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Export everything recorded so far as a dict.
+
+        Returns:
+            Dict[str, Any]: `uptime` in seconds, `puts` per key expression (`count` and
+                `rate` per second), `dropped` counts per key expression and middleware,
+                `middlewares` and `callbacks` latency histograms and `gauges`.
+        """
+        with self._lock:
+            uptime = time.monotonic() - self._since
+            return {
+                "uptime": uptime,
+                "puts": {
+                    key: {"count": count, "rate": count / uptime if uptime else 0.0}
+                    for key, count in self._puts.items()
+                },
+                "dropped": {key: dict(counts) for key, counts in self._dropped.items()},
+                "middlewares": {
+                    name: hist.to_dict() for name, hist in self._middlewares.items()
+                },
+                "callbacks": {
+                    name: hist.to_dict() for name, hist in self._callbacks.items()
+                },
+                "gauges": {name: func() for name, func in self._gauges.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """Export everything recorded so far in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics as text.
+        """
+        snapshot = self.snapshot()
+        lines: List[str] = []
+
+        lines.append("# TYPE skarv_puts_total counter")
+        for key, put in snapshot["puts"].items():
+            lines.append(f"skarv_puts_total{_labels(key_expr=key)} {put['count']}")
+
+        lines.append("# TYPE skarv_middleware_dropped_total counter")
+        for key, counts in snapshot["dropped"].items():
+            for name, count in counts.items():
+                labels = _labels(key_expr=key, middleware=name)
+                lines.append(f"skarv_middleware_dropped_total{labels} {count}")
+
+        for metric, label, hists in (
+            ("skarv_middleware_duration_seconds", "middleware", "middlewares"),
+            ("skarv_callback_duration_seconds", "callback", "callbacks"),
+        ):
+            lines.append(f"# TYPE {metric} histogram")
+            for name, hist in snapshot[hists].items():
+                for bound, count in hist["buckets"].items():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _labels(**{label: name, "le": le})
+                    lines.append(f"{metric}_bucket{labels} {count}")
+                lines.append(f"{metric}_sum{_labels(**{label: name})} {hist['sum']}")
+                lines.append(
+                    f"{metric}_count{_labels(**{label: name})} {hist['count']}"
+                )
+
+        for name, value in snapshot["gauges"].items():
+            lines.append(f"# TYPE skarv_{name} gauge")
+            lines.append(f"skarv_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels: str) -> str:
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+_metrics = Metrics()
+
+
+def enable():
+    """Start recording metrics of the broker hot path."""
+    logger.info("Enabling metrics")
+    _metrics.enabled = True
+
+
+def disable():
+    """Stop recording metrics, keeping what was recorded so far."""
+    logger.info("Disabling metrics")
+    _metrics.enabled = False
+
+
+def reset():
+    """Forget all recorded metrics."""
+    _metrics.reset()
+
+
+def snapshot() -> Dict[str, Any]:
+    """Export the recorded metrics as a dict.
+
+    Returns:
+        Dict[str, Any]: See `Metrics.snapshot`.
+    """
+    return _metrics.snapshot()
+
+
+def to_prometheus() -> str:
+    """Export the recorded metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: The metrics as text.
+    """
+    return _metrics.to_prometheus()
@@ -1,9 +1,12 @@
-import time
+import math
+import bisect
 import operator
 from threading import Lock
-from functools import cache
 from collections import deque
-from typing import Callable, Any, Union, Sequence
+from typing import Callable, Any, List, Optional, Union, Sequence
+
+from ._clock import now, resumer
+from .concurrency import get_background_loop, get_thread_pool
 
 Numeric = Union[int, float]
 
@@ -11,6 +14,8 @@ Numeric = Union[int, float]
 def throttle(at_most_every: float) -> Callable[[Any], Any | None]:
     """Create a throttling middleware that allows values through at most once every specified interval.
 
+    Intervals are measured on the monotonic timestamps of the samples.
+
     Args:
         at_most_every (float): Minimum interval in seconds between allowed values.
 
@@ -18,20 +23,20 @@ def throttle(at_most_every: float) -> Callable[[Any], Any | None]:
         Callable[[Any], Any | None]: Middleware function that returns the value or None if throttled.
     """
     lock = Lock()
-    last_call_time = 0.0
+    last_call_time = None
 
     def _throttler(value: Any) -> Any | None:
         nonlocal last_call_time
 
         with lock:
 
-            now = time.time()
+            t = now()
 
             # Should we throttle?
-            if (now - last_call_time) < at_most_every:
+            if last_call_time is not None and (t - last_call_time) < at_most_every:
                 return None
 
-            last_call_time = now
+            last_call_time = t
             return value
 
     return _throttler
@@ -40,6 +45,10 @@ def throttle(at_most_every: float) -> Callable[[Any], Any | None]:
 def average(no_of_samples: int) -> Callable[[Numeric], Numeric]:
     """Create a middleware that computes the moving average over a window of samples.
 
+    The sum of the window is kept up to date as values enter and leave it, and is
+    recomputed once every `no_of_samples` values to stop floating point errors from
+    accumulating, for an amortized constant cost per value.
+
     Args:
         no_of_samples (int): Number of samples to average over.
 
@@ -48,28 +57,38 @@ def average(no_of_samples: int) -> Callable[[Numeric], Numeric]:
     """
     lock = Lock()
     window = deque(maxlen=no_of_samples)
+    total = 0
+    count = 0
 
     def _averager(value: Numeric) -> Numeric:
-        nonlocal window
+        nonlocal total, count
 
         with lock:
 
+            if len(window) == no_of_samples:
+                total -= window[0]
             window.append(value)
+            total += value
 
-            return sum(window) / len(window)
-
-    return _averager
+            count += 1
+            if count == no_of_samples:
+                total = sum(window)
+                count = 0
 
+            return total / len(window)
 
-@cache
-def _get_weights(no_of_samples: int) -> Sequence[float]:
-    sum_of_smaller_integers = (no_of_samples - 1) * (no_of_samples / 2) + no_of_samples
-    return [number / sum_of_smaller_integers for number in range(no_of_samples, 0, -1)]
+    return _averager
 
 
 def weighted_average(no_of_samples: int) -> Callable[[Numeric], Numeric]:
     """Create a middleware that computes a weighted moving average over a window of samples.
 
+    The newest of `k` values in the window weighs `k`, the oldest weighs 1. The weighted
+    sum is updated incrementally: when a value leaves a full window, every remaining
+    weight drops by one, which amounts to subtracting the plain sum of the window. Both
+    sums are recomputed once every `no_of_samples` values, for an amortized constant cost
+    per value.
+
     Args:
         no_of_samples (int): Number of samples to use for the weighted average.
 
@@ -78,22 +97,218 @@ def weighted_average(no_of_samples: int) -> Callable[[Numeric], Numeric]:
     """
     lock = Lock()
     window = deque(maxlen=no_of_samples)
+    total = 0
+    weighted = 0
+    count = 0
 
     def _averager(value: Numeric) -> Numeric:
-        nonlocal window
+        nonlocal total, weighted, count
 
         with lock:
 
-            window.appendleft(value)
+            if len(window) == no_of_samples:
+                weighted -= total
+                total -= window[0]
+            window.append(value)
+            total += value
+            weighted += len(window) * value
+
+            count += 1
+            if count == no_of_samples:
+                total = sum(window)
+                weighted = sum(map(operator.mul, window, range(1, len(window) + 1)))
+                count = 0
 
-            return sum(map(operator.mul, window, _get_weights(len(window))))
+            length = len(window)
+            return weighted / (length * (length + 1) / 2)
 
     return _averager
 
 
+def variance(no_of_samples: int) -> Callable[[Numeric], float]:
+    """Create a middleware that computes the moving (population) variance over a window of samples.
+
+    The mean and the sum of squared deviations are updated with Welford's algorithm as
+    values enter and leave the window, and recomputed once every `no_of_samples` values,
+    for an amortized constant cost per value.
+
+    Args:
+        no_of_samples (int): Number of samples to compute the variance over.
+
+    Returns:
+        Callable[[Numeric], float]: Middleware function that returns the moving variance.
+    """
+    lock = Lock()
+    window = deque(maxlen=no_of_samples)
+    mean = 0.0
+    squares = 0.0
+    count = 0
+
+    def _variance(value: Numeric) -> float:
+        nonlocal mean, squares, count
+
+        with lock:
+
+            if len(window) == no_of_samples:
+                oldest = window[0]
+                window.append(value)
+                previous = mean
+                mean += (value - oldest) / no_of_samples
+                squares += (value - oldest) * (value - mean + oldest - previous)
+            else:
+                window.append(value)
+                delta = value - mean
+                mean += delta / len(window)
+                squares += delta * (value - mean)
+
+            count += 1
+            if count == no_of_samples:
+                mean = sum(window) / len(window)
+                squares = sum((sample - mean) ** 2 for sample in window)
+                count = 0
+
+            return max(squares, 0.0) / len(window)
+
+    return _variance
+
+
+def standard_deviation(no_of_samples: int) -> Callable[[Numeric], float]:
+    """Create a middleware that computes the moving (population) standard deviation over a window of samples.
+
+    Args:
+        no_of_samples (int): Number of samples to compute the standard deviation over.
+
+    Returns:
+        Callable[[Numeric], float]: Middleware function that returns the moving standard deviation.
+    """
+    _variance = variance(no_of_samples)
+
+    def _deviation(value: Numeric) -> float:
+        return math.sqrt(_variance(value))
+
+    return _deviation
+
+
+def exponential_moving_average(alpha: float) -> Callable[[Numeric], float]:
+    """Create a middleware that computes the exponential moving average of the input values.
+
+    Args:
+        alpha (float): The smoothing factor in (0, 1], the weight of the newest value.
+
+    Returns:
+        Callable[[Numeric], float]: Middleware function that returns the exponential moving average.
+    """
+    if not 0 < alpha <= 1:
+        raise ValueError(f"The smoothing factor must be in (0, 1], got {alpha}")
+
+    lock = Lock()
+    ema = None
+
+    def _averager(value: Numeric) -> float:
+        nonlocal ema
+
+        with lock:
+
+            ema = value if ema is None else ema + alpha * (value - ema)
+            return ema
+
+    return _averager
+
+
+def _rolling_extreme(
+    no_of_samples: int, dominates: Callable[[Numeric, Numeric], bool]
+) -> Callable[[Numeric], Numeric]:
+    lock = Lock()
+    # (index, value) pairs, none dominating the ones before it
+    candidates = deque()
+    index = 0
+
+    def _extreme(value: Numeric) -> Numeric:
+        nonlocal index
+
+        with lock:
+
+            while candidates and not dominates(candidates[-1][1], value):
+                candidates.pop()
+            candidates.append((index, value))
+
+            if candidates[0][0] <= index - no_of_samples:
+                candidates.popleft()
+
+            index += 1
+            return candidates[0][1]
+
+    return _extreme
+
+
+def rolling_min(no_of_samples: int) -> Callable[[Numeric], Numeric]:
+    """Create a middleware that computes the minimum over a window of samples.
+
+    A monotonic queue of the candidate minima is kept, for an amortized constant cost per
+    value.
+
+    Args:
+        no_of_samples (int): Number of samples to take the minimum over.
+
+    Returns:
+        Callable[[Numeric], Numeric]: Middleware function that returns the rolling minimum.
+    """
+    return _rolling_extreme(no_of_samples, operator.lt)
+
+
+def rolling_max(no_of_samples: int) -> Callable[[Numeric], Numeric]:
+    """Create a middleware that computes the maximum over a window of samples.
+
+    A monotonic queue of the candidate maxima is kept, for an amortized constant cost per
+    value.
+
+    Args:
+        no_of_samples (int): Number of samples to take the maximum over.
+
+    Returns:
+        Callable[[Numeric], Numeric]: Middleware function that returns the rolling maximum.
+    """
+    return _rolling_extreme(no_of_samples, operator.gt)
+
+
+def median(no_of_samples: int) -> Callable[[Numeric], Numeric]:
+    """Create a middleware that computes the moving median over a window of samples.
+
+    The window is also kept sorted, values being located by bisection.
+
+    Args:
+        no_of_samples (int): Number of samples to take the median over.
+
+    Returns:
+        Callable[[Numeric], Numeric]: Middleware function that returns the moving median.
+    """
+    lock = Lock()
+    window = deque(maxlen=no_of_samples)
+    ordered = []
+
+    def _median(value: Numeric) -> Numeric:
+
+        with lock:
+
+            if len(window) == no_of_samples:
+                del ordered[bisect.bisect_left(ordered, window[0])]
+            window.append(value)
+            bisect.insort(ordered, value)
+
+            middle = len(ordered) // 2
+            if len(ordered) % 2:
+                return ordered[middle]
+            return (ordered[middle - 1] + ordered[middle]) / 2
+
+    return _median
+
+
 def differentiate() -> Callable[[Numeric], Numeric | None]:
     """Create a middleware that computes the numerical derivative of the input values.
 
+    The time step is taken from the monotonic timestamps of the samples. Values without a
+    time step since the previous one are dropped.
+
     Returns:
         Callable[[Numeric], Numeric | None]: Middleware function that returns the derivative or None for the first value.
     """
@@ -106,45 +321,166 @@ def differentiate() -> Callable[[Numeric], Numeric | None]:
 
         with lock:
 
+            t = now()
+
             if last_value is None:
                 last_value = value
-                last_time = time.time()
+                last_time = t
                 return None
 
-            now = time.time()
+            if t <= last_time:
+                return None
 
-            derivative = (value - last_value) / (now - last_time)
+            derivative = (value - last_value) / (t - last_time)
 
             last_value = value
-            last_time = now
+            last_time = t
 
             return derivative
 
     return _differentiator
 
 
-def batch(size: int) -> Callable[[Any], Sequence[Any] | None]:
+def _collector(
+    size: Optional[int],
+    max_latency: Optional[float],
+    reduce: Callable[[List[Any]], Any],
+) -> Callable[[Any], Any | None]:
+    lock = Lock()
+    values = []
+    opened = 0.0
+    # Identifies the current collection, so that stale timers do nothing
+    generation = 0
+
+    def _flush(expected: int, resume: Callable[[Any], None]):
+        nonlocal generation
+
+        with lock:
+            if generation != expected or not values:
+                return
+
+            output = reduce(values)
+            values.clear()
+            generation += 1
+
+        resume(output)
+
+    def _collect(value: Any) -> Any | None:
+        nonlocal opened, generation
+
+        with lock:
+
+            output = None
+
+            if max_latency is not None:
+                t = now()
+
+                # The collection timed out before its timer fired
+                if values and t - opened >= max_latency:
+                    output = reduce(values)
+                    values.clear()
+                    generation += 1
+
+                if not values:
+                    opened = t
+                    if (resume := resumer(_collect)) is not None:
+                        loop = get_background_loop()
+                        loop.call_soon_threadsafe(
+                            loop.call_later,
+                            max_latency,
+                            get_thread_pool().submit,
+                            _flush,
+                            generation,
+                            resume,
+                        )
+
+            values.append(value)
+
+            if size is not None and len(values) >= size:
+                output = reduce(values)
+                values.clear()
+                generation += 1
+
+            return output
+
+    return _collect
+
+
+def batch(
+    size: int, max_latency: Optional[float] = None
+) -> Callable[[Any], Sequence[Any] | None]:
     """Create a middleware that batches input values and outputs them as a sequence when the batch size is reached.
 
+    With a `max_latency`, a partial batch is also emitted once its first value is
+    `max_latency` seconds old, so that the latency stays bounded on slow topics. Within a
+    `put`, the partial batch is then flushed from a timer on the background event loop
+    and published by a worker thread, passing through the remaining middlewares. Called
+    directly, it is emitted with the next value instead.
+
     Args:
         size (int): The number of values to collect before emitting a batch.
+        max_latency (Optional[float], optional): The maximum time in seconds a value waits
+            in a partial batch. Defaults to None.
 
     Returns:
         Callable[[Any], Sequence[Any] | None]: Middleware function that returns a batch or None if not enough values have been collected.
     """
+    return _collector(size, max_latency, tuple)
+
+
+def time_average(seconds: float) -> Callable[[Numeric], Numeric]:
+    """Create a middleware that computes the moving average over a sliding time window.
+
+    The window holds the values put during the last `seconds`, measured on the monotonic
+    timestamps of the samples. As with `average`, the sum of the window is updated as
+    values enter and leave it, for an amortized constant cost per value.
+
+    Args:
+        seconds (float): The length of the window in seconds.
+
+    Returns:
+        Callable[[Numeric], Numeric]: Middleware function that returns the moving average.
+    """
     lock = Lock()
-    batch = []
+    window = deque()
+    total = 0
+    count = 0
 
-    def _batcher(value: Any) -> Sequence[Any] | None:
+    def _averager(value: Numeric) -> Numeric:
+        nonlocal total, count
 
         with lock:
-            batch.append(value)
 
-            if len(batch) >= size:
-                output = tuple(batch)
-                batch.clear()
-                return output
+            t = now()
+
+            while window and window[0][0] <= t - seconds:
+                total -= window.popleft()[1]
+            window.append((t, value))
+            total += value
 
-            return None
+            count += 1
+            if count >= len(window):
+                total = sum(value for _, value in window)
+                count = 0
 
-    return _batcher
+            return total / len(window)
+
+    return _averager
+
+
+def tumbling_average(seconds: float) -> Callable[[Numeric], Numeric | None]:
+    """Create a middleware that emits the average of consecutive, non-overlapping time windows.
+
+    A window opens with its first value and closes `seconds` later. Within a `put`, a
+    closed window is flushed from a timer on the background event loop and published by a
+    worker thread, passing through the remaining middlewares. Called directly, it is
+    emitted with the first value of the next window instead.
+
+    Args:
+        seconds (float): The length of the windows in seconds.
+
+    Returns:
+        Callable[[Numeric], Numeric | None]: Middleware function that returns the average of a
+            closed window or None.
+    """
+    return _collector(None, seconds, lambda values: sum(values) / len(values))
@@ -0,0 +1,659 @@
+"""A latest-value store shared by the processes of one host.
+
+A `SharedVault` keeps the latest value of each key in a block of shared memory, so that
+several processes read and write the same store without a network broker. Puts are
+announced to the subscribing processes over unix datagram sockets.
+
+The block holds a fixed number of slots of a fixed size, one per key. Each slot is
+guarded by a sequence lock: a writer makes its sequence number odd while it writes and
+even again when done, and readers retry until they copy the slot between two equal, even
+sequence numbers. Reads therefore never wait for a lock, while writers of the same slot
+are serialized by a lock on its byte range in a lock file.
+
+Example:
+    ```python
+    vault = SharedVault("sensors")
+
+    @vault.subscribe("sensor/**")
+    def _(sample):
+        print(sample.key_expr, sample.value)
+
+    vault.put("sensor/temperature", 22.5)
+    ```
+
+The vault relies on POSIX shared memory, record locks and unix sockets, and is not
+available on Windows.
+"""
+
+import os
+import sys
+import time
+import struct
+import pickle
+import socket
+import logging
+import tempfile
+import threading
+import zlib
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    raise ImportError("skarv.shared is only available on POSIX systems") from None
+
+from zenoh import KeyExpr
+
+from ._index import KeyExprIndex, _is_wild
+from ._sample import Sample
+from .broker import Registration, Subscriber, _dispatcher
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"SKARVSV1"
+
+# Magic, number of slots, key size and value size
+_HEADER = struct.Struct("<8sQQQ")
+
+# Sequence lock, key length, value length, timestamp, monotonic time, sequence number
+# and source timestamp, followed by the key and the value
+_SLOT = struct.Struct("<QIIddQd")
+_SEQLOCK = struct.Struct("<Q")
+_KEY_LENGTH = struct.Struct("<I")
+_KEY_LENGTH_OFFSET = 8
+
+# Notifications carry the index of the slot written
+_NOTIFICATION = struct.Struct("<I")
+_STOP = 0xFFFFFFFF
+
+# Number of retries of a read on a slot being written before checking for a dead writer
+_SPINS_BEFORE_CHECK = 100
+
+# Seconds to wait for the listening thread to finish a subscriber call when closing
+_CLOSE_TIMEOUT = 1.0
+
+# The coarsest modification time granularity of common filesystems, in nanoseconds. A
+# listing of the receivers made within it of the last change of their directory may miss
+# a receiver added since, without the modification time of the directory changing
+_MTIME_GRANULARITY = 2_000_000_000
+
+# Marks a missing source timestamp
+_NO_SOURCE_TIMESTAMP = float("nan")
+
+
+def _block(name: str) -> str:
+    return f"skarv-{name}"
+
+
+def _directory(name: str) -> str:
+    return os.path.join(tempfile.gettempdir(), _block(name))
+
+
+class SharedVault:
+    """A latest-value store in shared memory, with the `put`, `get` and `subscribe` API of a `Broker`.
+
+    The first process to open a vault of a given name creates it, later ones attach to it,
+    taking its dimensions from the existing block. The block outlives the processes using
+    it until `unlink` is called.
+
+    Values are pickled into fixed-size slots, so a vault holds at most `slots` keys and
+    values pickled to at most `value_size` bytes. Keys cannot be removed, and there are no
+    middlewares or histories. A value left half written by a process that died while
+    writing it reads as missing until its key is put again.
+
+    Subscribers are called on a thread of the subscribing process, once per notification
+    received. Notifications are not queued when a subscriber falls behind: a slow
+    subscriber may skip intermediate values of a key, but reads the latest value when
+    notified.
+
+    Args:
+        name (str): The name of the vault, shared by the processes using it.
+        slots (int, optional): The maximum number of keys, when creating. Defaults to 1024.
+        key_size (int, optional): The maximum size of a key in bytes, when creating.
+            Defaults to 128.
+        value_size (int, optional): The maximum size of a pickled value in bytes, when
+            creating. Defaults to 256.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        slots: int = 1024,
+        key_size: int = 128,
+        value_size: int = 256,
+    ):
+        self.name = name
+        self._directory = _directory(name)
+        os.makedirs(self._directory, exist_ok=True)
+
+        self._memory, self.slots, self.key_size, self.value_size = _open(
+            name, slots, key_size, value_size
+        )
+        self._buffer = self._memory.buf
+        self._stride = -(-(_SLOT.size + self.key_size + self.value_size) // 8) * 8
+
+        self._lock = threading.Lock()
+        self._locks = _Locks.open(self._directory, self.slots)
+        self._indices: Dict[str, int] = {}
+
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        self._receivers: List[str] = []
+        self._receivers_version = -1
+        self._receivers_listed = -1
+
+        self._subscribers = KeyExprIndex()
+        self._receiver: Optional[socket.socket] = None
+        self._receiver_path: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._closing = threading.Event()
+        self._delivered: Dict[int, int] = {}
+
+    def put(self, key: str, value: Any, source_timestamp: Optional[float] = None):
+        """Store a value for a given key and notify the subscribing processes.
+
+        Args:
+            key (str): The key to associate with the value, without wildcards.
+            value (Any): The value to store, which must be picklable.
+            source_timestamp (Optional[float], optional): A timestamp supplied by the source of
+                the value, carried along in the sample. Defaults to None.
+
+        Raises:
+            ValueError: If the key has wildcards or is too long, or the pickled value is
+                too large.
+            RuntimeError: If the key is new and all slots are taken.
+        """
+        ke: KeyExpr = KeyExpr.autocanonize(key)
+        key = str(ke)
+        if _is_wild(key):
+            raise ValueError(f"Cannot put to a key with wildcards: {key}")
+
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.value_size:
+            raise ValueError(
+                f"The pickled value takes {len(data)} bytes, more than the {self.value_size} of a slot"
+            )
+
+        timestamp, monotonic = time.time(), time.monotonic()
+        if source_timestamp is None:
+            source_timestamp = _NO_SOURCE_TIMESTAMP
+
+        index = self._claim(key)
+        offset = self._offset(index)
+        with self._locks.slot(index):
+            seqlock, _, _, _, _, sequence, _ = _SLOT.unpack_from(self._buffer, offset)
+            # An odd sequence lock was left by a writer that died while writing
+            seqlock += seqlock & 1
+
+            _SEQLOCK.pack_into(self._buffer, offset, seqlock + 1)
+            start = offset + _SLOT.size + self.key_size
+            self._buffer[start : start + len(data)] = data
+            _SLOT.pack_into(
+                self._buffer,
+                offset,
+                seqlock + 1,
+                len(key.encode()),
+                len(data),
+                timestamp,
+                monotonic,
+                sequence + 1,
+                source_timestamp,
+            )
+            _SEQLOCK.pack_into(self._buffer, offset, seqlock + 2)
+
+        self._notify(index)
+
+    def get(self, key: str) -> Union[Sample, List[Sample], None]:
+        """Retrieve sample(s) whose keys intersect with the given key.
+
+        For key expressions without wildcards, returns a single Sample or None.
+        For key expressions with wildcards, returns a list of matching samples.
+
+        Args:
+            key (str): The key to search for.
+
+        Returns:
+            Union[Sample, List[Sample], None]: For non-wildcard keys, returns a single Sample or None if not found.
+                                                For wildcard keys, returns a list of matching samples.
+        """
+        req_ke = KeyExpr.autocanonize(key)
+
+        if not _is_wild(str(req_ke)):
+            index = self._find(str(req_ke))
+            return None if index is None else self._read(index)
+
+        samples = []
+        for index in range(self.slots):
+            if (slot_key := self._key(index)) is None:
+                continue
+            if not req_ke.intersects(KeyExpr(slot_key)):
+                continue
+            # Claimed slots hold no value until written
+            if (sample := self._read(index)) is not None:
+                samples.append(sample)
+        return samples
+
+    def subscribe(
+        self,
+        *keys: str,
+        executor: Optional[str] = None,
+        queue_size: int = 1024,
+        overflow: str = "block",
+    ) -> Registration:
+        """Decorator to subscribe a callback to one or more keys, put by any process.
+
+        Subscribing starts listening for notifications in this process. By default the
+        callback runs on the listening thread, see `Broker.subscribe` for the executors.
+
+        Args:
+            *keys (str): One or more keys to subscribe to.
+            executor (Optional[str], optional): `thread`, `loop` or `process` to dispatch off
+                the listening thread, None to call inline. Defaults to None.
+            queue_size (int, optional): Maximum number of pending samples when dispatching.
+                Defaults to 1024.
+            overflow (str, optional): What to do when the queue is full: `block`, `drop_oldest`,
+                `drop_newest` or `latest`. Defaults to "block".
+
+        Returns:
+            Registration: A decorator that registers the callback as a subscriber, and a
+                handle to unsubscribe with.
+        """
+        kes = [KeyExpr.autocanonize(key) for key in keys]
+        self._listen()
+
+        def records(callback: Callable) -> List[Subscriber]:
+            target = _dispatcher(callback, executor, queue_size, overflow)
+            return [Subscriber(ke, target) for ke in kes]
+
+        return Registration(self._subscribers, records)
+
+    def close(self):
+        """Stop listening and detach from the shared memory, leaving the vault to other processes."""
+        with self._lock:
+            receiver, self._receiver = self._receiver, None
+            thread, self._thread = self._thread, None
+
+        if receiver is not None:
+            # The listening thread stops at its next notification. Shutting the socket down
+            # wakes it when idle, the stop notification when the platform does not support
+            # it, and a full queue of notifications when the notification cannot be sent
+            self._closing.set()
+            try:
+                receiver.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                self._sender.sendto(_NOTIFICATION.pack(_STOP), receiver.getsockname())
+            except OSError:
+                pass
+            thread.join(_CLOSE_TIMEOUT)
+            if thread.is_alive():
+                logger.warning(
+                    "Closing shared vault %s while a subscriber is still running",
+                    self.name,
+                )
+            receiver.close()
+            _remove(self._receiver_path)
+
+        self._subscribers.clear()
+        self._sender.close()
+        self._locks.close()
+        self._buffer = None
+        self._memory.close()
+
+    def unlink(self):
+        """Destroy the vault once all processes are done with it."""
+        try:
+            _unlink(self._memory)
+        except FileNotFoundError:
+            pass
+        for entry in os.listdir(self._directory):
+            _remove(os.path.join(self._directory, entry))
+        try:
+            os.rmdir(self._directory)
+        except OSError:
+            pass
+
+    def __enter__(self) -> "SharedVault":
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.close()
+
+    def _offset(self, index: int) -> int:
+        return _HEADER.size + index * self._stride
+
+    def _key(self, index: int) -> Optional[str]:
+        offset = self._offset(index)
+        (length,) = _KEY_LENGTH.unpack_from(self._buffer, offset + _KEY_LENGTH_OFFSET)
+        if length == 0:
+            return None
+        start = offset + _SLOT.size
+        return bytes(self._buffer[start : start + length]).decode()
+
+    def _probe(self, key: str):
+        start = zlib.crc32(key.encode()) % self.slots
+        for step in range(self.slots):
+            yield (start + step) % self.slots
+
+    def _find(self, key: str) -> Optional[int]:
+        if (index := self._indices.get(key)) is not None:
+            return index
+
+        for index in self._probe(key):
+            if (slot_key := self._key(index)) is None:
+                return None
+            if slot_key == key:
+                self._indices[key] = index
+                return index
+        return None
+
+    def _claim(self, key: str) -> int:
+        if (index := self._indices.get(key)) is not None:
+            return index
+
+        encoded = key.encode()
+        if len(encoded) > self.key_size:
+            raise ValueError(
+                f"The key takes {len(encoded)} bytes, more than the {self.key_size} of a slot"
+            )
+
+        for index in self._probe(key):
+            if (slot_key := self._key(index)) is None:
+                with self._locks.slot(index):
+                    # Another process may have claimed the slot meanwhile
+                    if (slot_key := self._key(index)) is None:
+                        offset = self._offset(index)
+                        start = offset + _SLOT.size
+                        self._buffer[start : start + len(encoded)] = encoded
+                        # The key length is written last, publishing the key
+                        _KEY_LENGTH.pack_into(
+                            self._buffer, offset + _KEY_LENGTH_OFFSET, len(encoded)
+                        )
+                        slot_key = key
+
+            if slot_key == key:
+                self._indices[key] = index
+                return index
+
+        raise RuntimeError(f"All {self.slots} slots of the shared vault are taken")
+
+    def _read(self, index: int) -> Optional[Sample]:
+        offset = self._offset(index)
+        size = _SLOT.size + self.key_size + self.value_size
+
+        spins = 0
+        while True:
+            (before,) = _SEQLOCK.unpack_from(self._buffer, offset)
+            if before & 1:
+                spins += 1
+                if spins % _SPINS_BEFORE_CHECK == 0 and self._abandoned(index):
+                    return None
+                time.sleep(0)
+                continue
+
+            data = bytes(self._buffer[offset : offset + size])
+
+            (after,) = _SEQLOCK.unpack_from(self._buffer, offset)
+            if after == before:
+                break
+
+        (
+            _,
+            key_length,
+            value_length,
+            timestamp,
+            monotonic,
+            sequence,
+            source_timestamp,
+        ) = _SLOT.unpack_from(data)
+        if sequence == 0:
+            return None
+
+        key = data[_SLOT.size : _SLOT.size + key_length].decode()
+        start = _SLOT.size + self.key_size
+        value = pickle.loads(data[start : start + value_length])
+
+        if source_timestamp != source_timestamp:
+            source_timestamp = None
+
+        return Sample(
+            KeyExpr(key), value, timestamp, monotonic, sequence, source_timestamp
+        )
+
+    def _abandoned(self, index: int) -> bool:
+        """Whether a slot was left half written by a writer that died."""
+        # Fails while a writer is still at work
+        if not self._locks.slot(index).acquire(blocking=False):
+            return False
+        self._locks.slot(index).release()
+        return True
+
+    def _notify(self, index: int):
+        version = os.stat(self._directory).st_mtime_ns
+        if (
+            version != self._receivers_version
+            or self._receivers_listed - version < _MTIME_GRANULARITY
+        ):
+            self._receivers_version, self._receivers_listed = version, time.time_ns()
+            self._receivers = [
+                os.path.join(self._directory, entry)
+                for entry in os.listdir(self._directory)
+                if entry.endswith(".sock")
+            ]
+
+        message = _NOTIFICATION.pack(index)
+        for path in self._receivers:
+            try:
+                self._sender.sendto(message, path)
+            except BlockingIOError:
+                # The receiver is behind, it reads the latest value when it catches up
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a process that did not close the vault
+                _remove(path)
+            except OSError as error:
+                logger.warning("Cannot notify %s: %s", path, error)
+
+    def _listen(self):
+        with self._lock:
+            if self._receiver is not None:
+                return
+
+            path = os.path.join(self._directory, f"{os.getpid()}-{id(self):x}.sock")
+            _remove(path)
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(path)
+
+            self._receiver, self._receiver_path = receiver, path
+            self._thread = threading.Thread(
+                target=self._receive,
+                args=(receiver,),
+                name=f"skarv-shared-{self.name}",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _receive(self, receiver: socket.socket):
+        while True:
+            try:
+                message = receiver.recv(_NOTIFICATION.size)
+            except OSError:
+                # Closed under a subscriber call that outlasted `close`
+                return
+            if self._closing.is_set() or len(message) < _NOTIFICATION.size:
+                return
+
+            (index,) = _NOTIFICATION.unpack(message)
+            if index == _STOP:
+                return
+
+            if (sample := self._read(index)) is None:
+                continue
+
+            # Notifications received after the value was read deliver nothing new
+            if self._delivered.get(index) == sample.sequence:
+                continue
+            self._delivered[index] = sample.sequence
+
+            for subscriber in self._subscribers.match(str(sample.key_expr)):
+                try:
+                    subscriber.callback(sample)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception(
+                        f"Exception in shared vault subscriber {subscriber.callback}"
+                    )
+
+
+class _SlotLock:
+    """An exclusive lock on a slot, across the threads and the processes of the host.
+
+    Record locks on the byte of the lock file at the index of the slot exclude other
+    processes, but are held per process, so a thread lock excludes the other threads.
+    """
+
+    __slots__ = ("fd", "index", "thread_lock")
+
+    def __init__(self, fd: int, index: int):
+        self.fd = fd
+        self.index = index
+        self.thread_lock = threading.Lock()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self.thread_lock.acquire(blocking):
+            return False
+        try:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            fcntl.lockf(self.fd, flags, 1, self.index)
+        except OSError:
+            self.thread_lock.release()
+            if blocking:
+                raise
+            return False
+        return True
+
+    def release(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.index)
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc_info: Any):
+        self.release()
+
+
+class _Locks:
+    """The slot locks of a vault, shared by all instances of this process opening it.
+
+    Closing any descriptor of a file releases all the record locks of the process on it,
+    so the lock file is opened once per process and closed along with the last instance.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.slots: List[_SlotLock] = []
+        self.references = 0
+
+    @staticmethod
+    def open(directory: str, slots: int) -> "_Locks":
+        path = os.path.join(directory, "lock")
+        with _opened_lock:
+            if (locks := _opened.get(path)) is None:
+                locks = _opened[path] = _Locks(path)
+            locks.references += 1
+            locks.slots.extend(
+                _SlotLock(locks.fd, index) for index in range(len(locks.slots), slots)
+            )
+        return locks
+
+    def slot(self, index: int) -> _SlotLock:
+        return self.slots[index]
+
+    def close(self):
+        with _opened_lock:
+            self.references -= 1
+            if self.references == 0:
+                del _opened[self.path]
+                os.close(self.fd)
+
+
+# The locks of the vaults opened by this process, by lock file
+_opened: Dict[str, _Locks] = {}
+_opened_lock = threading.Lock()
+
+
+def _open(
+    name: str, slots: int, key_size: int, value_size: int
+) -> Tuple[SharedMemory, int, int, int]:
+    stride = -(-(_SLOT.size + key_size + value_size) // 8) * 8
+    try:
+        memory = _shared_memory(name, create=True, size=_HEADER.size + slots * stride)
+    except FileExistsError:
+        return _attach(name)
+
+    _HEADER.pack_into(memory.buf, 0, _MAGIC, slots, key_size, value_size)
+    return memory, slots, key_size, value_size
+
+
+def _attach(name: str, timeout: float = 1.0) -> Tuple[SharedMemory, int, int, int]:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            memory = _shared_memory(name)
+        except ValueError:
+            # Attached before the creating process sized the block
+            memory = None
+        if memory is not None and memory.size >= _HEADER.size:
+            magic, slots, key_size, value_size = _HEADER.unpack_from(memory.buf)
+            if magic == _MAGIC:
+                return memory, slots, key_size, value_size
+        if memory is not None:
+            memory.close()
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{name} is not a shared vault")
+        time.sleep(0.001)
+
+
+def _shared_memory(name: str, create: bool = False, size: int = 0) -> SharedMemory:
+    """Open the block of a vault, untracked by the resource tracker of this process.
+
+    The lifetime of the block is managed with `unlink`. Left tracked, the block would be
+    unlinked as soon as any process that opened it exits, creating or attaching alike.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(_block(name), create=create, size=size, track=False)
+
+    memory = SharedMemory(_block(name), create=create, size=size)
+    resource_tracker.unregister(
+        memory._name, "shared_memory"  # pylint: disable=protected-access
+    )
+    return memory
+
+
+def _unlink(memory: SharedMemory):
+    if sys.version_info < (3, 13):
+        # Balances the unregistration made by `SharedMemory.unlink`
+        resource_tracker.register(
+            memory._name, "shared_memory"  # pylint: disable=protected-access
+        )
+    try:
+        memory.unlink()
+    except FileNotFoundError:
+        if sys.version_info < (3, 13):
+            resource_tracker.unregister(
+                memory._name, "shared_memory"  # pylint: disable=protected-access
+            )
+        raise
+
+
+def _remove(path: Optional[str]):
+    if path is None:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
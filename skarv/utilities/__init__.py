@@ -1,10 +1,7 @@
-import time
-import asyncio
 import logging
-import warnings
 from typing import Callable
 
-from ..concurrency import schedule_coroutine
+from ..concurrency import Job
 
 
 logger = logging.getLogger(__name__)
@@ -13,50 +10,28 @@ logger = logging.getLogger(__name__)
 def call_every(
     seconds: float,
     wait_first: bool = False,
+    missed: str = "coalesce",
 ):
     """Decorator to repeatedly call a function every specified number of seconds.
 
+    The calls follow a drift-free schedule of monotonic deadlines shared by all periodic
+    jobs on the background event loop. Coroutine functions run on the loop and other
+    functions on a dedicated, bounded thread pool. Use `skarv.concurrency.Job` directly
+    for a handle to cancel or reschedule the calls.
+
     Args:
         seconds (float): The interval in seconds between calls.
         wait_first (bool, optional): If True, wait for the interval before the first call. Defaults to False.
+        missed (str, optional): What to do with the calls missed while a call overran its
+            interval: `skip` them, `catch_up` on each of them or `coalesce` them into one.
+            Defaults to "coalesce".
 
     Returns:
         Callable: A decorator that schedules the function to be called periodically.
     """
 
     def timed_task_decorator(func: Callable) -> Callable:
-
-        is_coroutine = asyncio.iscoroutinefunction(func)
-
-        async def timer():
-
-            if wait_first:
-                await asyncio.sleep(seconds)
-
-            while True:
-                t_0 = time.time()
-
-                try:
-                    if is_coroutine:
-                        await func()
-                    else:
-                        await asyncio.get_event_loop().run_in_executor(None, func)
-                except Exception:  # pylint: disable=broad-except
-                    logger.exception(f"call_every: Exception in {func}")
-
-                remainder = seconds - (time.time() - t_0)
-
-                if remainder < 0:
-                    warnings.warn(
-                        f"Function {func} has an execution time the exceeds"
-                        f" the requested execution interval of {seconds}s!",
-                        UserWarning,
-                    )
-
-                await asyncio.sleep(max(remainder, 0))
-
-        # Put `timer` on the event loop on service startup
-        schedule_coroutine(timer())
+        Job(func, seconds, wait_first, missed)
         return func
 
     return timed_task_decorator
@@ -0,0 +1,238 @@
+"""Middlewares for array-valued samples, vectorized with NumPy.
+
+Requires the optional `numpy` dependency: `pip install skarv[numpy]`.
+
+All values passed to one middleware must be arrays of the same shape. The windows are
+kept in preallocated ring buffers and the aggregates are updated with in-place
+vectorized operations, so the cost per value does not depend on the window size.
+"""
+
+from threading import Lock
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+from .._clock import now
+
+
+class _Window:
+    """A preallocated ring buffer of equally shaped arrays."""
+
+    def __init__(self, no_of_samples: int, value: np.ndarray):
+        self.shape: Tuple[int, ...] = value.shape
+        self.dtype = np.result_type(value.dtype, np.float64)
+        self.buffer = np.zeros((no_of_samples,) + self.shape, dtype=self.dtype)
+        self.length = 0
+        self.index = 0
+
+    @property
+    def full(self) -> bool:
+        return self.length == len(self.buffer)
+
+    def check(self, value: np.ndarray):
+        if value.shape != self.shape:
+            raise ValueError(
+                f"Expected an array of shape {self.shape}, got {value.shape}"
+            )
+
+    def oldest(self) -> Optional[np.ndarray]:
+        """A view of the value the next push overwrites, None if not full."""
+        return self.buffer[self.index] if self.full else None
+
+    def push(self, value: np.ndarray):
+        """Store a value, overwriting the oldest one when full."""
+        self.buffer[self.index] = value
+        self.index = (self.index + 1) % len(self.buffer)
+        self.length = min(self.length + 1, len(self.buffer))
+
+    def ordered(self) -> np.ndarray:
+        """The stored values, oldest first."""
+        if not self.full:
+            return self.buffer[: self.length]
+        return np.roll(self.buffer, -self.index, axis=0)
+
+
+def _as_float(value: np.ndarray) -> np.ndarray:
+    return value.astype(np.result_type(value.dtype, np.float64))
+
+
+def batch(size: int) -> Callable[[np.ndarray], Optional[np.ndarray]]:
+    """Create a middleware that stacks arrays into a single array when the batch size is reached.
+
+    Values are copied into a preallocated array of shape `(size, *value.shape)` as they
+    arrive. That array is then emitted as is, without a final copy, and a new one is
+    allocated for the next batch.
+
+    Args:
+        size (int): The number of arrays to collect before emitting a batch.
+
+    Returns:
+        Callable[[np.ndarray], Optional[np.ndarray]]: Middleware function that returns the
+            stacked batch or None if not enough values have been collected.
+    """
+    lock = Lock()
+    buffer: Optional[np.ndarray] = None
+    length = 0
+
+    def _batcher(value: np.ndarray) -> Optional[np.ndarray]:
+        nonlocal buffer, length
+
+        value = np.asarray(value)
+
+        with lock:
+
+            if buffer is None:
+                buffer = np.empty((size,) + value.shape, dtype=value.dtype)
+            elif value.shape != buffer.shape[1:]:
+                raise ValueError(
+                    f"Expected an array of shape {buffer.shape[1:]}, got {value.shape}"
+                )
+
+            buffer[length] = value
+            length += 1
+
+            if length < size:
+                return None
+
+            output, buffer, length = buffer, None, 0
+            return output
+
+    return _batcher
+
+
+def average(no_of_samples: int) -> Callable[[np.ndarray], np.ndarray]:
+    """Create a middleware that computes the element-wise moving average over a window of arrays.
+
+    The sum of the window is updated in place as arrays enter and leave it, and is
+    recomputed once every `no_of_samples` values to stop floating point errors from
+    accumulating.
+
+    Args:
+        no_of_samples (int): Number of arrays to average over.
+
+    Returns:
+        Callable[[np.ndarray], np.ndarray]: Middleware function that returns the moving average.
+    """
+    lock = Lock()
+    window: Optional[_Window] = None
+    total: Optional[np.ndarray] = None
+    count = 0
+
+    def _averager(value: np.ndarray) -> np.ndarray:
+        nonlocal window, total, count
+
+        value = np.asarray(value)
+
+        with lock:
+
+            if window is None:
+                window = _Window(no_of_samples, value)
+                total = np.zeros(window.shape, dtype=window.dtype)
+            window.check(value)
+
+            if (oldest := window.oldest()) is not None:
+                total -= oldest
+            window.push(value)
+            total += value
+
+            count += 1
+            if count == no_of_samples:
+                total = window.buffer.sum(axis=0)
+                count = 0
+
+            return total / window.length
+
+    return _averager
+
+
+def weighted_average(no_of_samples: int) -> Callable[[np.ndarray], np.ndarray]:
+    """Create a middleware that computes the element-wise weighted moving average over a window of arrays.
+
+    As with `skarv.middlewares.weighted_average`, the newest of `k` arrays in the window
+    weighs `k` and the oldest weighs 1. The plain and weighted sums of the window are
+    updated in place, and recomputed once every `no_of_samples` values.
+
+    Args:
+        no_of_samples (int): Number of arrays to use for the weighted average.
+
+    Returns:
+        Callable[[np.ndarray], np.ndarray]: Middleware function that returns the weighted moving average.
+    """
+    lock = Lock()
+    window: Optional[_Window] = None
+    total: Optional[np.ndarray] = None
+    weighted: Optional[np.ndarray] = None
+    count = 0
+
+    def _averager(value: np.ndarray) -> np.ndarray:
+        nonlocal window, total, weighted, count
+
+        value = np.asarray(value)
+
+        with lock:
+
+            if window is None:
+                window = _Window(no_of_samples, value)
+                total = np.zeros(window.shape, dtype=window.dtype)
+                weighted = np.zeros(window.shape, dtype=window.dtype)
+            window.check(value)
+
+            if (oldest := window.oldest()) is not None:
+                weighted -= total
+                total -= oldest
+            window.push(value)
+            total += value
+            weighted += window.length * value
+
+            count += 1
+            if count == no_of_samples:
+                ordered = window.ordered()
+                weights = np.arange(1, window.length + 1, dtype=window.dtype)
+                total = ordered.sum(axis=0)
+                weighted = np.tensordot(weights, ordered, axes=1)
+                count = 0
+
+            return weighted / (window.length * (window.length + 1) / 2)
+
+    return _averager
+
+
+def differentiate() -> Callable[[np.ndarray], Optional[np.ndarray]]:
+    """Create a middleware that computes the element-wise numerical derivative of arrays.
+
+    The time step is taken from the monotonic timestamps of the samples. Values without a
+    time step since the previous one are dropped.
+
+    Returns:
+        Callable[[np.ndarray], Optional[np.ndarray]]: Middleware function that returns the
+            derivative or None for the first value.
+    """
+    lock = Lock()
+    last_value: Optional[np.ndarray] = None
+    last_time = None
+
+    def _differentiator(value: np.ndarray) -> Optional[np.ndarray]:
+        nonlocal last_value, last_time
+
+        value = np.asarray(value)
+
+        with lock:
+
+            t = now()
+
+            if last_value is None:
+                last_value = _as_float(value)
+                last_time = t
+                return None
+
+            if t <= last_time:
+                return None
+
+            derivative = (value - last_value) / (t - last_time)
+
+            last_value = _as_float(value)
+            last_time = t
+
+            return derivative
+
+    return _differentiator
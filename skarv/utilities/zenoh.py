@@ -1,25 +1,443 @@
+import json
+import uuid
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
 import zenoh
 
-from .. import put, get
+from .. import put, put_many, get, subscribe, Sample
+from .._index import _is_wild
+from ..concurrency import get_background_loop, get_thread_pool
+
+logger = logging.getLogger(__name__)
+
+Decoder = Callable[[Any], Any]
+Encoder = Callable[[Any], Any]
+
+# Attached to the samples published by this process, to recognize them when they come back
+_ORIGIN = uuid.uuid4().bytes
+
+# Set while putting values received from Zenoh, so that they are not published back. Maps
+# each mirrored key to the sample stored for it, once a publication has received it, so
+# that values derived from it by subscribers and middlewares are still published
+_mirroring: ContextVar[Optional[Dict[str, Optional[Sample]]]] = ContextVar(
+    "skarv_mirroring", default=None
+)
+
+
+def _buffer(payload: Any) -> memoryview:
+    # Payloads exposing the buffer protocol are viewed in place, others are copied once
+    try:
+        return memoryview(payload)
+    except TypeError:
+        return memoryview(payload.to_bytes())
+
+
+def as_bytes(payload: Any) -> bytes:
+    """Decode a payload to bytes.
+
+    Args:
+        payload (Any): The `zenoh.ZBytes` payload.
+
+    Returns:
+        bytes: The payload as bytes.
+    """
+    return payload if isinstance(payload, bytes) else payload.to_bytes()
+
+
+def as_memoryview(payload: Any) -> memoryview:
+    """Decode a payload to a read-only memoryview.
+
+    Payloads exposing the buffer protocol are not copied at all, others are copied once.
+    Slicing the view, or passing it on to `numpy.frombuffer`, does not copy either.
+
+    Args:
+        payload (Any): The `zenoh.ZBytes` payload.
+
+    Returns:
+        memoryview: A view of the payload.
+    """
+    return _buffer(payload).toreadonly()
+
+
+def as_str(payload: Any) -> str:
+    """Decode a payload to a UTF-8 string.
+
+    Args:
+        payload (Any): The `zenoh.ZBytes` payload.
+
+    Returns:
+        str: The payload as a string.
+    """
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return str(payload, "utf-8")
+    return payload.to_string()
+
+
+def as_json(payload: Any) -> Any:
+    """Decode a JSON payload.
+
+    Args:
+        payload (Any): The `zenoh.ZBytes` payload.
+
+    Returns:
+        Any: The decoded document.
+    """
+    return json.loads(as_bytes(payload))
+
+
+def as_msgpack(payload: Any) -> Any:
+    """Decode a MessagePack payload, reading it through a memoryview.
+
+    Requires the optional `msgpack` dependency: `pip install skarv[msgpack]`.
+
+    Args:
+        payload (Any): The `zenoh.ZBytes` payload.
+
+    Returns:
+        Any: The decoded object.
+    """
+    import msgpack  # pylint: disable=import-outside-toplevel
+
+    return msgpack.unpackb(_buffer(payload))
+
+
+def as_array(dtype: Any, shape: Optional[Tuple[int, ...]] = None) -> Decoder:
+    """Create a decoder of payloads holding raw NumPy arrays.
+
+    The array is a read-only view of the payload through `numpy.frombuffer`, without
+    copying the payload any further.
+
+    Requires the optional `numpy` dependency: `pip install skarv[numpy]`.
+
+    Args:
+        dtype (Any): The data type of the array elements.
+        shape (Optional[Tuple[int, ...]], optional): The shape of the array, a flat array
+            if None. Defaults to None.
+
+    Returns:
+        Decoder: The decoder.
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    def _decoder(payload: Any) -> "np.ndarray":
+        array = np.frombuffer(as_memoryview(payload), dtype=dtype)
+        return array if shape is None else array.reshape(shape)
+
+    return _decoder
+
+
+DECODERS: Dict[str, Decoder] = {
+    "bytes": as_bytes,
+    "memoryview": as_memoryview,
+    "str": as_str,
+    "json": as_json,
+    "msgpack": as_msgpack,
+}
+
+
+def _key_mapping(zenoh_key: str, skarv_key: str) -> Callable[[str], str]:
+    if not _is_wild(skarv_key):
+        return lambda key: skarv_key
+
+    zenoh_prefix, skarv_prefix = zenoh_key[:-2], skarv_key[:-2]
+    if (
+        not (zenoh_key.endswith("**") and skarv_key.endswith("**"))
+        or "**" in zenoh_prefix
+        or _is_wild(skarv_prefix)
+        or zenoh_prefix[-1:] not in ("", "/")
+        or skarv_prefix[-1:] not in ("", "/")
+    ):
+        raise ValueError(
+            f"Cannot map {zenoh_key!r} to {skarv_key!r}, a wildcard Skarv key must be a "
+            "prefix followed by `**`, mirroring a Zenoh key ending with `**`"
+        )
+
+    # The chunks matched by the literal chunks of the Zenoh prefix are replaced by the
+    # Skarv prefix, those matched by its wildcards are kept to tell the keys apart
+    prefix_chunks = zenoh_prefix.split("/")[:-1]
+    skipped = len(prefix_chunks)
+    kept = [index for index, chunk in enumerate(prefix_chunks) if _is_wild(chunk)]
+    skarv_prefix = skarv_prefix.rstrip("/")
+
+    def _map(key: str) -> str:
+        chunks = key.split("/")
+        chunks = [chunks[index] for index in kept] + chunks[skipped:]
+        return "/".join([skarv_prefix] + chunks if skarv_prefix else chunks)
 
+    return _map
 
-def mirror(zenoh_session: zenoh.Session, zenoh_key: str, skarv_key: str):
+
+def mirror(
+    zenoh_session: zenoh.Session,
+    zenoh_key: str,
+    skarv_key: str,
+    decoder: Union[str, Decoder, None] = None,
+    timeout: Optional[float] = None,
+    consolidation: Optional[zenoh.ConsolidationMode] = None,
+):
     """Mirror a Zenoh key expression to a Skarv key.
 
     Subscribes to the Zenoh key expression and automatically puts received values into Skarv.
     If the Zenoh key already has a value, it fetches and stores it in Skarv (if not already present).
 
+    A wildcard Zenoh key ending with `**` may be mirrored to a Skarv prefix followed by `**`,
+    each Zenoh key then being stored under its own Skarv key. The chunks matched by the
+    literal chunks of the Zenoh prefix are replaced by the Skarv prefix, while those matched
+    by its `*` wildcards are kept: mirroring `fleet/*/status/**` to `robots/**` stores
+    `fleet/1/status/speed` in `robots/1/speed`. Otherwise, all values are stored in
+    `skarv_key`.
+
+    The initial values are fetched with a single query, collected and stored with one
+    `put_many`, so that subscribers see the initial state at once.
+
+    Payloads are decoded once, before being put, so that subscribers share the decoded
+    value instead of each converting the `zenoh.ZBytes` payload themselves. Payloads that
+    fail to decode are logged and dropped. Samples published by `publish` in this process
+    are not mirrored back.
+
     Args:
         zenoh_session (zenoh.Session): The Zenoh session to use.
         zenoh_key (str): The Zenoh key expression to subscribe to.
         skarv_key (str): The Skarv key to store values in.
+        decoder (Union[str, Decoder, None], optional): A function decoding the payloads, or
+            the name of one of `DECODERS`: `bytes`, `memoryview`, `str`, `json` or `msgpack`.
+            None to store the raw payloads. Defaults to None.
+        timeout (Optional[float], optional): The timeout of the initial query in seconds.
+            Defaults to None, using the Zenoh default.
+        consolidation (Optional[zenoh.ConsolidationMode], optional): The consolidation of the
+            replies to the initial query. Defaults to None, using the Zenoh default.
+
+    Raises:
+        ValueError: If the decoder is unknown or the keys cannot be mapped onto each other.
     """
+    if isinstance(decoder, str):
+        try:
+            decoder = DECODERS[decoder]
+        except KeyError:
+            raise ValueError(
+                f"Unknown decoder {decoder!r}, expected one of {tuple(DECODERS)}"
+            ) from None
+
+    to_skarv_key = _key_mapping(zenoh_key, skarv_key)
+
+    def _decode(sample: zenoh.Sample) -> Tuple[bool, Any]:
+        if _published_here(sample):
+            return False, None
+        if decoder is None:
+            return True, sample.payload
+        try:
+            return True, decoder(sample.payload)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception(f"mirror: Failed to decode payload of {zenoh_key}")
+            return False, None
+
+    def _receive(sample: zenoh.Sample):
+        decoded, value = _decode(sample)
+        if not decoded:
+            return
+
+        key = to_skarv_key(str(sample.key_expr))
+        token = _mirroring.set({key: None})
+        try:
+            put(key, value)
+        finally:
+            _mirroring.reset(token)
+
     # Subscribe to the key expression and put the received value into skarv
-    zenoh_session.declare_subscriber(
-        zenoh_key, lambda sample: put(skarv_key, sample.payload)
-    )
-
-    # If the key expression already has a value, we fetch it and put it into skarv
-    for response in zenoh_session.get(zenoh_key):
-        if (ok_response := response.ok) and not get(skarv_key):
-            put(skarv_key, ok_response.payload)
+    zenoh_session.declare_subscriber(zenoh_key, _receive)
+
+    # Fetch the current values with a single query, storing those not yet in skarv at once
+    options: Dict[str, Any] = {}
+    if timeout is not None:
+        options["timeout"] = timeout
+    if consolidation is not None:
+        options["consolidation"] = consolidation
+
+    initial: Dict[str, Any] = {}
+    for response in zenoh_session.get(zenoh_key, **options):
+        if ok_response := response.ok:
+            decoded, value = _decode(ok_response)
+            if decoded:
+                initial[to_skarv_key(str(ok_response.key_expr))] = value
+
+    missing = {key: value for key, value in initial.items() if get(key) is None}
+    if missing:
+        token = _mirroring.set(dict.fromkeys(missing))
+        try:
+            put_many(missing)
+        finally:
+            _mirroring.reset(token)
+
+
+def _mirrored(sample: Sample) -> bool:
+    if (mirrored := _mirroring.get()) is None:
+        return False
+
+    key = str(sample.key_expr)
+    if key not in mirrored:
+        return False
+
+    # The first sample of a mirrored key is the one stored by the mirror, received by
+    # every publication matching it
+    if mirrored[key] is None:
+        mirrored[key] = sample
+    return mirrored[key] is sample
+
+
+def _published_here(sample: zenoh.Sample) -> bool:
+    attachment = sample.attachment
+    return isinstance(attachment, zenoh.ZBytes) and attachment.to_bytes() == _ORIGIN
+
+
+def replace_prefix(skarv_prefix: str, zenoh_prefix: str) -> Callable[[str], str]:
+    """Create a key remapping replacing a leading part of skarv keys, for `publish`.
+
+    Args:
+        skarv_prefix (str): The chunks to replace, e.g. `robot/1`.
+        zenoh_prefix (str): The chunks to put instead, e.g. `fleet/robots/1`.
+
+    Returns:
+        Callable[[str], str]: The remapping.
+    """
+    skarv_prefix, zenoh_prefix = skarv_prefix.rstrip("/"), zenoh_prefix.rstrip("/")
+
+    def _remap(key: str) -> str:
+        if key == skarv_prefix:
+            return zenoh_prefix
+        if key.startswith(skarv_prefix + "/"):
+            return zenoh_prefix + key[len(skarv_prefix) :]
+        return key
+
+    return _remap
+
+
+class Publication:
+    """Publishes the samples of skarv key expressions to Zenoh, see `publish`.
+
+    Args:
+        zenoh_session (zenoh.Session): The Zenoh session to publish on.
+        skarv_key (str): The skarv key expression to publish.
+        remap (Optional[Callable[[str], str]]): Maps a skarv key to its Zenoh key.
+        encoder (Optional[Encoder]): Encodes the values into payloads.
+        interval (Optional[float]): The coalescing interval in seconds.
+    """
+
+    def __init__(
+        self,
+        zenoh_session: zenoh.Session,
+        skarv_key: str,
+        remap: Optional[Callable[[str], str]] = None,
+        encoder: Optional[Encoder] = None,
+        interval: Optional[float] = None,
+    ):
+        self._session = zenoh_session
+        self._remap = remap
+        self._encoder = encoder
+        self._interval = interval
+
+        self._lock = threading.Lock()
+        self._publishers: Dict[str, zenoh.Publisher] = {}
+        self._pending: Dict[str, Any] = {}
+
+        self._subscription = subscribe(skarv_key)
+        self._subscription(self._receive)
+
+    def close(self):
+        """Stop publishing, flushing pending values and undeclaring the publishers."""
+        self._subscription.close()
+        self._flush()
+
+        with self._lock:
+            publishers, self._publishers = self._publishers, {}
+        for publisher in publishers.values():
+            publisher.undeclare()
+
+    def __enter__(self) -> "Publication":
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.close()
+
+    def _receive(self, sample: Sample):
+        # Values received from Zenoh are not echoed back to it
+        if _mirrored(sample):
+            return
+
+        key = str(sample.key_expr)
+        if self._remap is not None:
+            key = self._remap(key)
+
+        if self._interval is None:
+            self._publish(key, sample.value)
+            return
+
+        with self._lock:
+            schedule = not self._pending
+            self._pending[key] = sample.value
+
+        if schedule:
+            loop = get_background_loop()
+            loop.call_soon_threadsafe(
+                loop.call_later, self._interval, get_thread_pool().submit, self._flush
+            )
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        for key, value in pending.items():
+            self._publish(key, value)
+
+    def _publish(self, key: str, value: Any):
+        try:
+            if self._encoder is not None:
+                value = self._encoder(value)
+
+            with self._lock:
+                if (publisher := self._publishers.get(key)) is None:
+                    publisher = self._publishers[key] = self._session.declare_publisher(
+                        key
+                    )
+
+            publisher.put(value, attachment=_ORIGIN)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception(f"publish: Failed to publish to {key}")
+
+
+def publish(
+    zenoh_session: zenoh.Session,
+    skarv_key: str,
+    remap: Optional[Callable[[str], str]] = None,
+    encoder: Optional[Encoder] = None,
+    interval: Optional[float] = None,
+) -> Publication:
+    """Publish a Skarv key expression to Zenoh, the reverse of `mirror`.
+
+    Every sample put to a key matching `skarv_key` is published to Zenoh through a
+    publisher declared once per key. With an `interval`, the values of each key are
+    coalesced and only the latest one is published, at most once per interval, so that
+    high-rate keys cost a single Zenoh message per interval.
+
+    Values put by `mirror` are never published back to Zenoh, and samples published here
+    are ignored by `mirror`, so a key may be bridged both ways without looping. Values
+    that subscribers or middlewares derive from mirrored ones and put to other keys are
+    published as usual.
+
+    Args:
+        zenoh_session (zenoh.Session): The Zenoh session to publish on.
+        skarv_key (str): The Skarv key expression to publish, wildcards allowed.
+        remap (Optional[Callable[[str], str]], optional): Maps each Skarv key to the Zenoh key
+            it is published to, e.g. `replace_prefix`. Defaults to None, publishing to the
+            same key.
+        encoder (Optional[Encoder], optional): Encodes the values into payloads, e.g.
+            `json.dumps`. Defaults to None, publishing the values as is.
+        interval (Optional[float], optional): The coalescing interval in seconds. Defaults to
+            None, publishing every value.
+
+    Returns:
+        Publication: A handle to stop publishing with.
+    """
+    return Publication(zenoh_session, skarv_key, remap, encoder, interval)
@@ -1,9 +1,15 @@
 import time
+import functools
+import asyncio
 import skarv
 import threading
 
 import pytest
 from unittest.mock import MagicMock
+from zenoh import KeyExpr
+
+from skarv._index import KeyExprIndex
+from skarv.broker import Registration, Subscriber
 
 
 def test_put_get():
@@ -165,3 +171,638 @@ def test_trigger_and_subscribe():
     subscribe_mock.assert_called_once()
     assert len(subscribe_mock.call_args.args) == 1
     assert isinstance(subscribe_mock.call_args.args[0], skarv.Sample)
+
+
+def test_get_wildcard_subtrees():
+    for device in range(5):
+        for sensor in range(3):
+            skarv.put(f"fleet/{device}/sensor/{sensor}", device * 10 + sensor)
+    skarv.put("other/0/sensor/0", -1)
+
+    res = skarv.get("fleet/3/**")
+    assert sorted(sample.value for sample in res) == [30, 31, 32]
+
+    res = skarv.get("*/*/sensor/0")
+    assert sorted(sample.value for sample in res) == [-1, 0, 10, 20, 30, 40]
+
+    res = skarv.get("fleet/$*4/sensor/*")
+    assert sorted(sample.value for sample in res) == [40, 41, 42]
+
+    assert skarv.get("fleet/2/sensor/1").value == 21
+
+
+def test_match_cache_canonical_keys():
+    skarv.subscribe("anything/**")(MagicMock())
+
+    skarv.put("anything/**/**", 1)
+    skarv.put("anything/**", 2)
+
+    info = skarv.match_cache_info()["subscribers"]
+    assert info.misses == 1
+    assert info.hits == 1
+    assert info.currsize == 1
+
+    skarv.configure_match_cache(0)
+    assert skarv.match_cache_info()["subscribers"].currsize == 0
+    skarv.configure_match_cache(skarv._index.DEFAULT_CACHE_SIZE)
+
+
+def test_put_many():
+    single = MagicMock()
+    batched = MagicMock()
+    trigger = MagicMock()
+
+    skarv.subscribe("frame/*")(single)
+    skarv.subscribe("frame/*", batch=True)(batched)
+    skarv.trigger("frame/**")(trigger)
+    skarv.register_middleware("frame/b", lambda value: None)
+
+    skarv.put_many({"frame/a": 1, "frame/b": 2, "frame/c": 3})
+
+    assert single.call_count == 2
+    batched.assert_called_once()
+    assert [sample.value for sample in batched.call_args.args[0]] == [1, 3]
+    trigger.assert_called_once()
+
+    assert skarv.get("frame/a").value == 1
+    assert skarv.get("frame/b") is None
+
+    skarv.put_many([("frame/a", 4)])
+    assert skarv.get("frame/a").value == 4
+
+    # Batch subscribers receive single puts as one-element lists
+    skarv.put("frame/c", 5)
+    assert [sample.value for sample in batched.call_args.args[0]] == [5]
+
+
+def _blocking_callback(release: threading.Event, received: list):
+    def callback(sample: skarv.Sample):
+        release.wait()
+        received.append(sample.value)
+
+    return callback
+
+
+def test_subscribe_executor_does_not_block_put():
+    release = threading.Event()
+    received = []
+    done = threading.Event()
+
+    skarv.subscribe("slow", executor="thread")(_blocking_callback(release, received))
+    skarv.trigger("slow", executor="loop")(done.set)
+
+    start = time.time()
+    for value in range(5):
+        skarv.put("slow", value)
+    assert time.time() - start < 0.5
+
+    assert done.wait(1)
+    release.set()
+
+    deadline = time.time() + 1
+    while len(received) < 5 and time.time() < deadline:
+        time.sleep(0.01)
+    assert received == [0, 1, 2, 3, 4]
+
+
+def test_subscribe_loop_executor_from_background_loop():
+    received = []
+    skarv.subscribe("loop/thing", executor="loop", queue_size=1)(received.append)
+
+    async def produce():
+        for value in range(5):
+            skarv.put("loop/thing", value)
+
+    # Waiting for room would block the very loop that drains the queue
+    skarv.concurrency.schedule_coroutine(produce()).result(1)
+
+    deadline = time.time() + 1
+    while len(received) < 5 and time.time() < deadline:
+        time.sleep(0.01)
+    assert [sample.value for sample in received] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize(
+    "overflow, expected",
+    [
+        ("drop_oldest", [0, 3, 4]),
+        ("drop_newest", [0, 1, 2]),
+        ("latest", [0, 1, 4]),
+    ],
+)
+def test_subscribe_overflow_policies(overflow, expected):
+    release = threading.Event()
+    received = []
+    started = threading.Event()
+
+    def callback(sample: skarv.Sample):
+        started.set()
+        release.wait()
+        received.append(sample.value)
+
+    skarv.subscribe("slow", executor="thread", queue_size=2, overflow=overflow)(
+        callback
+    )
+
+    # The first sample is taken by the worker and blocks it
+    skarv.put("slow", 0)
+    assert started.wait(1)
+
+    for value in range(1, 5):
+        skarv.put("slow", value)
+
+    release.set()
+
+    deadline = time.time() + 1
+    while len(received) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert received == expected
+
+
+def test_subscribe_conflate():
+    release = threading.Event()
+    started = threading.Event()
+    received = []
+
+    @skarv.subscribe("conflated/*", conflate=True)
+    def _(sample: skarv.Sample):
+        started.set()
+        release.wait()
+        received.append((str(sample.key_expr), sample.value))
+
+    # The first sample is taken by the worker and blocks it
+    skarv.put("conflated/a", 0)
+    assert started.wait(1)
+
+    for value in range(1, 100):
+        skarv.put("conflated/a", value)
+        skarv.put("conflated/b", -value)
+
+    release.set()
+
+    deadline = time.time() + 1
+    while len(received) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert received == [("conflated/a", 0), ("conflated/a", 99), ("conflated/b", -99)]
+
+    with pytest.raises(ValueError):
+        skarv.subscribe("conflated/*", batch=True, conflate=True)
+
+
+def test_coroutine_subscriber_background_loop():
+    received = []
+    done = threading.Event()
+
+    @skarv.subscribe("async/thing")
+    async def callback(sample: skarv.Sample):
+        await asyncio.sleep(0)
+        received.append(sample.value)
+        done.set()
+
+    skarv.put("async/thing", 42)
+
+    assert done.wait(1)
+    assert received == [42]
+
+
+def test_coroutine_subscriber_running_loop():
+    async def main():
+        received = asyncio.Queue()
+
+        @skarv.subscribe("async/thing")
+        async def callback(sample: skarv.Sample):
+            await received.put(sample.value)
+
+        # From the loop itself and from another thread
+        skarv.put("async/thing", 1)
+        await asyncio.to_thread(skarv.put, "async/thing", 2)
+
+        return [
+            await asyncio.wait_for(received.get(), 1),
+            await asyncio.wait_for(received.get(), 1),
+        ]
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_coroutine_subscriber_closed_loop():
+    received = []
+    done = threading.Event()
+
+    async def callback(sample: skarv.Sample):
+        received.append(sample.value)
+        done.set()
+
+    async def main():
+        skarv.subscribe("async/thing")(callback)
+
+    # The loop the callback was subscribed on is closed once run returns
+    asyncio.run(main())
+    after = MagicMock()
+    skarv.subscribe("async/thing")(after)
+
+    skarv.put("async/thing", 1)
+    assert done.wait(1)
+    assert received == [1]
+    after.assert_called_once()
+
+
+def test_stream():
+    async def main():
+        values = []
+
+        async with skarv.stream("stream/*") as samples:
+
+            def produce():
+                for value in range(100):
+                    skarv.put(f"stream/{value % 3}", value)
+
+            producer = asyncio.get_running_loop().run_in_executor(None, produce)
+
+            async for sample in samples:
+                values.append(sample.value)
+                if len(values) == 100:
+                    break
+
+            await producer
+
+        return values
+
+    assert asyncio.run(main()) == list(range(100))
+
+    # The stream is no longer subscribed once closed
+    assert len(skarv._default._subscribers) == 0
+
+
+def test_stream_backpressure():
+    async def main():
+        samples = skarv.stream("stream/thing", maxsize=2)
+        produced = threading.Event()
+
+        def produce():
+            for value in range(5):
+                skarv.put("stream/thing", value)
+            produced.set()
+
+        producer = asyncio.get_running_loop().run_in_executor(None, produce)
+
+        await asyncio.sleep(0.1)
+        assert not produced.is_set()
+        assert len(samples.queue) == 2
+
+        values = [await samples.__anext__() for _ in range(5)]
+        await producer
+        samples.close()
+
+        # A closed stream ends the iteration
+        assert [sample async for sample in samples] == []
+        return values
+
+    assert [sample.value for sample in asyncio.run(main())] == [0, 1, 2, 3, 4]
+
+
+def test_stream_close_releases_blocked_publishers():
+    async def main():
+        produced = threading.Event()
+
+        def produce():
+            for value in range(5):
+                skarv.put("stream/thing", value)
+            produced.set()
+
+        async with skarv.stream("stream/thing", maxsize=2) as samples:
+            producer = asyncio.get_running_loop().run_in_executor(None, produce)
+            async for sample in samples:
+                await asyncio.sleep(0.1)
+                assert not produced.is_set()
+                break
+
+        await asyncio.wait_for(producer, 1)
+        return samples.queue.dropped
+
+    assert asyncio.run(main()) > 0
+
+
+def test_history():
+    skarv.set_history("history/*", 3)
+
+    skarv.put("history/a", 0)
+    checkpoint = time.time()
+    for value in range(1, 6):
+        skarv.put("history/a", value)
+        skarv.put("history/b", value * 10)
+    skarv.put("elsewhere", 1)
+
+    assert [s.value for s in skarv.get_history("history/a")] == [3, 4, 5]
+    assert [s.value for s in skarv.get_history("history/a", last_n=2)] == [4, 5]
+    assert [s.value for s in skarv.get_history("history/b", since=checkpoint)] == [
+        30,
+        40,
+        50,
+    ]
+    assert len(skarv.get_history("history/*")) == 6
+    assert skarv.get_history("elsewhere") == []
+
+    # Shrinking the depth keeps the most recent values
+    skarv.set_history("history/*", 1)
+    assert [s.value for s in skarv.get_history("history/**")] == [5, 50]
+
+    skarv.set_history("history/*", 0)
+    assert skarv.get_history("history/a") == []
+
+
+def test_sample_stamps():
+    seen_by_middleware = []
+
+    def middleware(value):
+        seen_by_middleware.append(skarv._clock.now())
+        return value
+
+    skarv.register_middleware("stamped", middleware)
+    mock = MagicMock()
+    skarv.subscribe("stamped")(mock)
+
+    before = time.time()
+    skarv.put("stamped", 1)
+    skarv.put("stamped", 2, source_timestamp=123.0)
+
+    first, second = [call.args[0] for call in mock.call_args_list]
+    assert (first.sequence, second.sequence) == (1, 2)
+    assert before <= first.timestamp <= second.timestamp <= time.time()
+    assert first.monotonic <= second.monotonic <= time.monotonic()
+    assert first.source_timestamp is None
+    assert second.source_timestamp == 123.0
+    assert seen_by_middleware == [first.monotonic, second.monotonic]
+
+    assert skarv.get("stamped") == second
+
+    skarv.put_many({"stamped": 3, "other": 4}, source_timestamp=7.0)
+    assert skarv.get("stamped").sequence == 3
+    assert skarv.get("other").sequence == 1
+    assert skarv.get("other").source_timestamp == 7.0
+
+
+def test_samples_are_shared_and_slotted():
+    mock = MagicMock()
+    skarv.subscribe("shared")(mock)
+
+    skarv.put("shared", 42)
+
+    sample = mock.call_args.args[0]
+    assert skarv.get("shared") is sample
+    assert not hasattr(sample, "__dict__")
+    with pytest.raises(AttributeError):
+        sample.value = 43
+
+
+def test_isolated_brokers():
+    first, second = skarv.Broker(), skarv.Broker()
+    first_mock, second_mock, default_mock = MagicMock(), MagicMock(), MagicMock()
+
+    first.subscribe("isolated")(first_mock)
+    second.subscribe("isolated")(second_mock)
+    skarv.subscribe("isolated")(default_mock)
+
+    first.put("isolated", 1)
+
+    first_mock.assert_called_once()
+    second_mock.assert_not_called()
+    default_mock.assert_not_called()
+    assert first.get("isolated").value == 1
+    assert second.get("isolated") is None
+    assert skarv.get("isolated") is None
+
+    second.put("isolated", 2)
+    assert first.get("isolated").value == 1
+
+    first.clear()
+    assert first.get("isolated") is None
+    first.put("isolated", 3)
+    first_mock.assert_called_once()
+
+
+def test_sharded_vault():
+    broker = skarv.Broker(shards=4)
+
+    def producer(ix: int):
+        for value in range(100):
+            broker.put(f"shard{ix}/{value % 10}", value)
+
+    workers = [threading.Thread(target=producer, args=(ix,)) for ix in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(broker.get("**")) == 80
+
+    # Keys sharing a root are spread over the shards
+    fleet = skarv.Broker(shards=4)
+    fleet.put_many({f"fleet/{ix}/speed": ix for ix in range(100)})
+    assert all(shard.values for shard in fleet._vault._shards)
+    assert len(fleet.get("fleet/*/speed")) == 100
+    assert len(broker.get("shard3/*")) == 10
+    assert len(broker.get("*/5")) == 8
+    assert broker.get("shard3/5").value == 95
+    assert broker.get("shard3/5").sequence == 10
+
+    # Keys starting with a wildcard are found from any shard
+    broker.put("*/5", "wild")
+    assert len(broker.get("shard3/**")) == 11
+    assert len(broker.get("*/5")) == 9
+
+    broker.put_many({"shard0/0": -1, "shard1/0": -1})
+    assert (
+        sorted(sample.value for sample in broker.get("shard$*/0"))
+        == [-1, -1] + [90] * 6
+    )
+
+    broker.set_history("**", 3)
+    for value in range(3):
+        broker.put("shard0/history", value)
+        broker.put("shard1/history", value)
+    assert [sample.value for sample in broker.get_history("*/history")] == [
+        0,
+        0,
+        1,
+        1,
+        2,
+        2,
+    ]
+
+    with pytest.raises(ValueError):
+        skarv.Broker(shards=0)
+
+
+def test_registration_handles():
+    mock, trigger_mock = MagicMock(), MagicMock()
+
+    subscription = skarv.subscribe("handle/*", "other")
+    assert subscription(mock) is mock
+    skarv.subscribe("handle/**")(MagicMock())
+    middleware = skarv.register_middleware("handle/*", lambda value: value * 2)
+
+    with skarv.trigger("handle/**") as trigger:
+        trigger(trigger_mock)
+        skarv.put("handle/a", 1)
+        skarv.put("other", 1)
+
+    assert mock.call_count == 2
+    assert mock.call_args_list[0].args[0].value == 2
+    assert trigger_mock.call_count == 1
+    skarv.put("unrelated", 1)
+    info = skarv.match_cache_info()["subscribers"]
+
+    subscription.close()
+    subscription.close()
+    middleware.close()
+    skarv.put("handle/a", 1)
+    skarv.put("other", 1)
+    skarv.put("unrelated", 1)
+
+    assert mock.call_count == 2
+    assert trigger_mock.call_count == 1
+    assert skarv.get("handle/a").value == 1
+    assert len(skarv._default._subscribers) == 1
+
+    # Only the cached matches of the removed key expressions were dropped
+    assert skarv.match_cache_info()["subscribers"].misses == info.misses + 2
+
+    with pytest.raises(RuntimeError):
+        subscription(mock)
+
+
+def test_registration_handles_share_records():
+    mock = MagicMock()
+
+    first = skarv.subscribe("shared")
+    first(mock)
+    second = skarv.subscribe("shared")
+    second(mock)
+
+    # Equal records are delivered once, and stay until every handle is closed
+    skarv.put("shared", 1)
+    assert mock.call_count == 1
+
+    first.close()
+    skarv.put("shared", 2)
+    assert mock.call_count == 2
+
+    second.close()
+    skarv.put("shared", 3)
+    assert mock.call_count == 2
+
+
+def test_registration_close_during_registration():
+    adding, closed = threading.Event(), threading.Event()
+
+    class SlowIndex(KeyExprIndex):
+        def add(self, item):
+            adding.set()
+            closed.wait(0.2)
+            super().add(item)
+
+    index = SlowIndex()
+    registration = Registration(
+        index, lambda callback: [Subscriber(KeyExpr("slow"), callback)]
+    )
+
+    def close():
+        adding.wait(2)
+        registration.close()
+        closed.set()
+
+    closer = threading.Thread(target=close)
+    closer.start()
+    registration(print)
+    closer.join()
+
+    # A registration racing with `close` does not outlive it
+    assert len(index) == 0
+    with pytest.raises(RuntimeError):
+        registration(print)
+
+
+def test_subscribers_on_the_thread_pool_do_not_deadlock():
+    received = []
+    done = threading.Event()
+    count = 40
+
+    @skarv.subscribe("chained/b", executor="thread", queue_size=1)
+    def _(sample):
+        received.append(sample.value)
+        if len(received) == 2 * count:
+            done.set()
+
+    # More subscribers than pool workers, all putting into the full queue of another
+    for _ in range(count):
+        skarv.subscribe("chained/a", executor="thread")(
+            lambda sample: [skarv.put("chained/b", i) for i in range(2)]
+        )
+
+    skarv.put("chained/a", 1)
+    assert done.wait(10)
+
+
+def test_middleware_order():
+    skarv.register_middleware("ordered/**", lambda value: value + ["wide"])
+    skarv.register_middleware("ordered/key", lambda value: value + ["exact"])
+    skarv.register_middleware("ordered/*", lambda value: value + ["first"], priority=1)
+
+    skarv.put("ordered/key", [])
+    assert skarv.get("ordered/key").value == ["first", "wide", "exact"]
+
+    # The pipeline is rebuilt when the matching middlewares change
+    skarv.register_middleware("ordered/key", lambda value: None, priority=2).close()
+    skarv.register_middleware("ordered/key", lambda value: value + ["last"], -1)
+    skarv.put("ordered/key", [])
+    assert skarv.get("ordered/key").value == ["first", "wide", "exact", "last"]
+
+
+def _write_value(path, sample: skarv.Sample):
+    # Runs in a worker process
+    with open(path, "a") as file:
+        file.write(f"{sample.key_expr} {len(sample.value)}\n")
+
+
+def test_process_middleware():
+    received = []
+    skarv.register_middleware("cpu/*", bytes.upper, executor="process")
+    skarv.register_middleware("cpu/*", lambda value: value[:3], priority=-1)
+    skarv.subscribe("cpu/*")(received.append)
+
+    # Large values pass through shared memory, small ones are pickled
+    skarv.put("cpu/large", b"a" * 100_000)
+    for value in (b"b", b"c", b"d"):
+        skarv.put("cpu/small", value)
+
+    deadline = time.time() + 30
+    while len(received) < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert [sample.value for sample in received] == [b"AAA", b"B", b"C", b"D"]
+    assert skarv.get("cpu/small").sequence == 3
+
+    with pytest.raises(ValueError):
+        skarv.register_middleware("cpu/*", bytes.upper, executor="thread")
+
+
+def test_process_subscriber(tmp_path):
+    path = tmp_path / "received.txt"
+    skarv.subscribe("cpu/*", executor="process")(functools.partial(_write_value, path))
+
+    skarv.put("cpu/large", b"a" * 100_000)
+    skarv.put("cpu/small", b"b")
+
+    deadline = time.time() + 30
+    while (not path.exists() or len(path.read_text().splitlines()) < 2) and (
+        time.time() < deadline
+    ):
+        time.sleep(0.01)
+    assert sorted(path.read_text().splitlines()) == ["cpu/large 100000", "cpu/small 1"]
+
+    async def _(sample: skarv.Sample):
+        pass
+
+    with pytest.raises(ValueError):
+        skarv.subscribe("cpu/*", executor="process")(_)
@@ -0,0 +1,58 @@
+from array import array
+
+from skarv._history import RingBuffer
+
+
+def _entry(timestamp, value):
+    return (value, timestamp, timestamp, int(timestamp), None)
+
+
+def _values(entries):
+    return [entry[0] for entry in entries]
+
+
+def test_ring_buffer_wraps_around():
+    buffer = RingBuffer(3)
+    for value in range(5):
+        buffer.append(_entry(float(value), value))
+
+    assert len(buffer) == 3
+    assert list(buffer.entries()) == [
+        _entry(float(value), value) for value in (2, 3, 4)
+    ]
+    assert _values(buffer.entries(last_n=2)) == [3, 4]
+    assert _values(buffer.entries(since=2.5)) == [3, 4]
+    assert _values(buffer.entries(last_n=1, since=2.5)) == [4]
+    assert _values(buffer.entries(since=10)) == []
+
+    buffer.append((5, 5.0, 5.0, 5, 1.5))
+    assert list(buffer.entries(last_n=1)) == [(5, 5.0, 5.0, 5, 1.5)]
+
+
+def test_ring_buffer_storage():
+    floats = RingBuffer(2)
+    floats.append(_entry(0.0, 1.5))
+    assert isinstance(floats._values, array)
+
+    mixed = RingBuffer(3)
+    mixed.append(_entry(0.0, 1))
+    assert isinstance(mixed._values, array)
+    mixed.append(_entry(1.0, 2.5))
+    mixed.append(_entry(2.0, 2**70))
+    assert _values(mixed.entries()) == [1, 2.5, 2**70]
+    assert type(_values(mixed.entries())[0]) is int
+
+    objects = RingBuffer(2)
+    objects.append(_entry(0.0, "a"))
+    objects.append(_entry(1.0, "b"))
+    objects.append(_entry(2.0, "c"))
+    assert _values(objects.entries()) == ["b", "c"]
+
+
+def test_ring_buffer_resized():
+    buffer = RingBuffer(4)
+    for value in range(4):
+        buffer.append(_entry(float(value), value))
+
+    assert _values(buffer.resized(2).entries()) == [2, 3]
+    assert list(buffer.resized(8).entries()) == list(buffer.entries())
@@ -0,0 +1,188 @@
+import itertools
+from dataclasses import dataclass
+
+from zenoh import KeyExpr
+
+from skarv._index import KeyExprIndex, KeyTree
+
+
+@dataclass(frozen=True)
+class Entry:
+    key_expr: KeyExpr
+
+
+PATTERNS = [
+    "a",
+    "a/b",
+    "a/*",
+    "a/**",
+    "**",
+    "*/b",
+    "**/c",
+    "a/**/c",
+    "a/$*x/c",
+    "a/b$*",
+    "$*b/**",
+    "@v/*",
+    "a/@v",
+    "a/*/c/**",
+]
+
+KEYS = [
+    "a",
+    "b",
+    "a/b",
+    "a/b/c",
+    "a/bx/c",
+    "a/x/c",
+    "x/b",
+    "a/@v",
+    "@v/a",
+    "a/b/c/d/c",
+    "bb/q",
+]
+
+
+def test_index_matches_intersects():
+    index = KeyExprIndex()
+    entries = [Entry(KeyExpr.autocanonize(pattern)) for pattern in PATTERNS]
+    for entry in entries:
+        index.add(entry)
+
+    for key in KEYS:
+        ke = KeyExpr.autocanonize(key)
+        expected = [entry for entry in entries if entry.key_expr.intersects(ke)]
+        assert index.match(str(ke)) == expected, key
+
+
+def test_index_wildcard_lookup():
+    index = KeyExprIndex()
+    entries = [Entry(KeyExpr.autocanonize(pattern)) for pattern in PATTERNS]
+    for entry in entries:
+        index.add(entry)
+
+    ke = KeyExpr.autocanonize("a/*")
+    assert index.match(str(ke)) == [e for e in entries if e.key_expr.intersects(ke)]
+
+
+def test_index_incremental_invalidation():
+    index = KeyExprIndex()
+    index.add(Entry(KeyExpr("a/**")))
+
+    a_b = "a/b"
+    c_d = "c/d"
+    assert len(index.match(a_b)) == 1
+    assert index.match(c_d) == []
+
+    index.add(Entry(KeyExpr("a/*")))
+
+    # Only the cached entry affected by the new registration is recomputed
+    assert c_d in index._cache
+    assert a_b not in index._cache
+    assert len(index.match(a_b)) == 2
+
+
+def test_index_invalidation_matches_intersects():
+    index = KeyExprIndex()
+    entries = [Entry(KeyExpr.autocanonize(pattern)) for pattern in PATTERNS]
+    keys = [str(KeyExpr.autocanonize(key)) for key in KEYS + PATTERNS]
+
+    def check(registered):
+        for key in keys:
+            expected = [e for e in registered if e.key_expr.intersects(key)]
+            assert index.match(key) == expected, key
+
+    # Every key is cached before each change, the stale ones must all be dropped
+    for count, entry in enumerate(entries, 1):
+        check(entries[: count - 1])
+        index.add(entry)
+    check(entries)
+
+    for count, entry in enumerate(entries, 1):
+        index.remove(entry)
+        check(entries[count:])
+
+
+def test_index_remove():
+    index = KeyExprIndex()
+    entries = [Entry(KeyExpr.autocanonize(pattern)) for pattern in PATTERNS]
+    for entry in entries:
+        index.add(entry)
+
+    for entry in itertools.islice(entries, 0, None, 2):
+        index.remove(entry)
+    remaining = entries[1::2]
+
+    assert len(index) == len(remaining)
+    for key in KEYS:
+        ke = KeyExpr.autocanonize(key)
+        expected = [entry for entry in remaining if entry.key_expr.intersects(ke)]
+        assert index.match(str(ke)) == expected, key
+
+    for entry in remaining:
+        index.remove(entry)
+
+    assert index._root.is_empty()
+
+
+def test_key_tree_find_matches_intersects():
+    tree = KeyTree()
+    stored = [KeyExpr.autocanonize(key) for key in KEYS]
+    for ke in stored:
+        tree.insert(ke)
+
+    for pattern in PATTERNS + KEYS:
+        query = KeyExpr.autocanonize(pattern)
+        expected = {ke for ke in stored if query.intersects(ke)}
+        found = tree.find(query)
+        assert len(found) == len(set(found)), pattern
+        assert set(found) == expected, pattern
+
+
+def test_key_tree_discard():
+    tree = KeyTree()
+    for key in KEYS:
+        tree.insert(KeyExpr.autocanonize(key))
+
+    tree.discard(KeyExpr("a/b"))
+    assert KeyExpr("a/b") not in tree.find(KeyExpr("**"))
+    assert KeyExpr("a/b/c") in tree.find(KeyExpr("**"))
+
+    for key in KEYS:
+        tree.discard(KeyExpr.autocanonize(key))
+
+    assert not tree._root.children
+
+
+def test_index_cache_bound_and_stats():
+    index = KeyExprIndex(maxsize=2)
+    index.add(Entry(KeyExpr("a/**")))
+
+    # Hits do not refresh entries, the oldest one is evicted first
+    for key in ["a/1", "a/2", "a/1", "a/3", "a/2"]:
+        index.match(key)
+
+    info = index.cache_info()
+    assert info.hits == 2
+    assert info.misses == 3
+    assert info.evictions == 1
+    assert info.maxsize == 2
+    assert info.currsize == 2
+    assert list(index._cache) == ["a/2", "a/3"]
+
+    index.cache_resize(1)
+    assert index.cache_info().currsize == 1
+    assert index.cache_info().evictions == 2
+
+
+def test_index_empty_and_compiled():
+    index = KeyExprIndex(compile=tuple)
+
+    # An empty index answers without caching
+    assert index.match("a/b") == ()
+    assert index.cache_info().currsize == 0
+
+    entry = Entry(KeyExpr("a/*"))
+    index.add(entry)
+    assert index.match("a/b") == (entry,)
+    assert index.match("a/b") is index.match("a/b")
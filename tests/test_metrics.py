@@ -0,0 +1,84 @@
+import skarv
+import skarv.metrics
+from skarv.metrics import Histogram
+
+
+def test_metrics_disabled_by_default():
+    skarv.put("metrics/thing", 1)
+
+    snapshot = skarv.metrics.snapshot()
+    assert snapshot["puts"] == {}
+    assert snapshot["callbacks"] == {}
+
+
+def test_metrics_snapshot():
+    skarv.metrics.enable()
+
+    def drop_odd(value):
+        return value if value % 2 == 0 else None
+
+    def on_sample(sample):
+        pass
+
+    skarv.register_middleware("metrics/*", drop_odd)
+    skarv.subscribe("metrics/*")(on_sample)
+
+    for value in range(10):
+        skarv.put("metrics/thing", value)
+    skarv.put_many({"metrics/other": 2})
+
+    snapshot = skarv.metrics.snapshot()
+    assert snapshot["puts"]["metrics/thing"]["count"] == 10
+    assert snapshot["puts"]["metrics/thing"]["rate"] > 0
+    assert snapshot["puts"]["metrics/other"]["count"] == 1
+    assert snapshot["dropped"]["metrics/thing"] == {
+        f"{__name__}.test_metrics_snapshot.<locals>.drop_odd": 5
+    }
+
+    middleware = snapshot["middlewares"][
+        f"{__name__}.test_metrics_snapshot.<locals>.drop_odd"
+    ]
+    assert middleware["count"] == 11
+    assert middleware["buckets"][float("inf")] == 11
+
+    callback = snapshot["callbacks"][
+        f"{__name__}.test_metrics_snapshot.<locals>.on_sample"
+    ]
+    assert callback["count"] == 6
+    assert snapshot["gauges"]["vault_keys"] == 2
+
+
+def test_metrics_prometheus():
+    skarv.metrics.enable()
+    skarv.subscribe("metrics/*")(lambda sample: None)
+    skarv.put("metrics/thing", 1)
+
+    text = skarv.metrics.to_prometheus()
+
+    assert 'skarv_puts_total{key_expr="metrics/thing"} 1' in text
+    assert "# TYPE skarv_callback_duration_seconds histogram" in text
+    assert 'le="+Inf"} 1' in text
+    assert "skarv_vault_keys 1" in text
+
+
+def test_histogram():
+    histogram = Histogram(bounds=(0.1, 1.0))
+    for seconds in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(seconds)
+
+    assert histogram.to_dict() == {
+        "buckets": {0.1: 2, 1.0: 3, float("inf"): 4},
+        "sum": 2.65,
+        "count": 4,
+    }
+
+
+def test_callback_name():
+    def on_sample(sample):
+        pass
+
+    dispatched = skarv._dispatch.Dispatcher(on_sample)
+    assert skarv.metrics.callback_name(dispatched) == skarv.metrics.callback_name(
+        on_sample
+    )
+    assert skarv.metrics.callback_name(on_sample).endswith("<locals>.on_sample")
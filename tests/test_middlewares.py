@@ -1,6 +1,23 @@
 import time
+import random
+import threading
+import statistics
 import skarv
-from skarv.middlewares import throttle, average, weighted_average, differentiate, batch
+from skarv.middlewares import (
+    throttle,
+    average,
+    weighted_average,
+    variance,
+    standard_deviation,
+    exponential_moving_average,
+    rolling_min,
+    rolling_max,
+    median,
+    time_average,
+    tumbling_average,
+    differentiate,
+    batch,
+)
 
 import pytest
 
@@ -41,6 +58,51 @@ def test_weighted_average_middleware():
     assert weighted_averager(6) == pytest.approx(6 * 3 / 6 + 4 * 2 / 6 + 2 * 1 / 6)
 
 
+def test_window_middlewares_match_recomputation():
+    rng = random.Random(0)
+    values = [rng.uniform(-1e6, 1e6) for _ in range(500)]
+    size = 7
+
+    operators = {
+        average: lambda window: sum(window) / len(window),
+        weighted_average: lambda window: sum(
+            (ix + 1) * value for ix, value in enumerate(window)
+        )
+        / (len(window) * (len(window) + 1) / 2),
+        variance: statistics.pvariance,
+        standard_deviation: statistics.pstdev,
+        rolling_min: min,
+        rolling_max: max,
+        median: statistics.median,
+    }
+
+    for factory, expected in operators.items():
+        operator = factory(size)
+        for ix in range(len(values)):
+            window = values[max(ix + 1 - size, 0) : ix + 1]
+            assert operator(values[ix]) == pytest.approx(
+                expected(window), rel=1e-6, abs=1e-3
+            ), factory.__name__
+
+
+def test_rolling_extremes_with_ties():
+    minimum, maximum = rolling_min(3), rolling_max(3)
+
+    assert [minimum(value) for value in (3, 1, 1, 2, 5, 5, 5)] == [3, 1, 1, 1, 1, 2, 5]
+    assert [maximum(value) for value in (3, 1, 1, 2, 5, 5, 0)] == [3, 3, 3, 2, 5, 5, 5]
+
+
+def test_exponential_moving_average_middleware():
+    ema = exponential_moving_average(0.5)
+
+    assert ema(2) == 2
+    assert ema(4) == 3
+    assert ema(4) == 3.5
+
+    with pytest.raises(ValueError):
+        exponential_moving_average(0)
+
+
 def test_differentiate_middleware():
 
     differentiator = differentiate()
@@ -59,3 +121,103 @@ def test_batch_middleware():
     assert batcher(1) == (1, 1)
     assert batcher(2) == None
     assert batcher(3) == (2, 3)
+
+
+def _at(t, operator, value):
+    token = skarv._clock._put_time.set(t)
+    try:
+        return operator(value)
+    finally:
+        skarv._clock._put_time.reset(token)
+
+
+def test_time_average_middleware():
+    averager = time_average(1.0)
+
+    assert _at(0.0, averager, 2) == 2
+    assert _at(0.5, averager, 4) == 3
+    assert _at(1.2, averager, 6) == 5
+    assert _at(5.0, averager, 1) == 1
+
+
+def test_tumbling_average_without_timer():
+    averager = tumbling_average(1.0)
+
+    assert _at(0.0, averager, 2) is None
+    assert _at(0.5, averager, 4) is None
+    assert _at(1.5, averager, 6) == 3
+    assert _at(1.6, averager, 8) is None
+    assert _at(2.5, averager, 0) == 7
+
+
+def test_batch_max_latency_without_timer():
+    batcher = batch(3, max_latency=1.0)
+
+    assert _at(0.0, batcher, 1) is None
+    assert _at(0.5, batcher, 2) is None
+    assert _at(1.0, batcher, 3) == (1, 2)
+    assert _at(1.1, batcher, 4) is None
+    assert _at(1.2, batcher, 5) == (3, 4, 5)
+
+
+def test_batch_flushes_partial_batch_on_timer():
+    received = []
+    flushed = threading.Event()
+
+    skarv.register_middleware("slow/topic", batch(3, max_latency=0.05))
+    skarv.register_middleware("slow/topic", lambda values: len(values))
+
+    @skarv.subscribe("slow/topic")
+    def _(sample):
+        received.append(sample.value)
+        flushed.set()
+
+    skarv.put("slow/topic", "a")
+    skarv.put("slow/topic", "b")
+    assert not received
+
+    assert flushed.wait(2)
+    assert received == [2]
+    assert skarv.get("slow/topic").value == 2
+
+    # A batch completed by size does not get flushed again by its timer
+    for value in "cde":
+        skarv.put("slow/topic", value)
+    assert received == [2, 3]
+    time.sleep(0.2)
+    assert received == [2, 3]
+
+
+def test_batch_timer_flush_keeps_source_timestamp_and_metrics():
+    skarv.metrics.enable()
+    flushed = threading.Event()
+
+    def count(values):
+        return len(values)
+
+    skarv.register_middleware("timed/topic", batch(3, max_latency=0.05))
+    skarv.register_middleware("timed/topic", count)
+    skarv.subscribe("timed/topic")(lambda sample: flushed.set())
+
+    skarv.put("timed/topic", "a", source_timestamp=42.0)
+    assert flushed.wait(2)
+
+    sample = skarv.get("timed/topic")
+    assert sample.value == 1
+    assert sample.source_timestamp == 42.0
+
+    # The middlewares following the batch are timed when resumed
+    middlewares = skarv.metrics.snapshot()["middlewares"]
+    assert middlewares[f"{__name__}.{count.__qualname__}"]["count"] == 1
+
+
+def test_tumbling_average_flushes_on_timer():
+    done = threading.Event()
+    skarv.register_middleware("tumbling", tumbling_average(0.05))
+    skarv.subscribe("tumbling")(lambda sample: done.set())
+
+    skarv.put("tumbling", 1)
+    skarv.put("tumbling", 3)
+
+    assert done.wait(2)
+    assert skarv.get("tumbling").value == 2
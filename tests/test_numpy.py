@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+import skarv
+
+np = pytest.importorskip("numpy")
+
+from skarv.utilities.numpy import average, batch, differentiate, weighted_average
+
+
+def _frames(count, shape=(4, 3), seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.uniform(-1e3, 1e3, shape) for _ in range(count)]
+
+
+def test_batch_stacks_without_reusing_buffers():
+    batcher = batch(3)
+    frames = _frames(6)
+
+    assert batcher(frames[0]) is None
+    assert batcher(frames[1]) is None
+    first = batcher(frames[2])
+    assert first.shape == (3, 4, 3)
+    np.testing.assert_array_equal(first, np.stack(frames[:3]))
+
+    for frame in frames[3:5]:
+        assert batcher(frame) is None
+    second = batcher(frames[5])
+
+    # The first batch was not overwritten by the second one
+    np.testing.assert_array_equal(first, np.stack(frames[:3]))
+    np.testing.assert_array_equal(second, np.stack(frames[3:]))
+
+    assert batcher(frames[0]) is None
+    with pytest.raises(ValueError):
+        batcher(np.zeros(5))
+
+
+def test_averages_match_recomputation():
+    frames = _frames(50)
+    size = 7
+    averager, weighted_averager = average(size), weighted_average(size)
+
+    for ix, frame in enumerate(frames):
+        window = np.stack(frames[max(ix + 1 - size, 0) : ix + 1])
+        weights = np.arange(1, len(window) + 1)
+
+        np.testing.assert_allclose(averager(frame), window.mean(axis=0))
+        np.testing.assert_allclose(
+            weighted_averager(frame), np.average(window, axis=0, weights=weights)
+        )
+
+    with pytest.raises(ValueError):
+        averager(np.zeros(5))
+
+
+def test_averages_of_integer_arrays():
+    averager = average(2)
+
+    np.testing.assert_array_equal(averager(np.array([1, 2])), [1, 2])
+    np.testing.assert_array_equal(averager(np.array([2, 5])), [1.5, 3.5])
+
+
+def test_differentiate_arrays():
+    differentiator = differentiate()
+    value = np.array([1, 2], dtype=np.uint8)
+
+    assert differentiator(value) is None
+    np.testing.assert_array_equal(differentiator(value), [0, 0])
+
+    time.sleep(0.5)
+    derivative = differentiator(np.array([0, 4], dtype=np.uint8))
+    np.testing.assert_allclose(derivative, [-2, 4], rtol=0.1)
+
+
+def test_process_middleware_arrays():
+    received = []
+    skarv.register_middleware("frame", np.negative, executor="process")
+    skarv.subscribe("frame")(received.append)
+
+    frames = [np.full((128, 128), i, dtype=np.float64) for i in range(4)]
+    for frame in frames:
+        skarv.put("frame", frame)
+
+    deadline = time.time() + 30
+    while len(received) < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(received) == 4
+    for sample, frame in zip(received, frames):
+        np.testing.assert_array_equal(sample.value, -frame)
@@ -0,0 +1,50 @@
+from skarv._pipeline import Pipeline
+from skarv.broker import Middleware
+
+
+def test_pipeline_orders_by_priority_then_registration():
+    calls = []
+
+    def record(name):
+        def operator(value):
+            calls.append(name)
+            return value + [name]
+
+        return operator
+
+    pipeline = Pipeline(
+        [
+            Middleware("key", record("first")),
+            Middleware("key", record("urgent"), priority=10),
+            Middleware("key", record("second")),
+            Middleware("key", record("late"), priority=-1),
+        ]
+    )
+
+    assert len(pipeline) == 4
+    assert pipeline.run([]) == ["urgent", "first", "second", "late"]
+    assert calls == ["urgent", "first", "second", "late"]
+
+
+def test_pipeline_stops_at_dropped_value():
+    calls = []
+
+    def drop(value):
+        calls.append("drop")
+        return None
+
+    def never(value):
+        calls.append("never")
+        return value
+
+    pipeline = Pipeline([Middleware("key", drop), Middleware("key", never)])
+
+    assert pipeline.run(1) is None
+    assert calls == ["drop"]
+
+
+def test_empty_and_single_pipelines():
+    assert Pipeline([]).run(1) == 1
+
+    operator = lambda value: value * 2
+    assert Pipeline([Middleware("key", operator)]).run is operator
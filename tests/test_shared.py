@@ -0,0 +1,258 @@
+import os
+import sys
+import time
+import uuid
+import threading
+import subprocess
+import multiprocessing
+
+import pytest
+
+from skarv.shared import SharedVault
+
+
+@pytest.fixture
+def name():
+    name = f"test-{uuid.uuid4().hex[:8]}"
+    yield name
+    with SharedVault(name) as vault:
+        vault.unlink()
+
+
+def _put_values(name):
+    # Runs in another process
+    with SharedVault(name) as vault:
+        for i in range(30):
+            vault.put(f"sensor/{i % 3}", {"i": i})
+
+
+def test_put_get(name):
+    with SharedVault(name, slots=8) as writer, SharedVault(name) as reader:
+        assert reader.slots == 8
+        assert reader.get("sensor/a") is None
+
+        writer.put("sensor/a", {"value": 1}, source_timestamp=12.5)
+        writer.put("sensor/a", {"value": 2})
+        writer.put("sensor/b", [1, 2])
+
+        sample = reader.get("sensor/a")
+        assert str(sample.key_expr) == "sensor/a"
+        assert sample.value == {"value": 2}
+        assert sample.sequence == 2
+        assert sample.source_timestamp is None
+
+        samples = reader.get("sensor/*")
+        assert sorted(str(sample.key_expr) for sample in samples) == [
+            "sensor/a",
+            "sensor/b",
+        ]
+        assert reader.get("other/**") == []
+
+        # A claimed slot holds no value until written
+        writer._claim("sensor/c")
+        assert reader.get("sensor/c") is None
+        assert len(reader.get("**")) == 2
+
+
+def test_limits(name):
+    with SharedVault(name, slots=2, key_size=8, value_size=32) as vault:
+        with pytest.raises(ValueError):
+            vault.put("a", b"x" * 100)
+        with pytest.raises(ValueError):
+            vault.put("a/very/long/key", 1)
+        with pytest.raises(ValueError):
+            vault.put("a/*", 1)
+
+        vault.put("a", 1)
+        vault.put("b", 1)
+        with pytest.raises(RuntimeError):
+            vault.put("c", 1)
+
+        # Existing keys can still be written
+        vault.put("a", 2)
+        assert vault.get("a").value == 2
+
+
+def test_interrupted_write(name):
+    with SharedVault(name) as vault:
+        vault.put("key", 1)
+
+        # A writer died halfway through, leaving the sequence lock odd
+        offset = vault._offset(vault._find("key"))
+        vault._buffer[offset] += 1
+
+        # Readers do not wait for it forever
+        assert vault.get("key") is None
+        assert vault.get("**") == []
+
+        vault.put("key", 2)
+        assert vault.get("key").value == 2
+
+
+def test_subscribe_across_processes(name):
+    received = []
+    with SharedVault(name) as vault:
+        subscription = vault.subscribe("sensor/*")
+        subscription(received.append)
+
+        process = multiprocessing.get_context("spawn").Process(
+            target=_put_values, args=(name,)
+        )
+        process.start()
+        process.join(30)
+        assert process.exitcode == 0
+
+        # A subscriber behind reads the latest values, skipping intermediate ones
+        deadline = time.time() + 5
+        while time.time() < deadline and {
+            sample.value["i"] for sample in received[-3:]
+        } != {27, 28, 29}:
+            time.sleep(0.01)
+        for key in ("sensor/0", "sensor/1", "sensor/2"):
+            sequences = [s.sequence for s in received if str(s.key_expr) == key]
+            assert sequences == sorted(set(sequences))
+            assert sequences[-1] == 10
+        assert vault.get("sensor/0").value == {"i": 27}
+
+        subscription.close()
+        count = len(received)
+        vault.put("sensor/0", {"i": 30})
+        time.sleep(0.05)
+        assert len(received) == count
+
+
+def test_attach_from_independent_process(name):
+    with SharedVault(name) as vault:
+        vault.put("a/b", 1)
+
+        # An unrelated interpreter has its own resource tracker, which must not unlink
+        # the block when it exits
+        script = (
+            "import sys; from skarv.shared import SharedVault\n"
+            "with SharedVault(sys.argv[1]) as vault:\n"
+            "    assert vault.get('a/b').value == 1\n"
+            "    vault.put('a/c', 2)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script, name],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stderr == ""
+
+        with SharedVault(name) as other:
+            assert other.get("a/b").value == 1
+            assert other.get("a/c").value == 2
+            vault.put("a/b", 3)
+            assert other.get("a/b").value == 3
+
+
+def test_close_behind_a_slow_subscriber(name):
+    vault = SharedVault(name)
+    release = threading.Event()
+    calls = []
+
+    @vault.subscribe("key")
+    def _(sample):
+        calls.append(sample.value)
+        release.wait(5)
+
+    # Fill the queue of notifications of the listening thread
+    for i in range(1000):
+        vault.put(f"key/{i % 10}" if i % 2 else "key", i)
+    assert _wait(lambda: calls)
+
+    closer = threading.Thread(target=vault.close, daemon=True)
+    closer.start()
+    time.sleep(0.1)
+    release.set()
+    closer.join(3)
+    assert not closer.is_alive()
+
+
+def test_close_during_a_stuck_subscriber(name):
+    vault = SharedVault(name)
+    release = threading.Event()
+    called = threading.Event()
+
+    @vault.subscribe("key")
+    def _(sample):
+        called.set()
+        release.wait(5)
+
+    vault.put("key", 1)
+    assert called.wait(2)
+
+    # Closing gives up waiting for the subscriber
+    start = time.monotonic()
+    vault.close()
+    assert time.monotonic() - start < 3
+    thread = next(t for t in threading.enumerate() if t.name == f"skarv-shared-{name}")
+
+    # The listening thread ends once the subscriber returns
+    release.set()
+    thread.join(2)
+    assert not thread.is_alive()
+
+
+def _wait(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_instances_of_one_process_share_locks(name):
+    with SharedVault(name) as first, SharedVault(name) as second:
+        first.put("key", 1)
+        index = first._find("key")
+
+        # A slot locked through one instance is locked for the others
+        with first._locks.slot(index):
+            assert not second._locks.slot(index).acquire(blocking=False)
+
+        # Closing an instance keeps the record locks of the others
+        third = SharedVault(name)
+        script = (
+            "import sys, fcntl\n"
+            "with open(sys.argv[1], 'r+') as file:\n"
+            "    fcntl.lockf(file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, int(sys.argv[2]))\n"
+        )
+        with second._locks.slot(index):
+            third.close()
+            result = subprocess.run(
+                [sys.executable, "-c", script, first._locks.path, str(index)],
+                capture_output=True,
+                timeout=60,
+            )
+            assert result.returncode != 0
+
+        writers = [
+            threading.Thread(
+                target=lambda vault: [vault.put("count", i) for i in range(200)],
+                args=(vault,),
+            )
+            for vault in (first, second)
+        ]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        assert first.get("count").sequence == 400
+
+
+def test_notify_receivers_added_within_a_timestamp_tick(name):
+    with SharedVault(name) as writer, SharedVault(name) as reader:
+        writer.put("key", 1)
+
+        received = []
+        reader.subscribe("key")(received.append)
+
+        # On a filesystem with coarse timestamps, the directory keeps its time
+        writer._receivers_version = os.stat(writer._directory).st_mtime_ns
+
+        writer.put("key", 2)
+        assert _wait(lambda: received)
+        assert received[0].value == 2
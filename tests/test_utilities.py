@@ -1,7 +1,16 @@
 import time
 import skarv
+import zenoh
+import pytest
+from skarv.concurrency import Job
 from skarv.utilities import call_every
-from skarv.utilities.zenoh import mirror
+from skarv.utilities.zenoh import (
+    _key_mapping,
+    as_array,
+    mirror,
+    publish,
+    replace_prefix,
+)
 from unittest.mock import MagicMock, Mock
 
 
@@ -14,8 +23,8 @@ def test_call_every():
         nonlocal count
         count += 1
 
-    # Sleep for 1 second
-    time.sleep(1)
+    # Sleep for just under 1 second, the schedule does not drift
+    time.sleep(0.95)
 
     # It should have 10 invocations at 0.0, 0.1 ... 0.9 seconds
     assert count == 10
@@ -30,8 +39,8 @@ def test_call_every_wait_first():
         nonlocal count
         count += 1
 
-    # Sleep for 1 second
-    time.sleep(1)
+    # Sleep for just under 1 second, the schedule does not drift
+    time.sleep(0.95)
 
     # It should have 9 invocations at 0.1, 0.2 ... 0.9 seconds
     assert count == 9
@@ -112,3 +121,265 @@ def test_mirror_no_overwrite():
     result = skarv.get("skarv/test_no_overwrite")
     assert result is not None
     assert result.value == b"existing_value"
+
+
+def _mirror_callback(decoder, key):
+    mock_session = Mock()
+    mock_session.get = Mock(return_value=[])
+    mirror(mock_session, f"zenoh/{key}", f"skarv/{key}", decoder=decoder)
+    return mock_session.declare_subscriber.call_args[0][1]
+
+
+def test_mirror_decoders():
+    payload = zenoh.ZBytes(b'{"speed": 4}')
+
+    for decoder, expected in [
+        ("bytes", b'{"speed": 4}'),
+        ("str", '{"speed": 4}'),
+        ("json", {"speed": 4}),
+        (len, 12),
+    ]:
+        key = f"test_decoder_{getattr(decoder, '__name__', decoder)}"
+        _mirror_callback(decoder, key)(Mock(payload=payload))
+        assert skarv.get(f"skarv/{key}").value == expected
+
+    callback = _mirror_callback("memoryview", "test_decoder_view")
+    callback(Mock(payload=payload))
+    view = skarv.get("skarv/test_decoder_view").value
+    assert isinstance(view, memoryview) and view.readonly
+    assert view[1:7] == b'"speed'
+
+    with pytest.raises(ValueError):
+        _mirror_callback("yaml", "test_decoder_unknown")
+
+
+def test_mirror_decodes_without_copying_buffers():
+    np = pytest.importorskip("numpy")
+
+    frame = bytearray(np.arange(6, dtype=np.float32).tobytes())
+    _mirror_callback(as_array(np.float32, (2, 3)), "test_decoder_array")(
+        Mock(payload=frame)
+    )
+
+    array = skarv.get("skarv/test_decoder_array").value
+    assert array.shape == (2, 3)
+    assert not array.flags.writeable
+
+    # The array is a view on the received buffer
+    frame[:4] = np.float32(42).tobytes()
+    assert array[0, 0] == 42
+
+
+def test_mirror_drops_undecodable_payloads():
+    callback = _mirror_callback("json", "test_decoder_invalid")
+    callback(Mock(payload=b"not json"))
+    assert skarv.get("skarv/test_decoder_invalid") is None
+
+
+@pytest.fixture
+def zenoh_session():
+    # A peer without scouting nor endpoints, reaching nothing but itself
+    config = zenoh.Config()
+    config.insert_json5("mode", '"peer"')
+    config.insert_json5("scouting/multicast/enabled", "false")
+    config.insert_json5("listen/endpoints", "[]")
+    config.insert_json5("connect/endpoints", "[]")
+    session = zenoh.open(config)
+    yield session
+    session.close()
+
+
+def _collect(session, key):
+    received = []
+    session.declare_subscriber(
+        key,
+        lambda sample: received.append(
+            (str(sample.key_expr), sample.payload.to_bytes())
+        ),
+    )
+    return received
+
+
+def _wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_publish_remaps_keys(zenoh_session):
+    received = _collect(zenoh_session, "fleet/**")
+
+    with publish(
+        zenoh_session,
+        "robot/**",
+        remap=replace_prefix("robot", "fleet/robot"),
+        encoder=str.encode,
+    ):
+        skarv.put("robot/speed", "1")
+        skarv.put("robot/arm/angle", "2")
+        assert _wait_for(lambda: len(received) == 2)
+
+    skarv.put("robot/speed", "3")
+    time.sleep(0.1)
+    assert received == [("fleet/robot/speed", b"1"), ("fleet/robot/arm/angle", b"2")]
+
+
+def test_publish_coalesces_per_interval(zenoh_session):
+    received = _collect(zenoh_session, "rate/**")
+
+    publication = publish(zenoh_session, "rate/**", encoder=str.encode, interval=0.1)
+    for value in range(100):
+        skarv.put("rate/a", str(value))
+        skarv.put("rate/b", str(-value))
+
+    assert _wait_for(lambda: len(received) == 2)
+    assert sorted(received) == [("rate/a", b"99"), ("rate/b", b"-99")]
+
+    # Closing flushes the pending values
+    skarv.put("rate/a", "last")
+    publication.close()
+    assert _wait_for(lambda: len(received) == 3)
+    assert received[-1] == ("rate/a", b"last")
+
+
+def test_bidirectional_bridge_does_not_loop(zenoh_session):
+    puts = []
+    skarv.subscribe("shared/value")(lambda sample: puts.append(sample.value))
+
+    mirror(zenoh_session, "shared/value", "shared/value", decoder="str")
+    publish(zenoh_session, "shared/value", encoder=str.encode)
+    received = _collect(zenoh_session, "shared/value")
+
+    # From skarv to Zenoh, without coming back through the mirror
+    skarv.put("shared/value", "local")
+    assert _wait_for(lambda: len(received) == 1)
+
+    # From Zenoh to skarv, without being published again
+    zenoh_session.put("shared/value", b"remote")
+    assert _wait_for(lambda: len(puts) == 2)
+
+    time.sleep(0.2)
+    assert puts == ["local", "remote"]
+    assert received == [("shared/value", b"local"), ("shared/value", b"remote")]
+
+
+def test_publish_values_derived_from_mirrored_ones(zenoh_session):
+    mirror(zenoh_session, "in/temp", "in/temp", decoder="str")
+    publish(zenoh_session, "**", encoder=str.encode)
+    received = _collect(zenoh_session, "derived/**")
+    echoed = _collect(zenoh_session, "in/**")
+
+    @skarv.subscribe("in/temp")
+    def _(sample):
+        skarv.put("derived/temp_f", str(float(sample.value) * 9 / 5 + 32))
+
+    zenoh_session.put("in/temp", b"100")
+    assert _wait_for(lambda: received == [("derived/temp_f", b"212.0")])
+
+    # The mirrored value itself is not published back
+    time.sleep(0.2)
+    assert echoed == [("in/temp", b"100")]
+
+
+def test_mirror_bulk_initial_sync(zenoh_session):
+    stored = {f"store/{robot}/speed": str(robot).encode() for robot in range(50)}
+    stored["store/root"] = b"root"
+
+    def _reply(query):
+        for key, payload in stored.items():
+            query.reply(key, payload)
+
+    queryable = zenoh_session.declare_queryable("store/**", _reply)
+
+    batches = []
+    skarv.subscribe("robots/**", batch=True)(batches.append)
+    skarv.put("robots/3/speed", "kept")
+
+    mirror(
+        zenoh_session,
+        "store/**",
+        "robots/**",
+        decoder="str",
+        timeout=2.0,
+        consolidation=zenoh.ConsolidationMode.NONE,
+    )
+
+    # Everything but the already present key arrived in a single batch
+    assert len(batches) == 2 and len(batches[1]) == 50
+    assert skarv.get("robots/7/speed").value == "7"
+    assert skarv.get("robots/3/speed").value == "kept"
+    assert skarv.get("robots/root").value == "root"
+
+    # Live samples are mapped the same way
+    zenoh_session.put("store/8/speed", b"fast")
+    assert _wait_for(lambda: skarv.get("robots/8/speed").value == "fast")
+    queryable.undeclare()
+
+
+def test_mirror_key_mapping():
+    assert _key_mapping("a/b", "c")("a/b") == "c"
+    assert _key_mapping("**", "robots/**")("1/speed") == "robots/1/speed"
+    assert _key_mapping("fleet/**", "**")("fleet/1/speed") == "1/speed"
+
+    # Chunks matched by wildcards of the prefix tell the keys apart
+    to_skarv_key = _key_mapping("fleet/*/status/**", "robots/**")
+    assert to_skarv_key("fleet/1/status/speed") == "robots/1/speed"
+    assert to_skarv_key("fleet/2/status/speed") == "robots/2/speed"
+    assert _key_mapping("fleet/r$*/**", "robots/**")("fleet/r1/speed") == (
+        "robots/r1/speed"
+    )
+
+
+def test_mirror_rejects_unmappable_keys():
+    with pytest.raises(ValueError):
+        mirror(Mock(), "store/**", "robots/*")
+    with pytest.raises(ValueError):
+        mirror(Mock(), "store/*", "robots/**")
+
+
+@pytest.mark.parametrize(
+    "missed, expected",
+    [("skip", 3), ("catch_up", 5), ("coalesce", 4)],
+)
+def test_call_every_missed_tick_policies(missed, expected):
+    calls = []
+
+    def slow():
+        calls.append(time.monotonic())
+        # The first call overruns two and a half intervals
+        if len(calls) == 1:
+            time.sleep(0.25)
+
+    with pytest.warns(UserWarning):
+        job = Job(slow, 0.1, missed=missed)
+        time.sleep(0.45)
+    job.cancel()
+
+    # Deadlines at 0.0, 0.1 ... 0.4: the first call ends at 0.25, so that the calls at
+    # 0.1 and 0.2 were missed
+    assert len(calls) == expected
+
+
+def test_job_cancel_and_reschedule():
+    calls = []
+
+    async def tick():
+        calls.append(time.monotonic())
+
+    job = Job(tick, 0.05)
+    time.sleep(0.12)
+    assert len(calls) == 3
+
+    job.reschedule(0.2)
+    time.sleep(0.1)
+    assert len(calls) == 3
+    time.sleep(0.15)
+    assert len(calls) == 4
+
+    job.cancel()
+    time.sleep(0.25)
+    assert len(calls) == 4
+
+    with pytest.raises(ValueError):
+        Job(tick, 0.1, missed="never")